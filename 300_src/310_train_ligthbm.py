@@ -9,27 +9,29 @@ import sys
 import traceback
 import datetime
 import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
 
-# 評価指標
-from sklearn.metrics import mean_squared_error  # RMSE用
-from sklearn.metrics import mean_squared_log_error  # RMSLE用
-
-# CV
-from sklearn.model_selection import KFold
-
-# アルゴリズム
-import lightgbm as lgbm
-
-# 可視化用
-import matplotlib.pyplot as plt
-import seaborn as sns
-
 # utilプログラム
+from util import backtest_util
+from util import cache_util
 from util import conv_util
+from util import feature_store
+from util import feature_util
 from util import file_util
+from util import join_util
+from util import model_util
+from util import preprocessing
+from util import profile_util
+from util import search_util
+from util import segment_util
+
+# 評価指標（RMSE・RMSLE用）・アルゴリズム（最初に使う時点で読み込む）
+metrics = conv_util.lazy_import('sklearn.metrics')
+lgbm = conv_util.lazy_import('lightgbm')
 
 # グローバル変数定義
 g_bt_ymd = ''
@@ -38,6 +40,35 @@ g_logger = None
 g_python_name = os.path.basename(__file__)
 g_list = [None] * conv_util.VAR_LIST_SIZE
 
+# LightGBMの基本のパラメーター（探索モードでは候補のパラメーターで上書きする）
+LGBM_PARAM = {
+    'num_leaves': 31,  # 葉の数
+    'min_data_in_leaf': 30,  # 葉の最小サンプル数
+    'objective': 'regression',  # regression, binary, multiclass,など
+    "metric": 'rmse',  # rmse, mape, binary_logloss, softmax
+    # 'num_class': 8,  # multiclass場合
+    'max_depth': -1,
+    'learning_rate': 0.1,
+    "min_child_samples": 100,
+    "boosting": "gbdt",  # gbdt, dartなど
+    "feature_fraction": 0.9,  # colsample_bytreeのこと
+    "bagging_freq": 1,
+    "bagging_fraction": 0.9,  # subsampleのこと [bagging_freq:1]とセット
+    "bagging_seed": 2020,
+    "lambda_l1": 0.1,
+    "lambda_l2": 0.1,
+    "nthread": -1,  # 並列処理のCPU数
+    "verbosity": -1,
+    "random_state": 2020
+}
+
+# 時系列CVの基準日の数
+N_FOLD = 4
+
+# fold並列時に子プロセスへ引き継ぐ学習データ（forkで共有する）
+# (binning済みのDataset, 特徴量の配列, ターゲットの配列)
+g_fold_data = None
+
 
 # ------------------------------------------------------------
 # ★★★★★★  メイン処理部分  ★★★★★★
@@ -53,14 +84,36 @@ def main():
         # ディレクトリのセット
         os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-        # 特徴量データの取得
-        df_train = get_feature_data()
+        # 特徴量データの取得（バックテストモードはtrainデータから作成する）
+        df_train = None if g_par.BACKTEST_MODE else get_feature_data()
+
+        # 探索モードの場合は、パラメーターを探索して順位表を出力する
+        if g_par.SEARCH_MODE:
+            search_lightgbm(df_train, time)
+
+        # バックテストモードの場合は、基準日ごとに学習・予測して精度を出力する
+        elif g_par.BACKTEST_MODE:
+            backtest_lightgbm(time)
+
+        else:
+            # LightGBMモデルを学習する
+            df_feature_importance = train_lightgbm(
+                df_train, time, g_par.FOLD_N_JOBS, g_par.SAVE_DATASET_BINARY)
+
+            # 特徴量の重要度を出力する（図はバックグラウンドで出力する場合がある）
+            plot_future = write_feature_importance(df_feature_importance, time)
+
+            # セグメント別モデルを学習する（全体モデルは行数の少ないセグメントで使う）
+            if g_par.SEGMENT_MODE:
+                segment_lightgbm(df_train, time)
 
-        # LightGBMモデルを学習する
-        df_feature_importance = train_lightgbm(df_train, time)
+            # 重要度の図の出力を待つ
+            if plot_future is not None:
+                g_logger.info('PLOT  : ' + plot_future.result())
 
-        # 特徴量の重要度を出力する
-        write_feature_importance(df_feature_importance, time)
+            # 学習が完了したモデルを予測で使うモデルとして記録する
+            model_util.write_latest_model(g_logger, time, rows=len(df_train),
+                                          segment_mode=g_par.SEGMENT_MODE)
 
     except Exception:
         # エラースタックを出力
@@ -81,8 +134,12 @@ def main():
 # ------------------------------------------------------------
 # ★★★★★★  処理  ★★★★★★
 # ------------------------------------------------------------
+@profile_util.profiled('get_feature_data')
 def get_feature_data():
     '''
+    特徴量ストア（320_make_features の出力）から学習データを取得する
+    - GISデータ・店マスタが設定されている場合は、店舗のキーで結合する
+      （結合結果は、特徴量・入力ファイルと結合仕様が前回と同じ場合はキャッシュを利用する）
 
     Parameters
     ----------
@@ -90,7 +147,8 @@ def get_feature_data():
 
     Returns
     ----------
-    df_train
+    df_train : DataFrame
+        キー・ターゲット・特徴量
 
     '''
     try:
@@ -98,26 +156,55 @@ def get_feature_data():
         g_logger.info('[get_feature_data]')
         g_logger.info('********************************************')
 
-        # 特徴量データを取得する
-        df_train = file_util.load_csv(g_logger, g_par.INPUT_NIPPAN_DATA)
-        print(df_train.shape)
-
-        # GISデータ
-        df_gis = file_util.load_csv(g_logger, g_par.INPUT_GIS_DATA)
-
-        # GISデータを結合
-        df_train = pd.merge(df_train, df_gis, on=['org_mise'])
-
-        # 店マスタ
-        df_mise = file_util.load_csv(g_logger, g_par.INPUT_MISE_MASTER)
-
-        # 店マスタデータを結合
-        df_train = pd.merge(df_train, df_mise, on=['org_mise'])
+        # 結合するデータ（未設定のものは結合しない）
+        join_data = {name: file_data for name, file_data in
+                     (('gis', g_par.INPUT_GIS_DATA), ('mise', g_par.INPUT_MISE_MASTER))
+                     if file_data}
+
+        # 特徴量ストアのファイル（差分追記されたファイルを含む）
+        manifest = feature_store.load_manifest().get(g_par.FEATURE_NAME)
+        if manifest is None:
+            raise FileNotFoundError('特徴量セットが存在しません : ' + g_par.FEATURE_NAME)
+        feature_files = [{'file_dir': feature_store.FEATURE_DIR, 'file_name': part}
+                         for part in manifest['parts']]
+
+        # キー・ターゲット・特徴量のカラムのみを読み込む（結合で付与するカラムは除く）
+        need_col = set(g_par.KEY_COL + [g_par.TARGET_COL] + g_par.FEATURE_COL)
+        join_how = 'inner'
+
+        # 入力ファイルと結合仕様（読み込むカラム・結合方法を含む）が
+        # 前回と同じ場合はキャッシュを利用する
+        if join_data:
+            join_spec = {'merge': [[name, g_par.JOIN_COL] for name in join_data],
+                         'dropna': g_par.JOIN_DROPNA_COL,
+                         'columns': sorted(need_col),
+                         'how': join_how}
+            cache_key = cache_util.get_cache_key(
+                feature_files + list(join_data.values()), join_spec)
+            df_train = cache_util.load_cache(g_logger, cache_key)
+            if df_train is not None:
+                return df_train
+
+        df_train = feature_store.load_feature(
+            g_logger, g_par.FEATURE_NAME,
+            usecols=[col for col in manifest['columns'] if col in need_col])
+        g_logger.info('SHAPE : ' + str(df_train.shape))
+        if not join_data:
+            return df_train
+
+        # GISデータ・店マスタを同時に取得し、店舗のキーの整数コードで1度に付与する
+        df_dict = file_util.load_files(g_logger, join_data)
+        df_train = join_util.enrich(g_logger, df_train, {
+            name: {'df': df_dict[name], 'on': g_par.JOIN_COL} for name in join_data},
+            how=join_how)
 
         # 足りないデータをdrop★ここは暫定でお願いします
-        df_train.dropna(subset=['inhabitants', 'employees'], inplace=True)
-        print(df_train.shape)
-        print(df_train.head(10))
+        df_train.dropna(subset=g_par.JOIN_DROPNA_COL, inplace=True)
+        g_logger.info('SHAPE : ' + str(df_train.shape))
+        g_logger.debug(df_train.head(10))
+
+        # 結合結果をキャッシュに出力する
+        cache_util.write_cache(g_logger, df_train, cache_key)
 
         return df_train
 
@@ -126,17 +213,34 @@ def get_feature_data():
         raise
 
 
-def train_lightgbm(df_train, time):
+@profile_util.profiled('train_lightgbm', rows_arg='df_train')
+def train_lightgbm(df_train, time, n_jobs=1, save_binary=False):
     '''
+    時系列CV（基準日ごとの学習・検証）でLightGBMモデルを学習する
+    - 全データでbinning済みのDatasetを1度だけ作成し、各foldは
+      その行番号のsubsetとして作成する（bin mapperを共有する）
+    - n_jobs > 1 の場合、foldをプロセスプールで同時に学習し、
+      CPUコア数をfold間で分割する（例：4fold × コア数/4スレッド）
 
     Parameters
     ----------
+    df_train : DataFrame
+        学習データ
+    time : str
+        実行時間（モデルの出力先ディレクトリ名）
+    n_jobs : int
+        同時に学習するfold数
+    save_binary : boolean
+        binning済みのDatasetをLightGBMのバイナリ形式で出力するかの指定
 
     Returns
     ----------
-    None
+    df_feature_importance : DataFrame
+        foldごとの特徴量の重要度
 
     '''
+    global g_fold_data
+
     try:
         g_logger.info('********************************************')
         g_logger.info('[train_lightgbm]')
@@ -145,38 +249,24 @@ def train_lightgbm(df_train, time):
         # ディレクトリの作成
         os.mkdir('../600_model/' + str(time))
 
-        # 特徴量とターゲットのカラムを抽出
-        target = df_train[g_par.TARGET_COL]
-        df_train = df_train[g_par.FEATURE_COL]
+        # 時系列クロスバリデーションをセットする（基準日より後の行で検証する）
+        # - 検証の行は基準日より後の実績を欠損にして作成した特徴量を追加する
+        df_fold, fold_idx, cutoffs = get_fold_data(df_train)
+        Fold = len(fold_idx)
+
+        # 特徴量とターゲットのカラムを抽出（foldごとのDataFrameのコピーは作らない）
+        x_train, target = get_train_array(df_fold, time)
+
+        # 検証の行（学習データの後ろに追加した行）の系列キー・日付・実績
+        df_oof = df_fold.iloc[len(df_train):][g_par.KEY_COL + [g_par.TARGET_COL]] \
+            .reset_index(drop=True)
+        del df_fold
 
         # パラメーターセット
-        param = {
-            'num_leaves': 31,  # 葉の数
-            'min_data_in_leaf': 30,  # 葉の最小サンプル数
-            'objective': 'regression',  # regression, binary, multiclass,など
-            "metric": 'rmse',  # rmse, mape, binary_logloss, softmax
-            # 'num_class': 8,  # multiclass場合
-            'max_depth': -1,
-            'learning_rate': 0.1,
-            "min_child_samples": 100,
-            "boosting": "gbdt",  # gbdt, dartなど
-            "feature_fraction": 0.9,  # colsample_bytreeのこと
-            "bagging_freq": 1,
-            "bagging_fraction": 0.9,  # subsampleのこと [bagging_freq:1]とセット
-            "bagging_seed": 2020,
-            "lambda_l1": 0.1,
-            "lambda_l2": 0.1,
-            "nthread": -1,  # 並列処理のCPU数
-            "verbosity": -1,
-            "random_state": 2020
-        }
-
-        # KFoldクロスバリデーションをセットする
-        Fold = 4
-        folds = KFold(n_splits=Fold, shuffle=True, random_state=2020)
+        param = dict(LGBM_PARAM)
 
         # 学習データのout of foldの結果格納用dfのセット
-        train_oof = np.zeros(len(df_train))
+        train_oof = np.zeros(len(x_train))
 
         # 特徴量の重要度格納用のdfをセット
         df_feature_importance = pd.DataFrame()
@@ -184,56 +274,51 @@ def train_lightgbm(df_train, time):
         # 学習の最大回数をセット(大きければだいたいOK)
         num_round = 10000
 
-        # KFoldで学習する
-        for fold_, (trn_idx, val_idx) in enumerate(
-                folds.split(df_train.values, target.values)):
+        # 全データでbinning済みのDatasetを作成する
+        train_set = build_train_set(x_train, target, param)
+        if save_binary:
+            train_set.save_binary('../600_model/' + str(time) + '/lightGBM_train.bin')
+
+        # 子プロセスへ引き継ぐ学習データをセット
+        g_fold_data = (train_set, x_train, target.values)
+
+        # foldごとに学習する（fold並列の場合はCPUコアをfold間で分割する）
+        n_jobs = max(1, min(n_jobs, Fold))
+        if n_jobs == 1:
+            results = [_train_fold(fold_, trn_idx, val_idx, param, num_round)
+                       for fold_, (trn_idx, val_idx) in enumerate(fold_idx)]
+        else:
+            param['nthread'] = max(1, multiprocessing.cpu_count() // n_jobs)
+            g_logger.info('fold並列：{}プロセス × {}スレッド'.format(
+                n_jobs, param['nthread']))
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = [executor.submit(_train_fold, fold_, trn_idx, val_idx,
+                                           param, num_round)
+                           for fold_, (trn_idx, val_idx) in enumerate(fold_idx)]
+                results = [future.result() for future in futures]
+
+        # foldの結果をfold順に集計する
+        for fold_, (trn_idx, val_idx) in enumerate(fold_idx):
+
+            model, preds_train, preds_train_oof = results[fold_]
 
             g_logger.info('====== [fold:{}] ======'.format(fold_ + 1))
 
-            # trainとvalデータの定義
-            train_data = lgbm.Dataset(df_train.iloc[trn_idx][g_par.FEATURE_COL],
-                                      label=target.iloc[trn_idx],
-                                      categorical_feature=g_par.CATEGORICAL_COL)
-            val_data = lgbm.Dataset(df_train.iloc[val_idx][g_par.FEATURE_COL],
-                                    label=target.iloc[val_idx],
-                                    categorical_feature=g_par.CATEGORICAL_COL)
-
-            # 学習処理の実行
-            model = lgbm.train(param,  # パラメーターセット
-                               train_data,  # trainデータ
-                               num_round,  # num_round数
-                               valid_sets=[train_data, val_data],  # バリデーション用データセット
-                               verbose_eval=20,  # 詳細を表示する間隔
-                               early_stopping_rounds=20  # early_stopping数
-                               )
-
-            # ===== [トレーニングデータの予測と精度検証] =====
-            # 予測処理[トレーニングデータ]
-            preds_train = model.predict(df_train.iloc[trn_idx][g_par.FEATURE_COL],  # トレーニングデータセット
-                                        num_iteration=model.best_iteration)  # early_stopping結果
-            # 日販0以下を0に置換する
-            preds_train = np.where(preds_train > 0, preds_train, 0)
-
             # trainデータの精度評価
             g_logger.info('====== [trainデータの精度評価] ======')
             g_logger.info('train RMSE:{:.3f}'.format(
-                np.sqrt(mean_squared_error(target.iloc[trn_idx], preds_train))))
+                np.sqrt(metrics.mean_squared_error(target.iloc[trn_idx], preds_train))))
             g_logger.info('train RMSLE:{:.3f}'.format(
-                np.sqrt(mean_squared_log_error(target.iloc[trn_idx], preds_train))))
-
-            # ===== [バリデーションデータの予測と精度検証] =====
-            # 予測処理[バリデーションデータ]
-            preds_train_oof = model.predict(df_train.iloc[val_idx][g_par.FEATURE_COL],
-                                            num_iteration=model.best_iteration)  # num_round数
-            # 日販0以下を0に置換する
-            preds_train_oof = np.where(preds_train_oof > 0, preds_train_oof, 0)
+                np.sqrt(metrics.mean_squared_log_error(target.iloc[trn_idx], preds_train))))
 
             # Validationデータの精度評価
             g_logger.info('====== [Validationデータの精度評価] ======')
             g_logger.info('Validation RMSE:{:.3f}'.format(
-                np.sqrt(mean_squared_error(target.iloc[val_idx], preds_train_oof))))
+                np.sqrt(metrics.mean_squared_error(target.iloc[val_idx], preds_train_oof))))
             g_logger.info('Validation RMSLE:{:.3f}'.format(
-                np.sqrt(mean_squared_log_error(target.iloc[val_idx], preds_train_oof))))
+                np.sqrt(metrics.mean_squared_log_error(target.iloc[val_idx], preds_train_oof))))
 
             # fold内の予測値を全体で精度検証するために退避する
             train_oof[val_idx] = preds_train_oof
@@ -252,11 +337,22 @@ def train_lightgbm(df_train, time):
             df_feature_importance = \
                 pd.concat([df_feature_importance, df_feature_importance_fold], axis=0)
 
+        # 検証期間に含まれた行のみで評価する（最初の基準日以前の行は検証しない）
+        is_oof = np.zeros(len(x_train), dtype=bool)
+        for _, val_idx in fold_idx:
+            is_oof[val_idx] = True
+
         g_logger.info('====== [oofデータ全体での精度評価] ======')
         g_logger.info('OOF RMSE:{:.3f}'.format(
-            np.sqrt(mean_squared_error(target, train_oof))))
+            np.sqrt(metrics.mean_squared_error(target[is_oof], train_oof[is_oof]))))
         g_logger.info('OOF RMSLE:{:.3f}'.format(
-            np.sqrt(mean_squared_log_error(target, train_oof))))
+            np.sqrt(metrics.mean_squared_log_error(target[is_oof], train_oof[is_oof]))))
+
+        # 検証の予測値を出力する（530_reconcile_forecast の wls_var の重みに使う）
+        df_oof.insert(0, 'cutoff', np.repeat(backtest_util.to_ymd(cutoffs),
+                                             [len(val_idx) for _, val_idx in fold_idx]))
+        df_oof['pred'] = train_oof[len(df_train):]
+        write_oof(df_oof, time)
 
         return df_feature_importance
 
@@ -264,19 +360,428 @@ def train_lightgbm(df_train, time):
         g_logger.error('train_lightgbm で例外が発生しました')
         raise
 
+    finally:
+        g_fold_data = None
+
+
+def _train_fold(fold_, trn_idx, val_idx, param, num_round):
+    '''
+    1fold分のLightGBMモデルを学習し、train/valデータを予測する
+    - fold並列時は子プロセスで実行されるため、学習データは
+      g_fold_data から参照する（forkで共有し、pickleで転送しない）
+    - train/valのDatasetはbinning済みDatasetのsubsetとして作成する
+
+    Parameters
+    ----------
+    fold_ : int
+        fold番号（0始まり）
+    trn_idx : ndarray
+        trainデータの行番号
+    val_idx : ndarray
+        valデータの行番号
+    param : dictionary
+        LightGBMのパラメーター
+    num_round : int
+        学習の最大回数
+
+    Returns
+    ----------
+    model : Booster
+        学習済みモデル
+    preds_train : ndarray
+        trainデータの予測値
+    preds_train_oof : ndarray
+        valデータの予測値
+
+    '''
+    train_set, x_train, _ = g_fold_data
+
+    # trainとvalデータの定義（bin mapperを共有する行のsubset）
+    train_data = train_set.subset(trn_idx)
+    val_data = train_set.subset(val_idx)
+
+    # 学習処理の実行（foldごとに計測する）
+    with profile_util.stage('train_fold', rows=len(trn_idx), fold=fold_ + 1):
+        model = lgbm.train(param,  # パラメーターセット
+                           train_data,  # trainデータ
+                           num_round,  # num_round数
+                           valid_sets=[train_data, val_data],  # バリデーション用データセット
+                           feature_name=g_par.FEATURE_COL,  # binning済みDatasetと同じ指定
+                           categorical_feature=g_par.CATEGORICAL_COL,
+                           verbose_eval=20,  # 詳細を表示する間隔
+                           early_stopping_rounds=20  # early_stopping数
+                           )
+
+    # ===== [トレーニング・バリデーションデータの予測] =====
+    # 学習・検証の行のみを1回で予測して振り分ける
+    with profile_util.stage('predict_fold', rows=len(trn_idx) + len(val_idx),
+                            fold=fold_ + 1):
+        rows = np.concatenate([trn_idx, val_idx])
+        preds = np.empty(len(x_train))
+        preds[rows] = model.predict(x_train[rows],  # 学習・検証データ
+                                    num_iteration=model.best_iteration)  # early_stopping結果
+
+    # 日販0以下を0に置換する
+    preds = np.where(preds > 0, preds, 0)
+    preds_train = preds[trn_idx]
+    preds_train_oof = preds[val_idx]
+
+    return model, preds_train, preds_train_oof
+
+
+def get_train_array(df_train, time):
+    '''
+    学習データから特徴量の配列とターゲットを抽出する
+    - 文字列・category型のカテゴリ変数は、学習したカテゴリの番号に変換し、
+      予測時に同じ番号で変換できるようにエンコーダを保存する
+
+    Parameters
+    ----------
+    df_train : DataFrame
+        学習データ
+    time : str
+        実行時間（モデルの出力先ディレクトリ名）
+
+    Returns
+    ----------
+    x_train : ndarray
+        特徴量の配列
+    target : Series
+        ターゲット
+
+    '''
+    encode_col = [col for col in g_par.CATEGORICAL_COL
+                  if not pd.api.types.is_numeric_dtype(df_train[col])]
+    df_feature = df_train[g_par.FEATURE_COL]
+    if encode_col:
+        encoder = preprocessing.CategoryEncoder('label', encode_col)
+        df_feature = encoder.fit_transform(df_feature)
+        encoder.save(g_logger, '../600_model/' + str(time) + '/')
+
+    return model_util.to_feature_array(df_feature), df_train[g_par.TARGET_COL]
+
+
+def get_fold_data(df_train):
+    '''
+    時系列CVの各foldの学習データと行番号を作成する
+    - 実績の最終日から予測期間ずつ遡った N_FOLD 個の基準日について、
+      基準日以前を学習、基準日の翌日から予測期間を検証とする
+      （シャッフルしたKFoldのように未来の行で学習しない）
+    - 検証の行は、基準日より後の実績を欠損にして作成した特徴量で、
+      学習データの後ろに追加する（バックテスト・本番の予測と同じ条件）
+
+    Parameters
+    ----------
+    df_train : DataFrame
+        学習データ（日付のカラムを含む）
+
+    Returns
+    ----------
+    df_fold : DataFrame
+        学習データの後ろにfoldごとの検証の行を追加したDataFrame
+    fold_idx : list
+        foldごとの (trainの行番号, valの行番号)
+    cutoffs : list
+        foldごとの基準日（経過日数）
+
+    '''
+    cutoffs = backtest_util.make_cutoffs(df_train[feature_util.DATE_COL], N_FOLD,
+                                         g_par.BACKTEST_HORIZON)
+
+    df_fold, fold_idx = backtest_util.build_fold_features(
+        g_logger, df_train, cutoffs,
+        horizon=g_par.BACKTEST_HORIZON,
+        window=g_par.BACKTEST_WINDOW,
+        target_col=g_par.TARGET_COL,
+        lags=g_par.FEATURE_LAGS,
+        windows=g_par.FEATURE_WINDOWS,
+        shift=g_par.FEATURE_SHIFT,
+        holidays=feature_util.load_holidays(g_logger, g_par.INPUT_HOLIDAY_DATA))
+
+    return df_fold, fold_idx, cutoffs
+
+
+def build_train_set(x_train, target, param, init_score=None):
+    '''
+    全データでbinning済みのDatasetを作成する
+    - 各foldはこのDatasetの行番号のsubsetとして作成する（bin mapperを共有する）
+
+    Parameters
+    ----------
+    x_train : ndarray
+        特徴量の配列
+    target : Series
+        ターゲット
+    param : dictionary
+        LightGBMのパラメーター
+    init_score : ndarray
+        行ごとの予測の初期値（残差を学習する場合）
+
+    Returns
+    ----------
+    train_set : Dataset
+        binning済みのDataset
+
+    '''
+    return lgbm.Dataset(x_train,
+                        label=target.values,
+                        init_score=init_score,
+                        feature_name=g_par.FEATURE_COL,
+                        categorical_feature=g_par.CATEGORICAL_COL,
+                        params=param,
+                        free_raw_data=False).construct()
+
+
+def search_lightgbm(df_train, time):
+    '''
+    LightGBMのパラメーターを探索し、順位表を出力する
+    - binning済みのDatasetは1度だけ作成し、探索の各プロセスで共有する
+    - 最良の候補より明らかに劣る候補は、最初のfoldの途中または
+      foldごとの評価値の平均で打ち切る
+
+    Parameters
+    ----------
+    df_train : DataFrame
+        学習データ
+    time : str
+        実行時間（順位表の出力先ディレクトリ名）
+
+    Returns
+    ----------
+    df_leaderboard : DataFrame
+        順位表
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[search_lightgbm]')
+        g_logger.info('********************************************')
+
+        # ディレクトリの作成
+        os.mkdir('../600_model/' + str(time))
+
+        # 特徴量とターゲットのカラムを抽出（学習と同じ時系列CVで評価する）
+        df_fold, fold_idx, _ = get_fold_data(df_train)
+        x_train, target = get_train_array(df_fold, time)
+        del df_fold
+
+        # パラメーターの候補（binningに関するパラメーターは探索しない）
+        trials = search_util.sample_params(g_par.SEARCH_SPACE, g_par.SEARCH_N_TRIALS,
+                                           prune_rounds=g_par.SEARCH_PRUNE_ROUNDS,
+                                           prune_scale_lr=g_par.SEARCH_PRUNE_SCALE_LR)
+
+        # 候補ごとに木の学習に関するパラメーターを変えられるよう、
+        # binning時の特徴量の事前除外を無効にしてDatasetを作成する
+        param = dict(LGBM_PARAM, feature_pre_filter=False)
+        train_set = build_train_set(x_train, target, param)
+
+        # 探索を実行する
+        results = search_util.run_search(g_logger, train_set, fold_idx, param, trials,
+                                         g_par.SEARCH_N_JOBS,
+                                         prune_rounds=g_par.SEARCH_PRUNE_ROUNDS,
+                                         prune_margin=g_par.SEARCH_PRUNE_MARGIN,
+                                         prune_scale_lr=g_par.SEARCH_PRUNE_SCALE_LR)
+
+        # 順位表を出力する
+        return search_util.write_leaderboard(g_logger, results,
+                                             '../600_model/' + str(time) + '/')
+
+    except:
+        g_logger.error('search_lightgbm で例外が発生しました')
+        raise
+
+
+def backtest_lightgbm(time):
+    '''
+    trainデータで時系列バックテストを実行し、精度を出力する
+    - 基準日ごとに、基準日までの実績で学習し、翌日から予測期間を予測する
+      （本番の 20200529 まで学習 → 6月を予測 と同じ条件）
+    - 特徴量は基準日の順に差分更新で作成し、基準日ごとに作り直さない
+    - 基準日・group_mise・group_item ごとの RMSE / RMSLE を出力する
 
+    Parameters
+    ----------
+    time : str
+        実行時間（結果の出力先ディレクトリ名）
+
+    Returns
+    ----------
+    metrics : dictionary
+        集計単位 → 精度のDataFrame
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[backtest_lightgbm]')
+        g_logger.info('********************************************')
+
+        # ディレクトリの作成
+        os.mkdir('../600_model/' + str(time))
+
+        # 実績データの取得
+        df_base = file_util.load_csv(g_logger, g_par.INPUT_TRAIN_DATA)
+        df_base[g_par.TARGET_COL] = df_base[g_par.TARGET_COL].astype(np.float64)
+
+        # 基準日の作成
+        cutoffs = backtest_util.make_cutoffs(
+            df_base[feature_util.DATE_COL], g_par.BACKTEST_N_CUTOFFS,
+            g_par.BACKTEST_HORIZON)
+
+        # 基準日ごとに学習・予測する（lightgbm は子プロセスの作成前に読み込む）
+        conv_util.load_module(lgbm)
+        df_result = backtest_util.run_backtest(
+            g_logger, df_base, cutoffs, fit_predict_cutoff,
+            horizon=g_par.BACKTEST_HORIZON,
+            window=g_par.BACKTEST_WINDOW,
+            n_jobs=g_par.BACKTEST_N_JOBS,
+            target_col=g_par.TARGET_COL,
+            lags=g_par.FEATURE_LAGS,
+            windows=g_par.FEATURE_WINDOWS,
+            shift=g_par.FEATURE_SHIFT,
+            holidays=feature_util.load_holidays(g_logger, g_par.INPUT_HOLIDAY_DATA))
+
+        # 精度を出力する
+        return backtest_util.write_backtest(g_logger, df_result,
+                                            '../600_model/' + str(time) + '/')
+
+    except:
+        g_logger.error('backtest_lightgbm で例外が発生しました')
+        raise
+
+
+def fit_predict_cutoff(df_train, df_forecast, nthread=-1):
+    '''
+    1つの基準日について学習し、予測期間を予測する
+    - 学習期間の最後の予測期間分を検証データとしてearly_stoppingに使う
+    - バックテストの並列時は子プロセスで実行される
+
+    Parameters
+    ----------
+    df_train : DataFrame
+        学習期間の特徴量
+    df_forecast : DataFrame
+        予測期間の特徴量
+    nthread : int
+        学習のスレッド数（並列時は CPUコア数 / 同時に学習する基準日の数）
+
+    Returns
+    ----------
+    preds : ndarray
+        予測期間の予測値
+
+    '''
+    # 文字列・category型のカテゴリ変数は学習期間のカテゴリの番号に変換する
+    encode_col = [col for col in g_par.CATEGORICAL_COL
+                  if not pd.api.types.is_numeric_dtype(df_train[col])]
+    encoder = preprocessing.CategoryEncoder('label', encode_col).fit(
+        df_train[g_par.FEATURE_COL])
+    x_train = model_util.to_feature_array(encoder.transform(df_train[g_par.FEATURE_COL]))
+    x_forecast = model_util.to_feature_array(
+        encoder.transform(df_forecast[g_par.FEATURE_COL]))
+    target = df_train[g_par.TARGET_COL]
+
+    # 学習期間の最後の予測期間分で検証する
+    dates = df_train[feature_util.DATE_COL]
+    cutoffs = backtest_util.make_cutoffs(dates, 1, g_par.BACKTEST_HORIZON)
+    (trn_idx, val_idx), = backtest_util.time_series_folds(
+        dates, cutoffs, g_par.BACKTEST_HORIZON)
+
+    param = dict(LGBM_PARAM, nthread=nthread)
+    train_set = build_train_set(x_train, target, param)
+    model = lgbm.train(param,
+                       train_set.subset(trn_idx),
+                       10000,
+                       valid_sets=[train_set.subset(val_idx)],
+                       feature_name=g_par.FEATURE_COL,
+                       categorical_feature=g_par.CATEGORICAL_COL,
+                       verbose_eval=False,
+                       early_stopping_rounds=20)
+
+    # 日販0以下を0に置換する
+    preds = model.predict(x_forecast, num_iteration=model.best_iteration)
+
+    return np.where(preds > 0, preds, 0)
+
+
+def segment_lightgbm(df_train, time):
+    '''
+    セグメント（店舗・商品・店舗×商品）ごとのLightGBMモデルを学習する
+    - separate : セグメントのデータのみで学習する
+    - residual : 学習済みの全体モデルの予測値を初期値とし、残差を学習する
+    - 行数が g_par.SEGMENT_MIN_ROWS 未満のセグメントは全体モデルで予測する
+    - g_par.SEGMENT_BASE_TIME の学習結果と学習データが同じセグメントは再学習しない
+
+    Parameters
+    ----------
+    df_train : DataFrame
+        学習データ
+    time : str
+        実行時間（全体モデルの出力先ディレクトリ名）
+
+    Returns
+    ----------
+    manifest : dictionary
+        セグメント別モデルの一覧
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[segment_lightgbm]')
+        g_logger.info('********************************************')
+
+        model_dir = '../600_model/' + str(time) + '/'
+
+        # 特徴量とターゲットのカラムを抽出
+        x_train, target = get_train_array(df_train, time)
+
+        # residualの場合は全体モデルの予測値を初期値にする
+        init_score = None
+        if g_par.SEGMENT_MODE == 'residual':
+            init_score = model_util.predict_folds(
+                model_util.load_fold_models(g_logger, model_dir), x_train)
+
+        train_set = build_train_set(x_train, target, LGBM_PARAM, init_score)
+
+        # 前回の学習結果
+        base_dir = None
+        if g_par.SEGMENT_BASE_TIME:
+            base_dir = '../600_model/' + str(g_par.SEGMENT_BASE_TIME) + '/'
+
+        by = segment_util.SEGMENT_BY[g_par.SEGMENT_LEVEL]
+        return segment_util.train_segments(
+            g_logger, train_set, df_train[by], df_train[feature_util.DATE_COL],
+            model_dir, LGBM_PARAM,
+            mode=g_par.SEGMENT_MODE,
+            by=by,
+            min_rows=g_par.SEGMENT_MIN_ROWS,
+            n_jobs=g_par.SEGMENT_N_JOBS,
+            horizon=g_par.BACKTEST_HORIZON,
+            base_dir=base_dir)
+
+    except:
+        g_logger.error('segment_lightgbm で例外が発生しました')
+        raise
+
+
+@profile_util.profiled('write_feature_importance')
 def write_feature_importance(df_feature_importance, time):
     '''
-    特徴量の重要度を
+    特徴量の重要度をfoldの平均・標準偏差に集計し、表形式で出力する
+    - 形式は g_par.IMPORTANCE_FORMAT（csv / parquet）
+    - g_par.IMPORTANCE_PLOT がTrueの場合のみ、上位の特徴量の図（png）も出力する
+      （g_par.IMPORTANCE_PLOT_BACKGROUND がTrueの場合は子プロセスで出力する）
 
     Parameters
     ----------
     df_feature_importance : DataFrame
-        [特徴量の重要度]
+        foldごとの特徴量の重要度
+    time : str
+        実行時間（出力先のディレクトリ名）
 
     Returns
     ----------
-    None
+    plot_future : Future
+        バックグラウンドで図を出力する場合はそのFuture、それ以外はNone
 
     '''
     try:
@@ -284,29 +789,64 @@ def write_feature_importance(df_feature_importance, time):
         g_logger.info('[write_feature_importance]')
         g_logger.info('********************************************')
 
-        # 特徴量重要度からTOP50個を集計する
-        cols = (df_feature_importance[['feature', 'importance']]
-                .groupby(['feature'])
-                .mean()
-                .sort_values(by='importance', ascending=False)[:50].index)
+        model_dir = '../600_model/' + str(time) + '/'
 
-        # 特徴量の重要度からTOP50を抽出する
-        df_best_features = df_feature_importance.loc[
-            df_feature_importance['feature'].isin(cols)]
+        # foldの平均・標準偏差に集計して出力する
+        df_importance = model_util.summarize_importance(df_feature_importance)
+        model_util.write_importance(g_logger, df_importance, model_dir,
+                                    g_par.IMPORTANCE_FORMAT)
+        g_logger.debug(df_importance.head(10))
 
-        # feature_importanceの出力
-        plt.figure(figsize=(14, 30))
-        sns.barplot(x='importance', y='feature',
-                    data=df_best_features.sort_values(by='importance', ascending=False))
-        plt.title('LightGBM Features (avg over folds)')
-        plt.tight_layout()
-        plt.savefig('../600_model/' + str(time) + '/lgbm_importances.png')
+        if not g_par.IMPORTANCE_PLOT:
+            return None
+
+        # 上位の特徴量の図を出力する
+        plot_path = model_dir + 'lgbm_importances.png'
+        if g_par.IMPORTANCE_PLOT_BACKGROUND:
+            return model_util.submit_plot_importance(df_importance, plot_path,
+                                                     g_par.IMPORTANCE_TOP_N)
+
+        model_util.plot_importance(df_importance, plot_path, g_par.IMPORTANCE_TOP_N)
+        g_logger.info('PLOT  : ' + plot_path)
+
+        return None
 
     except:
         g_logger.error('write_feature_importance で例外が発生しました')
         raise
 
 
+def write_oof(df_oof, time):
+    '''
+    時系列CVの検証の予測値と実績を出力する（oof_result.csv）
+    - 形式はバックテストの backtest_result.csv と同じ
+      （基準日・系列キー・日付・実績・予測値）
+
+    Parameters
+    ----------
+    df_oof : DataFrame
+        検証の行の基準日・系列キー・日付・実績・予測値
+    time : str
+        実行時間（出力先のディレクトリ名）
+
+    Returns
+    ----------
+    None
+
+    '''
+    try:
+
+        g_logger.info('[write_oof]')
+
+        path = '../600_model/' + str(time) + '/oof_result.csv'
+        df_oof.to_csv(path, index=False)
+        g_logger.info('PATH  : ' + path)
+
+    except:
+        g_logger.error('write_oof で例外が発生しました')
+        raise
+
+
 def save_lightgbm_model(model, fold, time):
     '''
     学習済みAIモデルを保存する
@@ -0,0 +1,343 @@
+''' coding: utf-8 '''
+# ------------------------------------------------------------
+# 処理名  ： 特徴量の作成
+# 処理概要： train/testデータからカレンダー特徴量と
+#            店舗×商品ごとのラグ・移動窓・累積統計量を作成し、
+#            特徴量ストアに出力する
+#            - 差分更新モードでは、前回の状態から新しい日付の行のみを作成する
+# ------------------------------------------------------------
+# ライブラリーのインポート
+import os
+import sys
+import traceback
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# utilプログラム
+from util import conv_util
+from util import feature_store
+from util import feature_util
+from util import file_util
+
+# グローバル変数定義
+g_bt_ymd = ''
+g_par = None
+g_logger = None
+g_python_name = os.path.basename(__file__)
+g_list = [None] * conv_util.VAR_LIST_SIZE
+
+
+# ------------------------------------------------------------
+# ★★★★★★  メイン処理部分  ★★★★★★
+# ------------------------------------------------------------
+def main():
+
+    # バッチ処理の記述
+    try:
+
+        # ディレクトリのセット
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+        # 学習・予測データの取得
+        df_train, df_test = get_base_data()
+
+        # 差分更新用の状態の格納先
+        state_path = feature_store.FEATURE_DIR + g_par.FEATURE_NAME + '_state.pkl'
+
+        # 前回の状態（ラグ・移動窓の設定が変わった場合は使わない）
+        state = read_state(state_path) \
+            if g_par.FEATURE_INCREMENTAL and os.path.exists(state_path) else None
+
+        if state is not None:
+            # 新しい日付の行のみ特徴量を作成し、追記する
+            update_features(df_train, df_test, state, state_path)
+        else:
+            # 全履歴から特徴量を作成する
+            make_features(df_train, df_test, state_path)
+
+    except Exception:
+        # エラースタックを出力
+        g_logger.error('========================================')
+        g_logger.exception(traceback.format_exc())
+        g_logger.error('異常終了 ENDED CODE=1')
+        sys.exit(1)
+
+    else:
+        g_logger.info('========================================')
+        g_logger.info('正常終了 ENDED CODE=0')
+        sys.exit(0)
+
+    finally:
+        conv_util.end_app(g_list)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  処理  ★★★★★★
+# ------------------------------------------------------------
+def get_base_data():
+    '''
+    trainデータとtestデータを取得する
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    ----------
+    df_train : DataFrame
+        trainデータ（実績）
+    df_test : DataFrame
+        testデータ（予測対象、targetは欠損）
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[get_base_data]')
+        g_logger.info('********************************************')
+
+        # trainデータ・testデータを同時に読み込む
+        df_dict = file_util.load_files(g_logger, {'train': g_par.INPUT_TRAIN_DATA,
+                                                  'test': g_par.INPUT_TEST_DATA})
+        df_train = df_dict['train']
+        df_test = df_dict['test']
+
+        # targetは欠損を含められるようにfloat64で揃える（testデータは欠損）
+        df_train['target'] = df_train['target'].astype(np.float64)
+        df_test['target'] = np.nan
+
+        return df_train, df_test
+
+    except:
+        g_logger.error('get_base_data で例外が発生しました')
+        raise
+
+
+def make_features(df_train, df_test, state_path):
+    '''
+    全履歴から特徴量を作成し、差分更新用の状態を出力する
+    - 実績分は g_par.FEATURE_NAME、予測対象分は '_forecast' 付きの名前で出力する
+
+    Parameters
+    ----------
+    df_train : DataFrame
+        trainデータ
+    df_test : DataFrame
+        testデータ
+    state_path : str
+        差分更新用の状態の出力先
+
+    Returns
+    ----------
+    None
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[make_features]')
+        g_logger.info('********************************************')
+
+        # 予測対象は各系列 FEATURE_SHIFT 日以内であること
+        feature_util.check_forecast_horizon(df_test, g_par.FEATURE_SHIFT)
+
+        # 実績・予測対象を結合して作成し、区分で分割する
+        holidays = feature_util.load_holidays(g_logger, g_par.INPUT_HOLIDAY_DATA)
+        df_base = pd.concat([df_train.assign(is_forecast=0),
+                             df_test.assign(is_forecast=1)],
+                            axis=0, ignore_index=True)
+        df_feature = feature_util.make_features(
+            df_base,
+            lags=g_par.FEATURE_LAGS,
+            windows=g_par.FEATURE_WINDOWS,
+            shift=g_par.FEATURE_SHIFT,
+            holidays=holidays)
+        is_forecast = df_feature.pop('is_forecast').to_numpy() == 1
+        g_logger.info('SHAPE : ' + str(df_feature.shape))
+
+        # 特徴量ストアへ出力する
+        feature_store.write_feature(
+            g_logger, df_feature.loc[~is_forecast].reset_index(drop=True),
+            g_par.FEATURE_NAME)
+        feature_store.write_feature(
+            g_logger, df_feature.loc[is_forecast].reset_index(drop=True),
+            g_par.FEATURE_NAME + '_forecast')
+
+        # 差分更新用の状態を出力する（祝日の一覧は予測サーバでも使う）
+        state = feature_util.build_feature_state(
+            df_train,
+            lags=g_par.FEATURE_LAGS,
+            windows=g_par.FEATURE_WINDOWS,
+            shift=g_par.FEATURE_SHIFT,
+            holidays=holidays)
+        write_state(state, state_path)
+
+    except:
+        g_logger.error('make_features で例外が発生しました')
+        raise
+
+
+def update_features(df_train, df_test, state, state_path):
+    '''
+    前回の状態から、新しい日付の行のみ特徴量を作成して追記する
+    - 予測対象分は毎回作成し直す
+    - 新しい行がなく予測対象分も前回と同じ場合は、特徴量ストア（マニフェスト・
+      予測対象分のファイル）を書き換えない（後続のステージを再実行しない）
+
+    Parameters
+    ----------
+    df_train : DataFrame
+        trainデータ
+    df_test : DataFrame
+        testデータ
+    state : dictionary
+        前回の差分更新用の状態
+    state_path : str
+        差分更新用の状態の格納先
+
+    Returns
+    ----------
+    None
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[update_features]')
+        g_logger.info('********************************************')
+
+        # 前回の状態より後の日付の行のみを対象にする
+        df_new = feature_util.select_new_rows(df_train, state)
+        g_logger.info('NEW   : ' + str(df_new.shape))
+
+        # 祝日の一覧は毎回読み込み直す（状態の一覧を置き換える）
+        holidays = feature_util.load_holidays(g_logger, g_par.INPUT_HOLIDAY_DATA)
+        df_new_feature, df_forecast_feature, state = \
+            feature_util.update_features(df_new, state, df_test, holidays)
+
+        # 特徴量ストアへ出力する（変更がない場合は出力しない）
+        if len(df_new_feature) > 0:
+            feature_store.append_feature(g_logger, df_new_feature,
+                                         g_par.FEATURE_NAME)
+        if len(df_new_feature) > 0 or not is_same_forecast(df_forecast_feature):
+            feature_store.write_feature(g_logger, df_forecast_feature,
+                                        g_par.FEATURE_NAME + '_forecast')
+        else:
+            g_logger.info('新しい行・予測対象の変更がないため、特徴量ストアは更新しません')
+
+        # 差分更新用の状態を出力する（ステージの完了の記録を兼ねる）
+        write_state(state, state_path)
+
+    except:
+        g_logger.error('update_features で例外が発生しました')
+        raise
+
+
+def is_same_forecast(df_forecast_feature):
+    '''
+    予測対象分の特徴量が、特徴量ストアの前回の出力と同じかを判定する
+
+    Parameters
+    ----------
+    df_forecast_feature : DataFrame
+        今回作成した予測対象分の特徴量
+
+    Returns
+    ----------
+    is_same : boolean
+        前回と同じ場合はTrue
+
+    '''
+    try:
+        forecast_name = g_par.FEATURE_NAME + '_forecast'
+        if forecast_name not in feature_store.load_manifest():
+            return False
+
+        df_prev = feature_store.load_feature(g_logger, forecast_name, memory_map=False)
+
+        return df_prev.equals(df_forecast_feature.reset_index(drop=True))
+
+    except:
+        g_logger.error('is_same_forecast で例外が発生しました')
+        raise
+
+
+def read_state(state_path):
+    '''
+    差分更新用の状態を読み込む
+    - ラグ・移動窓・shift の設定が現在の設定と異なる場合はNoneを返す
+      （全履歴から作成し直す）
+
+    Parameters
+    ----------
+    state_path : str
+        格納先
+
+    Returns
+    ----------
+    state : dictionary
+        差分更新用の状態（設定が異なる場合はNone）
+
+    '''
+    try:
+
+        g_logger.info('[read_state]')
+
+        with open(state_path, 'rb') as pickle_file:
+            state = pickle.load(pickle_file)
+
+        if (state['lags'], state['windows'], state['shift']) != \
+                (list(g_par.FEATURE_LAGS), list(g_par.FEATURE_WINDOWS), g_par.FEATURE_SHIFT):
+            g_logger.info('特徴量の設定が前回と異なるため、全履歴から作成します')
+            return None
+
+        return state
+
+    except:
+        g_logger.error('read_state で例外が発生しました')
+        raise
+
+
+def write_state(state, state_path):
+    '''
+    差分更新用の状態を出力する
+
+    Parameters
+    ----------
+    state : dictionary
+        差分更新用の状態
+    state_path : str
+        出力先
+
+    Returns
+    ----------
+    None
+
+    '''
+    try:
+
+        g_logger.info('[write_state]')
+
+        # 一時ファイルに出力してから置き換える
+        with open(state_path + '.tmp', 'wb') as pickle_file:
+            pickle.dump(state, pickle_file, protocol=4)
+        os.replace(state_path + '.tmp', state_path)
+
+    except:
+        g_logger.error('write_state で例外が発生しました')
+        raise
+
+
+# ------------------------------------------------------------
+# ★★★★★★  実行部分  ★★★★★★
+# ------------------------------------------------------------
+if __name__ == '__main__':
+
+    # 初期処理、アプリ内で利用するグローバル変数の取得
+    g_bt_ymd, g_par, g_logger = conv_util.start_app(g_python_name, g_list)
+
+    # 実行部分
+    main()
+
+# ------------------------------------------------------------
+# ★★★★★★  特徴量の作成  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,461 @@
+''' coding: utf-8 '''
+# ------------------------------------------------------------
+# 処理名  ： ベンチマーク
+# 処理概要： 本番相当の規模の疑似データで、320_make_features・
+#            310_train_ligthbm・510_predict_lightgbm_model の処理を
+#            そのまま実行して処理時間を計測し、基準値と比較する
+#            - 予測サーバの少ない行数の予測は、foldモデル（Booster）と
+#              結合モデル（tree_util）の両方を計測する
+#            - 各スクリプトは BENCH_DIR の作業ディレクトリ（400_features /
+#              600_model など）で実行し、本番の出力には書き込まない
+#            - BENCH_REPEATS 回計測した中央値で比較する
+#            - 計測結果は 800_log/metrics.jsonl と BENCH_DIR に出力する
+#            - 基準値より BENCH_TOLERANCE 以上、かつ BENCH_MIN_DELTA_SEC /
+#              BENCH_MIN_DELTA_MB 以上悪化した処理があれば異常終了する
+# ------------------------------------------------------------
+# ライブラリーのインポート
+import datetime
+import importlib.util
+import os
+import shutil
+import sys
+import traceback
+import types
+
+import numpy as np
+import pandas as pd
+
+# utilプログラム
+from util import bench_util
+from util import conv_util
+from util import feature_store
+from util import model_util
+from util import profile_util
+from util import tree_util
+
+# LightGBMは計測前に読み込む（読込時間は import.lightgbm として計測する）
+lgbm = conv_util.lazy_import('lightgbm')
+
+# グローバル変数定義
+g_bt_ymd = ''
+g_par = None
+g_logger = None
+g_python_name = os.path.basename(__file__)
+g_list = [None] * conv_util.VAR_LIST_SIZE
+
+# 計測するスクリプト（関数を呼び出す）
+SCRIPT_MAKE_FEATURES = '320_make_features.py'
+SCRIPT_TRAIN = '310_train_ligthbm.py'
+SCRIPT_PREDICT = '510_predict_lightgbm_model.py'
+
+# 作業ディレクトリ内のディレクトリ（スクリプトは 300_src から相対パスで参照する）
+WORK_SUB_DIRS = ['300_src', '400_features', '500_output', '600_model']
+
+# 学習結果のディレクトリ名（600_model/<BENCH_MODEL_TIME>/）
+BENCH_MODEL_TIME = 'bench'
+
+
+# ------------------------------------------------------------
+# ★★★★★★  メイン処理部分  ★★★★★★
+# ------------------------------------------------------------
+def main():
+
+    # バッチ処理の記述
+    try:
+
+        # ディレクトリのセット
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+        # ベンチマークを実行する
+        df_bench = run_benchmark()
+
+        # 基準値と比較する
+        n_regression = compare_benchmark(df_bench)
+        if n_regression > 0:
+            raise RuntimeError('基準値より遅い処理があります : ' + str(n_regression))
+
+    except Exception:
+        # エラースタックを出力
+        g_logger.error('========================================')
+        g_logger.exception(traceback.format_exc())
+        g_logger.error('異常終了 ENDED CODE=1')
+        sys.exit(1)
+
+    else:
+        g_logger.info('========================================')
+        g_logger.info('正常終了 ENDED CODE=0')
+        sys.exit(0)
+
+    finally:
+        conv_util.end_app(g_list)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  処理  ★★★★★★
+# ------------------------------------------------------------
+def run_benchmark():
+    '''
+    疑似データを作成し、各スクリプトの処理を BENCH_REPEATS 回計測する
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    ----------
+    df_bench : DataFrame
+        処理（stage）ごとの計測結果の中央値
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[run_benchmark]')
+        g_logger.info('********************************************')
+
+        scale = '{}x{}x{}'.format(g_par.BENCH_N_MISE, g_par.BENCH_N_ITEM,
+                                  g_par.BENCH_N_DAYS)
+        bench_dir = os.path.abspath(g_par.BENCH_DIR)
+
+        # 疑似データの作成（作業ディレクトリから参照するため絶対パスにする）
+        data = bench_util.make_synthetic_data(g_par.BENCH_N_MISE, g_par.BENCH_N_ITEM,
+                                              g_par.BENCH_N_DAYS)
+        file_data_dict = bench_util.write_synthetic_data(
+            g_logger, {name: data[name] for name in ('train', 'test', 'gis', 'mise')},
+            os.path.join(bench_dir, 'data_' + scale))
+        del data
+
+        # 疑似データを参照するパラメーターで、各スクリプトの関数を読み込む
+        par = get_bench_par(file_data_dict)
+        scripts = {name: load_script(name, par) for name in
+                   (SCRIPT_MAKE_FEATURES, SCRIPT_TRAIN, SCRIPT_PREDICT)}
+
+        # 作業ディレクトリで実行しても計測結果は 800_log/ に出力する
+        profile_util.configure(log_dir=os.path.abspath(profile_util.g_log_dir))
+        conv_util.load_module(lgbm)
+
+        records = []
+        for repeat in range(g_par.BENCH_REPEATS):
+            g_logger.info('REPEAT: {}/{}'.format(repeat + 1, g_par.BENCH_REPEATS))
+            records.extend(run_once(scripts, os.path.join(bench_dir, 'work_' + scale),
+                                    scale, repeat))
+
+        df_runs = pd.DataFrame(records)
+        df_runs['stage'] = df_runs['stage'].str.replace('bench.', '', regex=False)
+
+        return bench_util.summarize_runs(
+            df_runs[['scale', 'stage', 'repeat', 'rows', 'wall_sec', 'cpu_sec',
+                     'peak_rss_mb', 'peak_rss_delta_mb', 'rows_per_sec']])
+
+    except:
+        g_logger.error('run_benchmark で例外が発生しました')
+        raise
+
+
+def get_bench_par(file_data_dict):
+    '''
+    疑似データを入力にしたパラメーターを作成する（g_par は変更しない）
+
+    Parameters
+    ----------
+    file_data_dict : dictionary
+        疑似データのファイル名（拡張子なし） → ファイルの情報
+
+    Returns
+    ----------
+    par : SimpleNamespace
+        ベンチマーク用のパラメーター
+
+    '''
+    par = types.SimpleNamespace(**vars(g_par))
+    par.INPUT_TRAIN_DATA = file_data_dict['train']
+    par.INPUT_TEST_DATA = file_data_dict['test']
+    par.INPUT_GIS_DATA = file_data_dict['gis']
+    par.INPUT_MISE_MASTER = file_data_dict['mise']
+    # 祝日の一覧は作業ディレクトリの外（100_config）から読み込む
+    par.INPUT_HOLIDAY_DATA = dict(
+        g_par.INPUT_HOLIDAY_DATA,
+        file_dir=os.path.abspath(g_par.INPUT_HOLIDAY_DATA['file_dir']) + os.sep)
+    par.JOIN_COL = ['group_mise']
+    par.JOIN_DROPNA_COL = bench_util.GIS_COL[:2]
+    par.PREDICT_MODEL_TIME = BENCH_MODEL_TIME
+    par.SEGMENT_MODE = ''
+    par.IMPORTANCE_PLOT = False
+
+    return par
+
+
+def load_script(script, par):
+    '''
+    スクリプトをモジュールとして読み込み（メイン処理は実行しない）、
+    g_par・g_logger をセットする
+    - fold並列で関数をpickleできるよう sys.modules に登録する
+
+    Parameters
+    ----------
+    script : str
+        スクリプトのファイル名（300_src/）
+    par : SimpleNamespace
+        スクリプトで使うパラメーター
+
+    Returns
+    ----------
+    script_globals : dictionary
+        スクリプトのグローバル変数（関数の参照先）
+
+    '''
+    module_name = 'bench_' + os.path.splitext(script)[0]
+    spec = importlib.util.spec_from_file_location(module_name, script)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    module.g_par = par
+    module.g_logger = g_logger
+
+    return vars(module)
+
+
+def run_once(scripts, work_dir, scale, repeat):
+    '''
+    空の作業ディレクトリで、特徴量作成・学習・予測を1回ずつ計測する
+
+    Parameters
+    ----------
+    scripts : dictionary
+        スクリプトのファイル名 → グローバル変数（load_script の戻り値）
+    work_dir : str
+        作業ディレクトリ（毎回作り直す）
+    scale : str
+        規模（店舗数x商品数x日数）
+    repeat : int
+        計測の回数（0始まり）
+
+    Returns
+    ----------
+    records : list
+        処理ごとの計測結果
+
+    '''
+    make_features = scripts[SCRIPT_MAKE_FEATURES]
+    train = scripts[SCRIPT_TRAIN]
+    predict = scripts[SCRIPT_PREDICT]
+    records = []
+
+    def bench(name, rows=None):
+        return profile_util.stage('bench.' + name, rows=rows, logger=g_logger,
+                                  scale=scale, repeat=repeat)
+
+    # 前回の特徴量・キャッシュ・モデルを使わないよう作業ディレクトリを作り直す
+    shutil.rmtree(work_dir, ignore_errors=True)
+    for name in WORK_SUB_DIRS:
+        os.makedirs(os.path.join(work_dir, name))
+    model_util.clear_model_cache()
+    tree_util.clear_merged_cache()
+
+    cwd = os.getcwd()
+    try:
+        os.chdir(os.path.join(work_dir, '300_src'))
+
+        # 読込（320 get_base_data）
+        with bench('load') as record:
+            df_train, df_test = make_features['get_base_data']()
+            record['rows'] = len(df_train) + len(df_test)
+        records.append(record)
+
+        # 特徴量作成・特徴量ストアへの出力（320 make_features）
+        with bench('features', rows=len(df_train) + len(df_test)) as record:
+            make_features['make_features'](
+                df_train, df_test,
+                feature_store.FEATURE_DIR + make_features['g_par'].FEATURE_NAME + '_state.pkl')
+        records.append(record)
+        del df_train, df_test
+
+        # 特徴量ストアの読込・GISデータ・店マスタの結合（310 get_feature_data）
+        with bench('feature_data') as record:
+            df_feature = train['get_feature_data']()
+            record['rows'] = len(df_feature)
+        records.append(record)
+
+        # foldごとの学習（310 train_lightgbm → _train_fold）
+        n_metrics = len(profile_util.load_metrics(run_id=profile_util.g_run_id))
+        with bench('train', rows=len(df_feature)) as record:
+            train['train_lightgbm'](df_feature, BENCH_MODEL_TIME,
+                                    train['g_par'].FOLD_N_JOBS)
+        records.append(record)
+        records.extend(get_fold_records(n_metrics, scale, repeat))
+        del df_feature
+
+        # foldアンサンブルでの予測（510 get_forecast_data → predict_lightgbm）
+        with bench('predict') as record:
+            df_test_feature = predict['get_forecast_data']()
+            predict['predict_lightgbm'](df_test_feature)
+            record['rows'] = len(df_test_feature)
+        records.append(record)
+
+        # 予測サーバの1回の予測（520 predict_request）
+        records.extend(run_serving(df_test_feature, predict['g_par'].FEATURE_COL,
+                                   scale, repeat))
+
+    finally:
+        os.chdir(cwd)
+
+    return records
+
+
+def run_serving(df_test_feature, feature_col, scale, repeat):
+    '''
+    予測サーバと同じ少ない行数の予測を、foldモデル（fold数分の Booster.predict）と
+    結合モデル（1回の Booster.predict）で計測する
+    - g_par.BENCH_SERVE_BATCH の行数ごとに g_par.BENCH_SERVE_CALLS 回予測する
+
+    Parameters
+    ----------
+    df_test_feature : DataFrame
+        予測対象の特徴量
+    feature_col : list
+        特徴量のカラム名
+    scale : str
+        規模
+    repeat : int
+        計測の回数
+
+    Returns
+    ----------
+    records : list
+        serve_booster_<行数> / serve_merged_<行数> の計測結果
+
+    '''
+    model_dir = model_util.MODEL_ROOT + BENCH_MODEL_TIME + '/'
+    models = model_util.load_fold_models(g_logger, model_dir)
+    merged = tree_util.load_merged_model(g_logger, model_dir)
+    x_feature = model_util.to_feature_array(model_util.encode_features(
+        g_logger, df_test_feature[feature_col], model_dir))
+
+    # 結合モデルの予測値がfoldモデルの平均と一致することを確認する
+    g_logger.info('SERVE : 予測値の差の最大 {:.3g}'.format(np.max(np.abs(
+        model_util.predict_folds(models, x_feature)
+        - tree_util.predict_merged(merged, x_feature)))))
+
+    records = []
+    for batch in g_par.BENCH_SERVE_BATCH:
+        x_batch = x_feature[np.arange(batch) % len(x_feature)]
+        predictors = {
+            'booster': lambda: model_util.predict_folds(models, x_batch),
+            'merged': lambda: tree_util.predict_merged(merged, x_batch),
+        }
+        wall_sec = {}
+        for name, predict in predictors.items():
+            predict()
+            with profile_util.stage('bench.serve_{}_{}'.format(name, batch),
+                                    rows=batch * g_par.BENCH_SERVE_CALLS,
+                                    scale=scale, repeat=repeat) as record:
+                for _ in range(g_par.BENCH_SERVE_CALLS):
+                    predict()
+            records.append(record)
+            wall_sec[name] = record['wall_sec']
+
+        g_logger.info('SERVE : {:>4}行 booster:{:.3f}[ms] merged:{:.3f}[ms] ({:.1f}倍)'.format(
+            batch,
+            wall_sec['booster'] / g_par.BENCH_SERVE_CALLS * 1000,
+            wall_sec['merged'] / g_par.BENCH_SERVE_CALLS * 1000,
+            wall_sec['booster'] / max(wall_sec['merged'], 1e-9)))
+
+    return records
+
+
+def get_fold_records(n_metrics, scale, repeat):
+    '''
+    _train_fold が出力したfoldごとの学習の計測結果を取得する
+    （fold並列の場合は子プロセスの計測結果）
+
+    Parameters
+    ----------
+    n_metrics : int
+        学習前の計測結果の行数（これより後の行を対象にする）
+    scale : str
+        規模
+    repeat : int
+        計測の回数
+
+    Returns
+    ----------
+    records : list
+        fold番号順の train_fold<n> の計測結果
+
+    '''
+    df_metrics = profile_util.load_metrics(run_id=profile_util.g_run_id).iloc[n_metrics:]
+    df_fold = df_metrics.loc[df_metrics['stage'] == 'train_fold'].sort_values('fold')
+
+    records = []
+    for record in df_fold.to_dict(orient='records'):
+        record.update(stage='train_fold{}'.format(int(record['fold'])),
+                      scale=scale, repeat=repeat)
+        records.append(record)
+
+    return records
+
+
+def compare_benchmark(df_bench):
+    '''
+    計測結果を基準値と比較して出力する
+    - g_par.BENCH_UPDATE_BASELINE がTrueの場合は、計測結果を基準値にする
+
+    Parameters
+    ----------
+    df_bench : DataFrame
+        処理ごとの計測結果（中央値）
+
+    Returns
+    ----------
+    n_regression : int
+        基準値より遅い処理の数
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[compare_benchmark]')
+        g_logger.info('********************************************')
+
+        baseline_path = os.path.join(g_par.BENCH_DIR, 'baseline.json')
+        df_compare = bench_util.compare_baseline(
+            df_bench, baseline_path, g_par.BENCH_TOLERANCE,
+            {'wall_sec': g_par.BENCH_MIN_DELTA_SEC,
+             'peak_rss_delta_mb': g_par.BENCH_MIN_DELTA_MB})
+
+        # 計測結果は BENCH_REPEATS 回の中央値
+        for row in df_compare.itertuples(index=False):
+            g_logger.info('{:<12} {:>8.2f}[sec] base:{:>8.2f}[sec] n:{} {}'.format(
+                row.stage, row.wall_sec, row.base_wall_sec, row.n_runs,
+                '★遅延' if row.regression else ''))
+
+        # 計測結果を出力する
+        time = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        df_compare.to_csv(os.path.join(g_par.BENCH_DIR, 'bench_' + time + '.csv'),
+                          index=False)
+
+        if g_par.BENCH_UPDATE_BASELINE:
+            bench_util.write_baseline(df_bench, baseline_path)
+            g_logger.info('BASELINE: ' + baseline_path)
+            return 0
+
+        return int(np.sum(df_compare['regression']))
+
+    except:
+        g_logger.error('compare_benchmark で例外が発生しました')
+        raise
+
+
+# ------------------------------------------------------------
+# ★★★★★★  実行部分  ★★★★★★
+# ------------------------------------------------------------
+if __name__ == '__main__':
+
+    # 初期処理、アプリ内で利用するグローバル変数の取得
+    g_bt_ymd, g_par, g_logger = conv_util.start_app(g_python_name, g_list)
+
+    # 実行部分
+    main()
+
+# ------------------------------------------------------------
+# ★★★★★★  ベンチマーク  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,145 @@
+''' coding: utf-8 '''
+# ------------------------------------------------------------
+# 処理名  ： LightGBMモデルによる予測
+# 処理概要： 学習済みのfoldモデルを1度だけ読み込み、
+#            予測対象の特徴量をfoldアンサンブルで予測する
+# ------------------------------------------------------------
+# ライブラリーのインポート
+import os
+import sys
+import traceback
+
+# utilプログラム
+from util import conv_util
+from util import feature_store
+from util import file_util
+from util import model_util
+from util import segment_util
+
+# グローバル変数定義
+g_bt_ymd = ''
+g_par = None
+g_logger = None
+g_python_name = os.path.basename(__file__)
+g_list = [None] * conv_util.VAR_LIST_SIZE
+
+
+# ------------------------------------------------------------
+# ★★★★★★  メイン処理部分  ★★★★★★
+# ------------------------------------------------------------
+def main():
+
+    # バッチ処理の記述
+    try:
+
+        # ディレクトリのセット
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+        # 予測対象の特徴量を取得する
+        df_test = get_forecast_data()
+
+        # foldアンサンブルで予測する
+        df_predict = predict_lightgbm(df_test)
+
+        # 予測結果を出力する
+        file_util.write_csv(g_logger, df_predict, g_par.OUTPUT_PREDICT_DATA)
+
+    except Exception:
+        # エラースタックを出力
+        g_logger.error('========================================')
+        g_logger.exception(traceback.format_exc())
+        g_logger.error('異常終了 ENDED CODE=1')
+        sys.exit(1)
+
+    else:
+        g_logger.info('========================================')
+        g_logger.info('正常終了 ENDED CODE=0')
+        sys.exit(0)
+
+    finally:
+        conv_util.end_app(g_list)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  処理  ★★★★★★
+# ------------------------------------------------------------
+def get_forecast_data():
+    '''
+    特徴量ストアから予測対象の特徴量を取得する
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    ----------
+    df_test : DataFrame
+        予測対象のキーと特徴量
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[get_forecast_data]')
+        g_logger.info('********************************************')
+
+        # キーと特徴量のカラムのみを読み込む
+        usecols = g_par.KEY_COL + [col for col in g_par.FEATURE_COL
+                                   if col not in g_par.KEY_COL]
+
+        return feature_store.load_feature(
+            g_logger, g_par.FEATURE_NAME + '_forecast', usecols=usecols)
+
+    except:
+        g_logger.error('get_forecast_data で例外が発生しました')
+        raise
+
+
+def predict_lightgbm(df_test):
+    '''
+    foldモデルの予測値の平均を算出する
+    - セグメント別モデルがある場合は、対象のセグメントの行をそのモデルで予測する
+
+    Parameters
+    ----------
+    df_test : DataFrame
+        予測対象のキーと特徴量
+
+    Returns
+    ----------
+    df_predict : DataFrame
+        予測対象のキーと予測値（target）
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[predict_lightgbm]')
+        g_logger.info('********************************************')
+
+        model_dir = model_util.resolve_model_dir(g_logger, g_par.PREDICT_MODEL_TIME)
+
+        df_predict = df_test[g_par.KEY_COL].copy()
+        df_predict[g_par.TARGET_COL] = segment_util.predict_segments(
+            g_logger, df_test, model_dir, g_par.FEATURE_COL,
+            g_par.PREDICT_CHUNK_SIZE)
+
+        return df_predict
+
+    except:
+        g_logger.error('predict_lightgbm で例外が発生しました')
+        raise
+
+
+# ------------------------------------------------------------
+# ★★★★★★  実行部分  ★★★★★★
+# ------------------------------------------------------------
+if __name__ == '__main__':
+
+    # 初期処理、アプリ内で利用するグローバル変数の取得
+    g_bt_ymd, g_par, g_logger = conv_util.start_app(g_python_name, g_list)
+
+    # 実行部分
+    main()
+
+# ------------------------------------------------------------
+# ★★★★★★  LightGBMモデルによる予測  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,373 @@
+''' coding: utf-8 '''
+# ------------------------------------------------------------
+# 処理名  ： 予測サーバ
+# 処理概要： 学習済みのfoldモデルと特徴量ストアを1度だけ読み込み、
+#            (nichi, group_mise, group_item) の予測リクエストにHTTPで応答する
+#            - 同時に届いたリクエストはマイクロバッチで1回の予測にまとめる
+#            - GET /stats で応答時間の p50 / p99 を返す
+# ------------------------------------------------------------
+# ライブラリーのインポート
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# utilプログラム
+from util import backtest_util
+from util import conv_util
+from util import feature_store
+from util import feature_util
+from util import model_util
+from util import segment_util
+from util import serve_util
+from util import tree_util
+
+# グローバル変数定義
+g_bt_ymd = ''
+g_par = None
+g_logger = None
+g_python_name = os.path.basename(__file__)
+g_list = [None] * conv_util.VAR_LIST_SIZE
+
+# 予測に使うデータ（起動時に1度だけ読み込む）
+g_forecast = None
+g_forecast_index = None
+g_state = None
+g_model_dir = ''
+
+
+# ------------------------------------------------------------
+# ★★★★★★  メイン処理部分  ★★★★★★
+# ------------------------------------------------------------
+def main():
+
+    # バッチ処理の記述
+    try:
+
+        # ディレクトリのセット
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+        # 特徴量・モデルを読み込む
+        load_serving_data()
+
+        # サーバを実行する（SIGINT / SIGTERM で停止する）
+        asyncio.run(run_server())
+
+    except Exception:
+        # エラースタックを出力
+        g_logger.error('========================================')
+        g_logger.exception(traceback.format_exc())
+        g_logger.error('異常終了 ENDED CODE=1')
+        sys.exit(1)
+
+    else:
+        g_logger.info('========================================')
+        g_logger.info('正常終了 ENDED CODE=0')
+        sys.exit(0)
+
+    finally:
+        conv_util.end_app(g_list)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  処理  ★★★★★★
+# ------------------------------------------------------------
+def load_serving_data():
+    '''
+    予測対象の特徴量・差分更新用の状態・foldモデルを読み込む
+    - 予測対象の特徴量はキーで引けるように索引を作成する
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    ----------
+    None
+
+    '''
+    global g_forecast, g_forecast_index, g_state, g_model_dir
+
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[load_serving_data]')
+        g_logger.info('********************************************')
+
+        # 予測対象の特徴量（キーの索引付き）
+        g_forecast = feature_store.load_feature(
+            g_logger, g_par.FEATURE_NAME + '_forecast')
+        g_forecast_index = pd.MultiIndex.from_frame(g_forecast[g_par.KEY_COL])
+
+        # 予測対象にないキーの特徴量を作成するための状態
+        state_path = feature_store.FEATURE_DIR + g_par.FEATURE_NAME + '_state.pkl'
+        if os.path.exists(state_path):
+            with open(state_path, 'rb') as pickle_file:
+                g_state = pickle.load(pickle_file)
+
+        # foldモデル（プロセス内にキャッシュされる）
+        g_model_dir = model_util.resolve_model_dir(g_logger, g_par.PREDICT_MODEL_TIME)
+        manifest, _ = segment_util.load_segments(g_logger, g_model_dir)
+        if g_par.SERVE_MERGED_MODEL:
+            # 結合モデルはfoldモデルのみ（セグメント別モデルがある場合は510と結果が異なる）
+            if manifest is not None:
+                raise ValueError('セグメント別モデルは SERVE_MERGED_MODEL では予測できません : '
+                                 + g_model_dir)
+            tree_util.load_merged_model(g_logger, g_model_dir)
+        else:
+            model_util.load_fold_models(g_logger, g_model_dir)
+
+    except:
+        g_logger.error('load_serving_data で例外が発生しました')
+        raise
+
+
+def build_features(df_request):
+    '''
+    リクエストの行の特徴量を作成する
+    - 予測対象の特徴量ストアにあるキーは、読込済みの行をそのまま使う
+    - ないキーは、重複を除いたキーごとに差分更新用の状態から作成する
+      （fill_request_dates で日付を補うため、同じバッチの他のリクエストに依存しない）
+
+    Parameters
+    ----------
+    df_request : DataFrame
+        予測対象のキー（g_par.KEY_COL）
+
+    Returns
+    ----------
+    df_feature : DataFrame
+        リクエストの行順の特徴量
+
+    '''
+    row = g_forecast_index.get_indexer(pd.MultiIndex.from_frame(df_request))
+    is_hit = row >= 0
+    if is_hit.all():
+        return g_forecast.iloc[row].reset_index(drop=True)
+
+    if g_state is None:
+        raise ValueError('予測対象にないキーです')
+
+    # 状態を書き換えないよう、複製した辞書で作成する
+    df_miss = df_request.loc[~is_hit].reset_index(drop=True)
+    df_fill = fill_request_dates(df_miss.drop_duplicates())
+    _, df_fill_feature, _ = feature_util.update_features(
+        g_state['tail'].iloc[:0], dict(g_state), df_fill)
+
+    # リクエストの行順に戻す（補った日付の行は使わない、重複したキーは同じ行を使う）
+    miss_row = pd.MultiIndex.from_frame(df_fill_feature[g_par.KEY_COL]) \
+        .get_indexer(pd.MultiIndex.from_frame(df_miss))
+    df_feature = pd.concat([g_forecast.iloc[row[is_hit]],
+                            df_fill_feature.iloc[miss_row]],
+                           axis=0, ignore_index=True)
+    order = np.concatenate([np.flatnonzero(is_hit), np.flatnonzero(~is_hit)])
+
+    return df_feature.iloc[np.argsort(order)].reset_index(drop=True)
+
+
+def fill_request_dates(df_key):
+    '''
+    系列ごとに、状態の最終日の翌日から要求日までの全日付の行を作成する
+    - ラグ・移動窓は行数で数えるため、間の日付を欠損のターゲットで補い、
+      ラグ・移動窓を日付に揃える
+    - 各日付の特徴量はそれより前の行のみから決まるため、系列の最大の要求日まで
+      まとめて作成しても、要求日ごとに作成した場合と同じ値になる
+    - 状態にない系列は、要求日の最小から最大までを作成する（ターゲットはすべて欠損）
+    - 補う日数は状態の shift（FEATURE_SHIFT）まで（それより先の日付の特徴量は
+      予測期間内の欠損の実績に依存し、学習の行と条件が異なる）
+
+    Parameters
+    ----------
+    df_key : DataFrame
+        予測対象にないキー（重複なし）
+
+    Returns
+    ----------
+    df_fill : DataFrame
+        系列キー・日付・ターゲット（欠損）の行
+
+    '''
+    key_col = g_state['key_col']
+    date_col = g_state['date_col']
+
+    days = feature_util.to_epoch_days(df_key[date_col])
+    key_index = pd.MultiIndex.from_frame(g_state['expanding'][key_col])
+    row_key = key_index.get_indexer(pd.MultiIndex.from_frame(df_key[key_col]))
+    last_days = g_state['expanding']['last_day'].to_numpy()
+    is_known = row_key >= 0
+    if np.any(days[is_known] <= last_days[row_key[is_known]]):
+        raise ValueError('実績の期間内の日付は予測できません')
+
+    # 系列ごとの作成範囲（開始日 〜 最大の要求日）
+    df_range = df_key[key_col].assign(
+        start=np.where(is_known, last_days[np.maximum(row_key, 0)] + 1, days),
+        end=days).groupby(key_col, sort=False, observed=True) \
+        .agg(start=('start', 'min'), end=('end', 'max')).reset_index()
+    length = (df_range['end'] - df_range['start'] + 1).to_numpy()
+    if length.max() > g_state['shift']:
+        raise ValueError('実績の最終日から {} 日より先の日付は予測できません'
+                         .format(g_state['shift']))
+
+    # 系列ごとに開始日からの連番の日付を展開する
+    series = np.repeat(np.arange(len(df_range)), length)
+    offset = np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length)
+    df_fill = df_range[key_col].iloc[series].reset_index(drop=True)
+    df_fill[date_col] = backtest_util.to_ymd(
+        df_range['start'].to_numpy()[series] + offset) \
+        .astype(g_state['tail'][date_col].dtype)
+    df_fill[g_state['target_col']] = np.nan
+
+    return df_fill[list(g_state['tail'].columns)]
+
+
+def predict_request(df_request):
+    '''
+    マイクロバッチにまとめたリクエストの行を、1回の呼出で予測する
+
+    Parameters
+    ----------
+    df_request : DataFrame
+        予測対象のキー
+
+    Returns
+    ----------
+    preds : ndarray
+        予測値
+
+    '''
+    df_feature = build_features(df_request)
+
+    if g_par.SERVE_MERGED_MODEL:
+        merged = tree_util.load_merged_model(g_logger, g_model_dir)
+        x_feature = model_util.to_feature_array(model_util.encode_features(
+            g_logger, df_feature[g_par.FEATURE_COL], g_model_dir))
+        return tree_util.predict_merged(merged, x_feature)
+
+    return segment_util.predict_segments(g_logger, df_feature, g_model_dir,
+                                         g_par.FEATURE_COL, g_par.PREDICT_CHUNK_SIZE)
+
+
+def parse_request(method, query, body):
+    '''
+    リクエストから予測対象のキーを取得する
+    - GET  : /forecast?nichi=20200601&group_mise=X&group_item=A
+    - POST : {"rows": [{"nichi": 20200601, "group_mise": "X", "group_item": "A"}, ...]}
+
+    Parameters
+    ----------
+    method : str
+        HTTPメソッド
+    query : dictionary
+        クエリ文字列
+    body : bytes
+        リクエストの本文
+
+    Returns
+    ----------
+    df_request : DataFrame
+        予測対象のキー（予測対象の特徴量と同じ型）
+
+    '''
+    if method == 'GET':
+        rows = [query]
+    else:
+        payload = json.loads(body.decode('utf8'))
+        rows = payload['rows'] if isinstance(payload, dict) else payload
+
+    df_request = pd.DataFrame(rows)
+    missing = [col for col in g_par.KEY_COL if col not in df_request.columns]
+    if missing or len(df_request) == 0:
+        raise ValueError('キーが指定されていません : ' + str(missing))
+
+    # 予測対象の特徴量のキーと型を揃える
+    df_request = df_request[g_par.KEY_COL]
+    for col in g_par.KEY_COL:
+        df_request[col] = df_request[col].astype(g_forecast[col].dtype)
+
+    return df_request
+
+
+async def run_server():
+    '''
+    予測サーバを起動し、停止の合図まで応答する
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    ----------
+    None
+
+    '''
+    g_logger.info('********************************************')
+    g_logger.info('[run_server]')
+    g_logger.info('********************************************')
+
+    batcher = serve_util.MicroBatcher(predict_request, g_par.SERVE_MAX_BATCH,
+                                      g_par.SERVE_MAX_WAIT)
+    stats = serve_util.LatencyStats()
+
+    async def handle_request(method, path, query, body):
+        if path == '/stats':
+            return 200, dict(stats.summary(), batches=batcher.batch_count,
+                             rows=batcher.row_count)
+        if path != '/forecast':
+            return 404, {'error': 'not found'}
+        if method not in ('GET', 'POST'):
+            return 405, {'error': 'method not allowed'}
+
+        start = time.perf_counter()
+        try:
+            df_request = parse_request(method, query, body)
+            preds = await batcher.predict(df_request)
+        except (KeyError, ValueError, TypeError) as error:
+            return 400, {'error': str(error)}
+
+        df_response = df_request.astype(object)
+        df_response[g_par.TARGET_COL] = preds
+        stats.add(time.perf_counter() - start)
+
+        return 200, {'forecast': df_response.to_dict(orient='records')}
+
+    # SIGINT / SIGTERM で停止する
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop_event.set)
+
+    batcher.start()
+    try:
+        await serve_util.serve(g_logger, handle_request, g_par.SERVE_HOST,
+                               g_par.SERVE_PORT, stop_event)
+    finally:
+        await batcher.stop()
+
+        # 応答時間の集計を出力する
+        summary = stats.summary()
+        g_logger.info('REQUEST: ' + str(summary['count']))
+        g_logger.info('BATCH  : ' + str(batcher.batch_count))
+        g_logger.info('P50    : ' + str(summary['p50_ms']) + '[ms]')
+        g_logger.info('P99    : ' + str(summary['p99_ms']) + '[ms]')
+
+
+# ------------------------------------------------------------
+# ★★★★★★  実行部分  ★★★★★★
+# ------------------------------------------------------------
+if __name__ == '__main__':
+
+    # 初期処理、アプリ内で利用するグローバル変数の取得
+    g_bt_ymd, g_par, g_logger = conv_util.start_app(g_python_name, g_list)
+
+    # 実行部分
+    main()
+
+# ------------------------------------------------------------
+# ★★★★★★  予測サーバ  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,208 @@
+''' coding: utf-8 '''
+# ------------------------------------------------------------
+# 処理名  ： 階層予測の整合化
+# 処理概要： 店舗×商品のLightGBMの予測値と、全体・店舗・商品の簡易予測
+#            （同じ曜日の直近の平均）を、集計の関係が成り立つように整合化する
+#            - 整合化の方法は g_par.RECONCILE_METHOD
+#              （bottom_up, top_down, ols, wls_struct, wls_var）
+#            - wls_var の重みは各階層の予測値の残差の分散
+#              （最下層はLightGBMの検証の残差、上位階層は簡易予測の残差）
+# ------------------------------------------------------------
+# ライブラリーのインポート
+import os
+import sys
+import traceback
+
+import numpy as np
+import pandas as pd
+
+# utilプログラム
+from util import conv_util
+from util import feature_util
+from util import file_util
+from util import model_util
+from util import reconcile_util
+
+# グローバル変数定義
+g_bt_ymd = ''
+g_par = None
+g_logger = None
+g_python_name = os.path.basename(__file__)
+g_list = [None] * conv_util.VAR_LIST_SIZE
+
+
+# ------------------------------------------------------------
+# ★★★★★★  メイン処理部分  ★★★★★★
+# ------------------------------------------------------------
+def main():
+
+    # バッチ処理の記述
+    try:
+
+        # ディレクトリのセット
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+        # 実績と最下層の予測値を取得する
+        df_dict = file_util.load_files(g_logger, {'train': g_par.INPUT_TRAIN_DATA,
+                                                  'predict': g_par.INPUT_PREDICT_DATA})
+
+        # 階層の予測値を整合化する
+        df_reconcile = reconcile_forecast(df_dict['train'], df_dict['predict'])
+
+        # 整合化の結果を出力する
+        file_util.write_csv(g_logger, df_reconcile, g_par.OUTPUT_RECONCILE_DATA)
+
+    except Exception:
+        # エラースタックを出力
+        g_logger.error('========================================')
+        g_logger.exception(traceback.format_exc())
+        g_logger.error('異常終了 ENDED CODE=1')
+        sys.exit(1)
+
+    else:
+        g_logger.info('========================================')
+        g_logger.info('正常終了 ENDED CODE=0')
+        sys.exit(0)
+
+    finally:
+        conv_util.end_app(g_list)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  処理  ★★★★★★
+# ------------------------------------------------------------
+def reconcile_forecast(df_train, df_predict):
+    '''
+    全階層の予測値を作成し、整合化する
+    - 最下層（店舗×商品）はLightGBMの予測値、上位階層は簡易予測を使う
+    - 整合化後の予測値は、上位階層が最下層の合計と一致する
+
+    Parameters
+    ----------
+    df_train : DataFrame
+        実績データ（キー・日付・ターゲット）
+    df_predict : DataFrame
+        最下層の予測値（510_predict_lightgbm_model の出力）
+
+    Returns
+    ----------
+    df_reconcile : DataFrame
+        ノード・日付ごとの整合化前（base）・整合化後（target）の予測値
+
+    '''
+    try:
+        g_logger.info('********************************************')
+        g_logger.info('[reconcile_forecast]')
+        g_logger.info('********************************************')
+
+        # 集計行列の作成（実績・予測対象の系列を含める）
+        summing, df_nodes = reconcile_util.build_summing_matrix(
+            pd.concat([df_train, df_predict], axis=0, ignore_index=True))
+        n_bottom = summing.shape[1]
+        g_logger.info('NODE  : {} BOTTOM:{}'.format(len(df_nodes), n_bottom))
+
+        # ノードごとの実績と、最下層の予測値
+        y_history, history_days = reconcile_util.to_node_matrix(
+            df_train, summing, df_nodes, g_par.TARGET_COL)
+        y_bottom, forecast_days = reconcile_util.to_node_matrix(
+            df_predict, summing, df_nodes, g_par.TARGET_COL)
+
+        # 上位階層は簡易予測、最下層はLightGBMの予測値
+        y_forecast = reconcile_util.forecast_seasonal(
+            y_history, history_days, forecast_days, g_par.RECONCILE_WEEKS)
+        y_forecast[-n_bottom:] = y_bottom[-n_bottom:]
+
+        # 整合化する（wls_var の場合は予測誤差の分散を算出する）
+        variances = get_variances(y_history, history_days, summing, df_nodes) \
+            if g_par.RECONCILE_METHOD == 'wls_var' else None
+        reconciler = reconcile_util.Reconciler(
+            summing, g_par.RECONCILE_METHOD,
+            variances=variances,
+            proportions=reconcile_util.bottom_proportions(y_history, summing))
+        y_reconcile = reconciler.reconcile(np.nan_to_num(y_forecast))
+
+        df_reconcile = reconcile_util.to_frame(y_reconcile, df_nodes, forecast_days,
+                                               g_par.TARGET_COL)
+        df_reconcile.insert(len(df_reconcile.columns) - 1, 'base', y_forecast.ravel())
+        g_logger.info('SHAPE : ' + str(df_reconcile.shape))
+
+        return df_reconcile
+
+    except:
+        g_logger.error('reconcile_forecast で例外が発生しました')
+        raise
+
+
+def get_variances(y_history, history_days, summing, df_nodes):
+    '''
+    ノードごとの、そのノードの予測値の残差の分散を算出する（wls_var の重み）
+    - 最下層は予測に使うモデルの残差（g_par.RECONCILE_RESIDUAL_FILE）の2乗平均
+    - 上位階層は同じ基準日・予測期間の簡易予測（forecast_seasonal）の残差の2乗平均
+    - 残差のない最下層の系列（学習後に追加された系列など）は簡易予測の残差を使う
+
+    Parameters
+    ----------
+    y_history : ndarray
+        ノードごとの実績（ノード数 × 日数）
+    history_days : ndarray
+        実績の日付（経過日数）
+    summing : csr_matrix
+        集計行列 S
+    df_nodes : DataFrame
+        ノード
+
+    Returns
+    ----------
+    variances : ndarray
+        ノードごとの分散
+
+    '''
+    try:
+        g_logger.info('[get_variances]')
+
+        # 予測に使うモデルの残差（基準日・系列キー・日付・実績・予測値）
+        model_dir = model_util.resolve_model_dir(g_logger, g_par.PREDICT_MODEL_TIME)
+        df_result = file_util.load_csv(g_logger, {
+            'file_dir': model_dir, 'file_name': g_par.RECONCILE_RESIDUAL_FILE,
+            'usecols': None, 'dtype': None})
+
+        # 上位階層は、最下層の残差と同じ基準日で簡易予測した残差
+        cutoffs = np.unique(feature_util.to_epoch_days(df_result['cutoff']))
+        residuals = reconcile_util.seasonal_residuals(
+            y_history, history_days, cutoffs, g_par.BACKTEST_HORIZON,
+            g_par.RECONCILE_WEEKS)
+        variances = np.nanmean(residuals ** 2, axis=1)
+
+        # 最下層はLightGBMの残差
+        n_bottom = summing.shape[1]
+        bottom = reconcile_util.bottom_variance(df_result, summing, df_nodes,
+                                                g_par.TARGET_COL)
+        g_logger.info('BOTTOM: {}/{} 系列にLightGBMの残差があります'.format(
+            int(np.sum(~np.isnan(bottom))), n_bottom))
+        variances[-n_bottom:] = np.where(np.isnan(bottom), variances[-n_bottom:], bottom)
+
+        for level, df_level in df_nodes.reset_index(drop=True).groupby('level', sort=False):
+            g_logger.info('LEVEL {} : RMSE {:.3f}'.format(
+                level, np.sqrt(np.mean(variances[df_level.index]))))
+
+        return variances
+
+    except:
+        g_logger.error('get_variances で例外が発生しました')
+        raise
+
+
+# ------------------------------------------------------------
+# ★★★★★★  実行部分  ★★★★★★
+# ------------------------------------------------------------
+if __name__ == '__main__':
+
+    # 初期処理、アプリ内で利用するグローバル変数の取得
+    g_bt_ymd, g_par, g_logger = conv_util.start_app(g_python_name, g_list)
+
+    # 実行部分
+    main()
+
+# ------------------------------------------------------------
+# ★★★★★★  階層予測の整合化  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,9 @@
+# ------------------------------------------------------------
+# 処理名  ： テストの共通設定
+# 作成日  ： 2026.10.18
+# 処理概要： 300_src の util を import できるようにする
+# ------------------------------------------------------------
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,136 @@
+# ------------------------------------------------------------
+# 処理名  ： feature_util のテスト
+# 作成日  ： 2026.10.18
+# 処理概要： 予測対象の行の特徴量が、学習の行と同じ条件で作成されることを確認する
+#            - 実行方法：300_src で python -m pytest -q tests
+# ------------------------------------------------------------
+import numpy as np
+import pandas as pd
+import pytest
+
+from util import feature_util
+
+# テストの特徴量の設定（予測期間 = shift）
+SHIFT = 30
+LAGS = [30, 35, 42]
+WINDOWS = [7, 28]
+# 2020年の祝日（100_config/holidays.csv の一部）
+HOLIDAYS = [20200101, 20200113, 20200211, 20200223, 20200224, 20200320,
+            20200429, 20200503, 20200504, 20200505, 20200506, 20200723,
+            20200724, 20200810, 20200921, 20200922, 20201103, 20201123]
+FEATURE_PARAMS = {'lags': LAGS, 'windows': WINDOWS, 'shift': SHIFT,
+                  'holidays': HOLIDAYS}
+
+
+def make_series(n_days=200, seed=0):
+    '''
+    3店舗 × 2商品の日次の疑似データ（最後の SHIFT 日が予測対象）
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-01-01', periods=n_days, freq='D')
+    frames = []
+    for mise in ['X', 'Y', 'Z']:
+        for item in ['A', 'B']:
+            frames.append(pd.DataFrame({
+                'nichi': dates.strftime('%Y%m%d').astype(np.int64),
+                'group_mise': mise,
+                'group_item': item,
+                'target': rng.poisson(20, n_days).astype(np.float64),
+            }))
+    df = pd.concat(frames, axis=0, ignore_index=True)
+    is_forecast = df['nichi'] > int(dates[-SHIFT - 1].strftime('%Y%m%d'))
+
+    return df, is_forecast.to_numpy()
+
+
+def feature_cols(df_feature):
+    return [col for col in df_feature.columns if col.startswith('target_')]
+
+
+def test_forecast_features_do_not_depend_on_forecast_targets():
+    # 予測対象の実績を欠損にしても、実績がある場合と同じ特徴量になる
+    df, is_forecast = make_series()
+    df_actual = feature_util.make_features(df, **FEATURE_PARAMS)
+    df_masked = feature_util.make_features(
+        df.assign(target=np.where(is_forecast, np.nan, df['target'])), **FEATURE_PARAMS)
+
+    cols = feature_cols(df_actual)
+    is_masked = df_masked['target'].isna().to_numpy()
+    pd.testing.assert_frame_equal(df_masked.loc[is_masked, cols],
+                                  df_actual.loc[is_masked, cols])
+
+
+def test_forecast_rows_are_as_complete_as_training_rows():
+    # 予測対象の行の欠損率は、学習の行（系列の先頭を除く）より高くならない
+    df, is_forecast = make_series()
+    df_feature = feature_util.make_features(
+        df.assign(target=np.where(is_forecast, np.nan, df['target'])), **FEATURE_PARAMS)
+
+    cols = feature_cols(df_feature)
+    is_masked = df_feature['target'].isna().to_numpy()
+    pos = feature_util.series_position(df_feature)
+    is_train = ~is_masked & (pos >= max(LAGS) + max(WINDOWS))
+
+    forecast_nan = df_feature.loc[is_masked, cols].isna().mean()
+    train_nan = df_feature.loc[is_train, cols].isna().mean()
+    assert (forecast_nan <= train_nan).all(), forecast_nan[forecast_nan > train_nan]
+    assert forecast_nan.max() == 0.0
+
+
+def test_update_features_matches_make_features():
+    # 差分更新の予測対象の特徴量は、全履歴から作成した特徴量と一致する
+    df, is_forecast = make_series()
+    df_history = df.loc[~is_forecast]
+    df_forecast = df.loc[is_forecast].assign(target=np.nan)
+    df_feature = feature_util.make_features(
+        pd.concat([df_history, df_forecast], axis=0, ignore_index=True), **FEATURE_PARAMS)
+
+    # 最後の100日分を差分更新する
+    is_old = df_history['nichi'] <= np.sort(df_history['nichi'].unique())[-101]
+    state = feature_util.build_feature_state(df_history.loc[is_old], **FEATURE_PARAMS)
+    _, df_forecast_feature, _ = feature_util.update_features(
+        df_history.loc[~is_old], state, df_forecast)
+
+    cols = feature_cols(df_feature)
+    expected = df_feature.loc[df_feature['target'].isna(), cols].reset_index(drop=True)
+    pd.testing.assert_frame_equal(df_forecast_feature[cols], expected)
+
+
+def test_short_lags_are_rejected():
+    # shift より短いラグは予測対象の行で欠損になるためエラー
+    df, _ = make_series()
+    with pytest.raises(ValueError):
+        feature_util.make_features(df, lags=[1, 30], windows=WINDOWS, shift=SHIFT)
+
+
+def test_forecast_longer_than_shift_is_rejected():
+    # 予測対象が shift 行を超える場合はエラー
+    df, is_forecast = make_series()
+    df_forecast = df.loc[is_forecast].assign(target=np.nan)
+    with pytest.raises(ValueError):
+        feature_util.check_forecast_horizon(df_forecast, SHIFT - 1)
+
+
+def test_holidays_are_flagged():
+    # 祝日の一覧の日付は休日、その前後の日は休日の前日・翌日になる（2020-02-10 は月曜日）
+    df = pd.DataFrame({'nichi': [20200210, 20200211, 20200212]})
+    df = feature_util.add_calendar_features(df, holidays=HOLIDAYS)
+    assert df['is_holiday'].tolist() == [0, 1, 0]
+    assert df['is_dayoff'].tolist() == [0, 1, 0]
+    assert df['is_before_holiday'].tolist() == [1, 0, 0]
+    assert df['is_after_holiday'].tolist() == [1, 0, 1]
+
+
+def test_holidays_must_cover_every_year():
+    # 祝日の一覧にない年の日付はエラー（祝日が平日として扱われるため）
+    df = pd.DataFrame({'nichi': [20201231, 20210101]})
+    with pytest.raises(ValueError):
+        feature_util.add_calendar_features(df, holidays=HOLIDAYS)
+
+
+def test_missing_holiday_source_is_rejected(monkeypatch):
+    # 祝日の一覧がなく jpholiday もない場合はエラー
+    monkeypatch.setattr(feature_util, 'jpholiday', None)
+    df = pd.DataFrame({'nichi': [20200211]})
+    with pytest.raises(ValueError):
+        feature_util.add_calendar_features(df)
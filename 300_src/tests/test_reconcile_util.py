@@ -0,0 +1,69 @@
+# ------------------------------------------------------------
+# 処理名  ： reconcile_util のテスト
+# 作成日  ： 2026.10.18
+# 処理概要： wls_var の重みが各階層の予測値の残差から算出されることを確認する
+#            - 実行方法：300_src で python -m pytest -q tests
+# ------------------------------------------------------------
+import numpy as np
+import pandas as pd
+
+from util import reconcile_util
+
+
+def make_bottom(n_days=84):
+    '''
+    2店舗 × 2商品の日次の疑似データ（曜日ごとに一定の値）
+    '''
+    dates = pd.date_range('2020-01-06', periods=n_days, freq='D')
+    frames = []
+    for base, (mise, item) in enumerate([('X', 'A'), ('X', 'B'), ('Y', 'A'), ('Y', 'B')]):
+        frames.append(pd.DataFrame({
+            'nichi': dates.strftime('%Y%m%d').astype(np.int64),
+            'group_mise': mise,
+            'group_item': item,
+            'target': (10.0 * (base + 1) + dates.dayofweek).astype(np.float64),
+        }))
+
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+
+def test_seasonal_residuals_use_only_days_before_cutoff():
+    # 曜日ごとに一定の系列は、簡易予測の残差が0になる
+    df = make_bottom()
+    summing, df_nodes = reconcile_util.build_summing_matrix(df)
+    y_history, history_days = reconcile_util.to_node_matrix(df, summing, df_nodes)
+
+    cutoffs = [history_days[41], history_days[55]]
+    residuals = reconcile_util.seasonal_residuals(y_history, history_days, cutoffs, 14)
+    assert residuals.shape == (len(df_nodes), 28)
+    np.testing.assert_allclose(residuals, 0.0)
+
+    # 予測期間の実績を変えても、予測値（= 実績 - 残差）は変わらない
+    y_shock = y_history.copy()
+    y_shock[:, 42:] += 100.0
+    shocked = reconcile_util.seasonal_residuals(y_shock, history_days, cutoffs[:1], 14)
+    np.testing.assert_allclose(shocked, 100.0)
+
+
+def test_bottom_variance_is_per_series():
+    # 最下層の分散は系列ごとの残差の2乗平均、残差のない系列はNaN
+    df = make_bottom()
+    summing, df_nodes = reconcile_util.build_summing_matrix(df)
+    df_result = pd.DataFrame({
+        'cutoff': 20200301,
+        'nichi': [20200302, 20200303, 20200302],
+        'group_mise': ['X', 'X', 'Y'],
+        'group_item': ['A', 'A', 'B'],
+        'target': [10.0, 20.0, 5.0],
+        'pred': [12.0, 16.0, 5.0],
+    })
+    variances = reconcile_util.bottom_variance(df_result, summing, df_nodes)
+
+    df_bottom = df_nodes.iloc[-summing.shape[1]:].reset_index(drop=True)
+    expected = {('X', 'A'): 10.0, ('Y', 'B'): 0.0}
+    for i, row in df_bottom.iterrows():
+        key = (row['group_mise'], row['group_item'])
+        if key in expected:
+            assert variances[i] == expected[key]
+        else:
+            assert np.isnan(variances[i])
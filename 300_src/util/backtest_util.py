@@ -0,0 +1,543 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】時系列バックテスト Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 予測の基準日（cutoff）を複数設定し、基準日までの実績で学習、
+#            基準日の翌日から horizon 日間を予測して精度を評価する
+#            - 特徴量は最初の基準日までを1度だけ作成し、以降の基準日は
+#              差分更新（feature_util.update_features）で作成する
+#            - 予測期間の特徴量は実績を欠損にして作成する（本番の予測と同じ条件）
+#              （時系列CVの検証の行も同じ方法で作成する）
+#            - 基準日ごとの学習はプロセスプールで同時に実行する
+# ------------------------------------------------------------
+# ライブラリのインポート
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from util import feature_util
+
+# 予測期間の日数（test.csv の予測期間と同程度）
+HORIZON = 30
+
+# 子プロセスへ引き継ぐバックテストデータ（forkで共有する）
+# (実績の特徴量, 実績の経過日数, 基準日ごとの予測期間の特徴量, 学習・予測関数, 学習期間の日数)
+g_backtest_data = None
+
+
+# ------------------------------------------------------------
+# [バックテスト] 基準日の作成
+# ------------------------------------------------------------
+def make_cutoffs(dates, n_cutoffs, horizon=HORIZON, step=None):
+    '''
+    実績の最終日から horizon 日前を最後の基準日とし、step 日ずつ遡って
+    基準日を作成する
+
+    Parameters
+    ----------
+    dates : Series
+        実績の日付（yyyymmdd の整数 or datetime64）
+    n_cutoffs : int
+        基準日の数
+    horizon : int
+        予測期間の日数
+    step : int
+        基準日の間隔の日数（Noneの場合は horizon）
+
+    Returns
+    ----------
+    cutoffs : list
+        基準日（1970-01-01からの経過日数、昇順）
+
+    Example
+    ----------
+    使用方法：
+    cutoffs = backtest_util.make_cutoffs(df_train['nichi'], 4, horizon=30)
+
+    '''
+    days = feature_util.to_epoch_days(dates)
+    step = horizon if step is None else step
+    last = int(days.max()) - horizon
+
+    cutoffs = [last - step * i for i in reversed(range(n_cutoffs))]
+    cutoffs = [cutoff for cutoff in cutoffs if cutoff >= days.min()]
+    if not cutoffs:
+        raise ValueError('基準日を作成できる期間がありません')
+
+    return cutoffs
+
+
+def time_series_folds(dates, cutoffs, horizon=HORIZON, window=None):
+    '''
+    基準日ごとの学習・検証の行番号を作成する（シャッフルしたKFoldの代わり）
+    - 学習：基準日以前（window 指定時は基準日から window 日間）
+    - 検証：基準日の翌日から horizon 日間
+
+    Parameters
+    ----------
+    dates : Series
+        行ごとの日付
+    cutoffs : list
+        基準日（経過日数）
+    horizon : int
+        予測期間の日数
+    window : int
+        学習期間の日数（Noneの場合は基準日以前の全期間）
+
+    Returns
+    ----------
+    fold_idx : list
+        基準日ごとの (trainの行番号, valの行番号)
+
+    '''
+    days = feature_util.to_epoch_days(dates)
+    fold_idx = []
+    for cutoff in cutoffs:
+        is_train = _train_mask(days, cutoff, window)
+        is_val = (days > cutoff) & (days <= cutoff + horizon)
+        fold_idx.append((np.flatnonzero(is_train), np.flatnonzero(is_val)))
+
+    return fold_idx
+
+
+def _train_mask(days, cutoff, window):
+    '''
+    基準日の学習期間の行（window がNoneの場合は拡張窓、指定時はスライド窓）
+    '''
+    is_train = days <= cutoff
+    if window is not None:
+        is_train &= days > cutoff - window
+    return is_train
+
+
+# ------------------------------------------------------------
+# [バックテスト] 基準日ごとの特徴量の作成
+# ------------------------------------------------------------
+def build_cutoff_features(logger, df, cutoffs, horizon=HORIZON, target_col='target',
+                          key_col=feature_util.KEY_COL, date_col=feature_util.DATE_COL,
+                          **feature_params):
+    '''
+    実績の特徴量と、基準日ごとの予測期間の特徴量を作成する
+    - 最初の基準日までの実績は全履歴から作成し、以降は基準日の間の
+      新しい実績のみを差分更新で作成する（全履歴の作り直しはしない）
+    - 予測期間の特徴量は、基準日の状態から実績を欠損として作成する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df : DataFrame
+        実績データ（日付・系列キー・ターゲット）
+    cutoffs : list
+        基準日（経過日数、昇順）
+    horizon : int
+        予測期間の日数
+    target_col : str
+        ターゲットのカラム名
+    key_col : list
+        系列キーのカラム名
+    date_col : str
+        日付のカラム名
+    feature_params : dictionary
+        feature_util.make_features に渡すパラメータ（lags, windows など）
+
+    Returns
+    ----------
+    df_history_feature : DataFrame
+        最後の基準日までの実績の特徴量
+    forecasts : list
+        基準日ごとの予測期間の特徴量（ターゲットは実績の値）
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+
+        logger.info('--[backtest_util：build_cutoff_features]--------------------')
+
+        df = df[list(key_col) + [date_col, target_col]]
+        days = feature_util.to_epoch_days(df[date_col])
+
+        # 最初の基準日までの実績（全履歴から作成）
+        is_first = days <= cutoffs[0]
+        frames = [feature_util.make_features(
+            df.loc[is_first], target_col, key_col, date_col, **feature_params)]
+        state = feature_util.build_feature_state(
+            df.loc[is_first], target_col, key_col, date_col, **feature_params)
+
+        forecasts = []
+        prev = cutoffs[0]
+        for cutoff in cutoffs:
+            # 前の基準日から今回の基準日までの実績のみで状態を更新する
+            df_new = df.loc[(days > prev) & (days <= cutoff)]
+
+            # 予測期間は実績を欠損にして作成し、評価用に実績を戻す
+            is_forecast = (days > cutoff) & (days <= cutoff + horizon)
+            df_forecast = df.loc[is_forecast].assign(**{target_col: np.nan})
+            df_new_feature, df_forecast_feature, state = \
+                feature_util.update_features(df_new, state, df_forecast)
+
+            row = pd.MultiIndex.from_frame(df.loc[is_forecast, list(key_col) + [date_col]]) \
+                .get_indexer(pd.MultiIndex.from_frame(
+                    df_forecast_feature[list(key_col) + [date_col]]))
+            df_forecast_feature[target_col] = \
+                df.loc[is_forecast, target_col].to_numpy()[row]
+
+            if cutoff != cutoffs[0]:
+                frames.append(df_new_feature)
+            forecasts.append(df_forecast_feature)
+            prev = cutoff
+
+            logger.info('CUTOFF: {} NEW:{} FORECAST:{}'.format(
+                to_ymd([cutoff])[0], len(df_new_feature), len(df_forecast_feature)))
+
+        df_history_feature = pd.concat(frames, axis=0, ignore_index=True)
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('SHAPE : ' + str(df_history_feature.shape))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return df_history_feature, forecasts
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [バックテスト] 時系列CVの検証の行の特徴量の作成
+# ------------------------------------------------------------
+def build_fold_features(logger, df_feature, cutoffs, horizon=HORIZON, window=None,
+                        target_col='target', key_col=feature_util.KEY_COL,
+                        date_col=feature_util.DATE_COL, **feature_params):
+    '''
+    時系列CVの各foldについて、検証の行の特徴量を基準日より後の実績を欠損にして
+    作り直し、学習データの後ろに追加する
+    - 特徴量ストアの特徴量は全実績から作成されているため、検証の行のラグ・移動窓が
+      基準日より後の実績を含む場合がある（検証の精度が本番より良くなる）
+    - 検証の行は build_cutoff_features の予測期間の特徴量（本番の予測と同じ条件）
+      で置き換え、それ以外のカラム（結合したカラムなど）は元の行の値を使う
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df_feature : DataFrame
+        学習データ（特徴量ストアの特徴量）
+    cutoffs : list
+        基準日（経過日数、昇順）
+    horizon : int
+        予測期間の日数
+    window : int
+        学習期間の日数（Noneの場合は基準日以前の全期間）
+    target_col : str
+        ターゲットのカラム名
+    key_col : list
+        系列キーのカラム名
+    date_col : str
+        日付のカラム名
+    feature_params : dictionary
+        feature_util.make_features に渡すパラメータ（lags, windows, shift など）
+
+    Returns
+    ----------
+    df_fold_feature : DataFrame
+        学習データの後ろに、foldごとの検証の行を追加したDataFrame
+    fold_idx : list
+        foldごとの (trainの行番号, valの行番号)（valは追加した行）
+
+    Example
+    ----------
+    使用方法：
+    df_fold_feature, fold_idx = backtest_util.build_fold_features(
+        g_logger, df_train, cutoffs, horizon=30, lags=[30, 35], windows=[7], shift=30)
+
+    '''
+    _, forecasts = build_cutoff_features(logger, df_feature, cutoffs, horizon,
+                                         target_col, key_col, date_col,
+                                         **feature_params)
+
+    key_date_col = list(key_col) + [date_col]
+    frames = [df_feature]
+    fold_idx = []
+    n_rows = len(df_feature)
+    for (trn_idx, val_idx), df_forecast in zip(
+            time_series_folds(df_feature[date_col], cutoffs, horizon, window), forecasts):
+
+        # 検証の行の、実績を欠損にして作成した特徴量で置き換える
+        df_val = df_feature.iloc[val_idx].reset_index(drop=True)
+        row = pd.MultiIndex.from_frame(df_forecast[key_date_col]) \
+            .get_indexer(pd.MultiIndex.from_frame(df_val[key_date_col]))
+        for col in df_forecast.columns:
+            if col in df_val.columns and col not in key_date_col + [target_col]:
+                df_val[col] = df_forecast[col].to_numpy()[row]
+
+        fold_idx.append((trn_idx, np.arange(n_rows, n_rows + len(df_val))))
+        frames.append(df_val)
+        n_rows += len(df_val)
+
+    return pd.concat(frames, axis=0, ignore_index=True), fold_idx
+
+
+# ------------------------------------------------------------
+# [バックテスト] 実行
+# ------------------------------------------------------------
+def run_backtest(logger, df, cutoffs, fit_predict, horizon=HORIZON, window=None,
+                 n_jobs=1, target_col='target', key_col=feature_util.KEY_COL,
+                 date_col=feature_util.DATE_COL, **feature_params):
+    '''
+    基準日ごとに学習・予測し、予測期間の予測値と実績を返す
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df : DataFrame
+        実績データ（日付・系列キー・ターゲット）
+    cutoffs : list
+        基準日（経過日数、昇順）
+    fit_predict : function
+        (学習期間の特徴量, 予測期間の特徴量, スレッド数) を受け取り、
+        予測値（ndarray）を返す関数（n_jobs > 1 の場合はモジュールの関数であること）
+        スレッド数は CPUコア数 / 同時に学習する基準日の数
+    horizon : int
+        予測期間の日数
+    window : int
+        学習期間の日数（Noneの場合は基準日以前の全期間）
+    n_jobs : int
+        同時に学習する基準日の数
+    target_col : str
+        ターゲットのカラム名
+    key_col : list
+        系列キーのカラム名
+    date_col : str
+        日付のカラム名
+    feature_params : dictionary
+        feature_util.make_features に渡すパラメータ
+
+    Returns
+    ----------
+    df_result : DataFrame
+        基準日・系列キー・日付・実績（target_col）・予測値（pred）
+
+    Example
+    ----------
+    使用方法：
+    df_result = backtest_util.run_backtest(g_logger, df_train, cutoffs, fit_predict,
+                                           horizon=30, n_jobs=4)
+
+    '''
+    global g_backtest_data
+
+    try:
+        # 特徴量の作成（基準日の順に差分更新する）
+        df_history_feature, forecasts = build_cutoff_features(
+            logger, df, cutoffs, horizon, target_col, key_col, date_col,
+            **feature_params)
+
+        # 計測開始
+        start = time.time()
+
+        logger.info('--[backtest_util：run_backtest]--------------------')
+        logger.info('CUTOFF: ' + str(len(cutoffs)) + ' WINDOW: '
+                    + ('expanding' if window is None else str(window) + '[day]'))
+
+        # 同時に学習する基準日の数で、CPUコアを分割する
+        n_jobs = max(1, min(n_jobs, len(cutoffs)))
+        nthread = max(1, multiprocessing.cpu_count() // n_jobs)
+
+        # 子プロセスへ引き継ぐバックテストデータをセット
+        g_backtest_data = (df_history_feature,
+                           feature_util.to_epoch_days(df_history_feature[date_col]),
+                           forecasts, fit_predict, window, nthread)
+
+        if n_jobs == 1:
+            preds = [_run_cutoff(i, cutoff) for i, cutoff in enumerate(cutoffs)]
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = [executor.submit(_run_cutoff, i, cutoff)
+                           for i, cutoff in enumerate(cutoffs)]
+                preds = [future.result() for future in futures]
+
+        # 予測期間の予測値と実績をまとめる
+        frames = []
+        for i, cutoff in enumerate(cutoffs):
+            df_cutoff = forecasts[i][list(key_col) + [date_col, target_col]].copy()
+            df_cutoff.insert(0, 'cutoff', to_ymd([cutoff])[0])
+            df_cutoff['pred'] = preds[i]
+            frames.append(df_cutoff)
+        df_result = pd.concat(frames, axis=0, ignore_index=True)
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('SHAPE : ' + str(df_result.shape))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return df_result
+
+    finally:
+        g_backtest_data = None
+
+
+def _run_cutoff(i, cutoff):
+    '''
+    1つの基準日について学習・予測する（子プロセスで実行される）
+    '''
+    df_history_feature, history_days, forecasts, fit_predict, window, nthread = \
+        g_backtest_data
+    df_train = df_history_feature.loc[_train_mask(history_days, cutoff, window)] \
+        .reset_index(drop=True)
+
+    return np.asarray(fit_predict(df_train, forecasts[i], nthread))
+
+
+# ------------------------------------------------------------
+# [バックテスト] 精度評価
+# ------------------------------------------------------------
+def evaluate(df_result, by=None, target_col='target', pred_col='pred'):
+    '''
+    予測値の RMSE / RMSLE を集計する（実績が欠損の行は除く）
+
+    Parameters
+    ----------
+    df_result : DataFrame
+        run_backtest の戻り値
+    by : list
+        集計単位のカラム名（Noneの場合は全体）
+    target_col : str
+        実績のカラム名
+    pred_col : str
+        予測値のカラム名
+
+    Returns
+    ----------
+    df_metric : DataFrame
+        集計単位ごとの件数・RMSE・RMSLE
+
+    '''
+    df_result = df_result.loc[df_result[target_col].notna()]
+    actual = df_result[target_col].to_numpy(dtype=np.float64)
+    pred = df_result[pred_col].to_numpy(dtype=np.float64)
+
+    # RMSLEは負の値を0として算出する
+    df_error = pd.DataFrame({
+        'n': np.ones(len(df_result), dtype=np.int64),
+        'rmse': (pred - actual) ** 2,
+        'rmsle': (np.log1p(np.maximum(pred, 0)) - np.log1p(np.maximum(actual, 0))) ** 2,
+    }, index=df_result.index)
+
+    if not by:
+        df_metric = pd.DataFrame({'n': [len(df_error)],
+                                  'rmse': [df_error['rmse'].mean()],
+                                  'rmsle': [df_error['rmsle'].mean()]})
+    else:
+        df_metric = df_error.join(df_result[by]).groupby(by, observed=True) \
+            .agg({'n': 'sum', 'rmse': 'mean', 'rmsle': 'mean'}).reset_index()
+    df_metric['rmse'] = np.sqrt(df_metric['rmse'])
+    df_metric['rmsle'] = np.sqrt(df_metric['rmsle'])
+
+    return df_metric
+
+
+def write_backtest(logger, df_result, model_dir, key_col=feature_util.KEY_COL):
+    '''
+    予測値と、基準日・系列キーごとの精度を出力する
+    - backtest_result.csv : 予測期間の予測値と実績
+    - backtest_cutoff.csv : 基準日ごとの精度
+    - backtest_<キー>.csv : 系列キーごとの精度（全基準日）
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df_result : DataFrame
+        run_backtest の戻り値
+    model_dir : str
+        出力先（600_model/<time>/）
+    key_col : list
+        系列キーのカラム名
+
+    Returns
+    ----------
+    metrics : dictionary
+        集計単位 → 精度のDataFrame
+
+    '''
+    try:
+        logger.info('--[backtest_util：write_backtest]--------------------')
+
+        metrics = {'cutoff': evaluate(df_result, ['cutoff'])}
+        for col in key_col:
+            metrics[col] = evaluate(df_result, [col])
+
+        df_result.to_csv(os.path.join(model_dir, 'backtest_result.csv'), index=False)
+        for name, df_metric in metrics.items():
+            path = os.path.join(model_dir, 'backtest_' + name + '.csv')
+            logger.info('PATH  : ' + path)
+            df_metric.to_csv(path, index=False)
+
+        # 基準日ごとの精度と全体の精度
+        for row in metrics['cutoff'].itertuples(index=False):
+            logger.info('CUTOFF {} RMSE:{:.3f} RMSLE:{:.3f}'.format(
+                row.cutoff, row.rmse, row.rmsle))
+        df_total = evaluate(df_result)
+        logger.info('TOTAL  RMSE:{:.3f} RMSLE:{:.3f}'.format(
+            df_total['rmse'][0], df_total['rmsle'][0]))
+
+    except Exception:
+        raise
+
+    else:
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return metrics
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [バックテスト] 日付の変換
+# ------------------------------------------------------------
+def to_ymd(days):
+    '''
+    経過日数を yyyymmdd の整数に変換する
+
+    Parameters
+    ----------
+    days : list
+        1970-01-01からの経過日数
+
+    Returns
+    ----------
+    ymd : ndarray
+        yyyymmdd の整数
+
+    '''
+    date = np.asarray(days, dtype=np.int64).astype('datetime64[D]')
+    month = date.astype('datetime64[M]')
+    year = month.astype('datetime64[Y]').astype(np.int64) + 1970
+    day = (date - month.astype('datetime64[D]')).astype(np.int64) + 1
+
+    return year * 10000 + (month.astype(np.int64) % 12 + 1) * 100 + day
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】時系列バックテスト Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,271 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】ベンチマーク Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 本番相当の規模（店舗数・商品数・日数）の疑似データを作成し、
+#            処理ごとの計測結果を基準値（baseline）と比較する
+#            - 疑似データは train.csv / test.csv / uriage.csv / kyaku.csv /
+#              food_uriage.csv / tenki.csv と同じカラム構成で作成する
+#              （学習時に結合するGISデータ・店マスタも店舗ごとに作成する）
+#            - 比較は複数回の計測の中央値で行い、比率と差の両方で判定する
+# ------------------------------------------------------------
+# ライブラリのインポート
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from util import backtest_util
+from util import feature_util
+
+# 疑似データの開始日と、予測対象（test）の日数
+START_DAY = 20180301
+TEST_DAYS = 30
+
+# 天気データのカラム
+TENKI_COL = ['kion_max', 'kion_min', 'kion_ave', 'kousuiryou']
+
+# GISデータ・店マスタの数値のカラム（GISデータは一部の店舗を欠損にする）
+GIS_COL = ['inhabitants', 'employees', 'households']
+MISE_COL = ['floor_area', 'seats']
+GIS_MISSING_RATE = 0.05
+
+# 基準値に対して遅くなったと判定する比率
+TOLERANCE = 0.2
+
+# 基準値と比較する計測項目（メモリはステージ開始時からの最大の増分）
+COMPARE_COL = ['wall_sec', 'peak_rss_delta_mb']
+
+# 悪化と判定する最小の差（短い処理の揺らぎを悪化と判定しない）
+MIN_DELTA = {'wall_sec': 0.5, 'peak_rss_delta_mb': 50.0}
+
+
+# ------------------------------------------------------------
+# [ベンチマーク] 疑似データの作成
+# ------------------------------------------------------------
+def make_synthetic_data(n_mise, n_item, n_days, start_day=START_DAY,
+                        test_days=TEST_DAYS, seed=2020):
+    '''
+    店舗×商品×日付の疑似データを作成する
+    - ターゲットは 店舗の規模 × 商品の人気 × 曜日・季節の変動 × ノイズ
+
+    Parameters
+    ----------
+    n_mise : int
+        店舗数
+    n_item : int
+        商品数
+    n_days : int
+        実績（train）の日数
+    start_day : int
+        開始日（yyyymmdd）
+    test_days : int
+        予測対象（test）の日数
+    seed : int
+        乱数のシード
+
+    Returns
+    ----------
+    data : dictionary
+        ファイル名（拡張子なし） → DataFrame
+        train, test, uriage, kyaku, food_uriage, tenki, gis, mise
+
+    Example
+    ----------
+    使用方法：
+    data = bench_util.make_synthetic_data(1000, 100, 730)
+
+    '''
+    rng = np.random.RandomState(seed)
+    first = int(feature_util.to_epoch_days(pd.Series([start_day]))[0])
+    days = np.arange(first, first + n_days + test_days)
+    nichi = backtest_util.to_ymd(days)
+    mise = np.array(['M{:05d}'.format(i) for i in range(n_mise)])
+    item = np.array(['I{:04d}'.format(i) for i in range(n_item)])
+
+    # 日付 × 店舗 × 商品 の順（train.csv と同じ並び）
+    n_series = n_mise * n_item
+    day_idx = np.repeat(np.arange(len(days)), n_series)
+    mise_idx = np.tile(np.repeat(np.arange(n_mise), n_item), len(days))
+    item_idx = np.tile(np.arange(n_item), len(days) * n_mise)
+
+    scale = rng.lognormal(3.0, 0.5, n_mise)[mise_idx] \
+        * rng.lognormal(0.0, 0.7, n_item)[item_idx]
+    weekly = 1.0 + 0.3 * ((days[day_idx] + 3) % 7 >= 5)
+    yearly = 1.0 + 0.2 * np.sin(2 * np.pi * days[day_idx] / 365.25)
+    target = np.round(scale * weekly * yearly * rng.lognormal(0.0, 0.2, len(day_idx)))
+
+    df_all = pd.DataFrame({'nichi': nichi[day_idx], 'group_mise': mise[mise_idx],
+                           'group_item': item[item_idx], 'target': target})
+    is_test = day_idx >= n_days
+    df_train = df_all.loc[~is_test].reset_index(drop=True)
+    df_test = df_all.loc[is_test].reset_index(drop=True)
+    df_test['target'] = np.nan
+
+    # 店舗×日付のサイドテーブル
+    df_mise_day = pd.DataFrame({'nichi': np.repeat(nichi, n_mise),
+                                'group_mise': np.tile(mise, len(days))})
+    data = {'train': df_train, 'test': df_test}
+    for name in ('uriage', 'kyaku', 'food_uriage'):
+        col = name + ('_wariai' if name == 'food_uriage' else '_param')
+        data[name] = df_mise_day.assign(**{col: rng.rand(len(df_mise_day)).round(5)})
+
+    # 日付のサイドテーブル
+    df_tenki = pd.DataFrame({'nichi': nichi})
+    for col in TENKI_COL:
+        df_tenki[col] = rng.randint(0, 35, len(days))
+    data['tenki'] = df_tenki
+
+    # 店舗のサイドテーブル（GISデータ・店マスタ）
+    df_gis = pd.DataFrame({'group_mise': mise})
+    for col in GIS_COL:
+        df_gis[col] = rng.randint(100, 100000, n_mise).astype(np.float64)
+    df_gis.loc[rng.rand(n_mise) < GIS_MISSING_RATE, GIS_COL[:2]] = np.nan
+    data['gis'] = df_gis
+
+    data['mise'] = pd.DataFrame({'group_mise': mise,
+                                 'floor_area': rng.randint(50, 500, n_mise),
+                                 'seats': rng.randint(0, 80, n_mise),
+                                 'mise_type': rng.choice(['A', 'B', 'C'], n_mise)})
+
+    return data
+
+
+def write_synthetic_data(logger, data, data_dir):
+    '''
+    疑似データをcsv形式で出力する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    data : dictionary
+        make_synthetic_data の戻り値
+    data_dir : str
+        出力先のディレクトリ
+
+    Returns
+    ----------
+    file_data_dict : dictionary
+        ファイル名（拡張子なし） → file_util の読込対象のファイルの情報
+
+    '''
+    os.makedirs(data_dir, exist_ok=True)
+
+    file_data_dict = {}
+    for name, df in data.items():
+        df.to_csv(os.path.join(data_dir, name + '.csv'), index=False)
+        file_data_dict[name] = {'file_dir': os.path.join(data_dir, ''), 'file_name': name + '.csv',
+                                'usecols': None, 'dtype': None}
+        logger.info('{:<12}: {}'.format(name, df.shape))
+
+    return file_data_dict
+
+
+# ------------------------------------------------------------
+# [ベンチマーク] 基準値との比較
+# ------------------------------------------------------------
+def summarize_runs(df_runs):
+    '''
+    複数回の計測結果を、規模（scale）・ステージごとの中央値にまとめる
+
+    Parameters
+    ----------
+    df_runs : DataFrame
+        計測結果（scale, stage, repeat と計測項目を含む、1行が1回の計測）
+
+    Returns
+    ----------
+    df_bench : DataFrame
+        規模・ステージごとの計測項目の中央値と計測回数（n_runs）
+
+    '''
+    value_col = [col for col in df_runs.columns
+                 if col not in ('scale', 'stage', 'repeat')
+                 and pd.api.types.is_numeric_dtype(df_runs[col])]
+    group = df_runs.groupby(['scale', 'stage'], sort=False)
+
+    df_bench = group[value_col].median().reset_index()
+    df_bench['n_runs'] = group.size().to_numpy()
+
+    return df_bench
+
+
+def compare_baseline(df_bench, baseline_path, tolerance=TOLERANCE, min_delta=None):
+    '''
+    計測結果を基準値と比較し、基準値より tolerance 以上、かつ min_delta 以上
+    悪化した処理を判定する
+    - 基準値は規模（scale）とステージ名が同じ計測結果と比較する
+
+    Parameters
+    ----------
+    df_bench : DataFrame
+        計測結果（scale, stage と COMPARE_COL の項目を含む）
+    baseline_path : str
+        基準値のファイル（JSON）
+    tolerance : float
+        悪化と判定する比率
+    min_delta : dictionary
+        計測項目 → 悪化と判定する最小の差（Noneの場合は MIN_DELTA）
+
+    Returns
+    ----------
+    df_compare : DataFrame
+        計測結果に基準値・比率・悪化の判定（regression）を追加したもの
+
+    '''
+    min_delta = dict(MIN_DELTA, **(min_delta or {}))
+
+    df_compare = df_bench.copy()
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as json_file:
+            baseline = json.load(json_file)
+
+    df_compare['regression'] = False
+    for col in COMPARE_COL:
+        base = [baseline.get(scale, {}).get(stage, {}).get(col)
+                for scale, stage in zip(df_compare['scale'], df_compare['stage'])]
+        df_compare['base_' + col] = pd.to_numeric(pd.Series(base, dtype=object),
+                                                  errors='coerce').to_numpy()
+        df_compare['ratio_' + col] = df_compare[col] / df_compare['base_' + col]
+        is_worse = (df_compare['ratio_' + col] > 1 + tolerance) \
+            & (df_compare[col] - df_compare['base_' + col] > min_delta.get(col, 0))
+        df_compare['regression'] |= is_worse.fillna(False).to_numpy()
+
+    return df_compare
+
+
+def write_baseline(df_bench, baseline_path):
+    '''
+    計測結果を基準値として出力する（同じ規模の基準値は上書きする）
+
+    Parameters
+    ----------
+    df_bench : DataFrame
+        計測結果
+    baseline_path : str
+        基準値のファイル（JSON）
+
+    Returns
+    ----------
+    None
+
+    '''
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as json_file:
+            baseline = json.load(json_file)
+
+    for row in df_bench.to_dict(orient='records'):
+        baseline.setdefault(row['scale'], {})[row['stage']] = \
+            {col: row[col] for col in COMPARE_COL}
+
+    os.makedirs(os.path.dirname(baseline_path) or '.', exist_ok=True)
+    with open(baseline_path, 'w') as json_file:
+        json.dump(baseline, json_file, indent=2)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】ベンチマーク Util関数  ★★★★★★
+# ------------------------------------------------------------
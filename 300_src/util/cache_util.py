@@ -0,0 +1,296 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】キャッシュ Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 入力ファイルの内容ハッシュと結合仕様をキーとして
+#            加工済みDataFrameをディスクにキャッシュする
+# ------------------------------------------------------------
+# ライブラリのインポート
+import hashlib
+import json
+import os
+import pickle
+import time
+
+# キャッシュのデフォルト格納先（300_src からの相対パス）
+CACHE_DIR = '../400_features/cache/'
+
+# キャッシュの上限（件数・合計バイト数）
+MAX_ENTRIES = 8
+MAX_BYTES = 4 * 1024 ** 3
+
+# ファイルハッシュの索引ファイル名
+HASH_INDEX_NAME = 'file_hash.json'
+
+# キャッシュファイルの拡張子
+CACHE_EXT = '.pkl'
+
+
+# ------------------------------------------------------------
+# [キャッシュ] キーの作成
+# ------------------------------------------------------------
+def get_cache_key(file_data_list, spec, cache_dir=CACHE_DIR):
+    '''
+    入力ファイルの内容ハッシュと加工仕様からキャッシュキーを作成する
+    - 入力ファイルのいずれかが変更されると別のキーになる
+    - 加工仕様（結合キー、dropna対象など）が変わっても別のキーになる
+
+    Parameters
+    ----------
+    file_data_list : list
+        入力ファイルの情報（file_util.load_csv と同じ dictionary）のリスト
+    spec : dictionary
+        加工仕様（JSONに変換できること）
+    cache_dir : str
+        キャッシュの格納先ディレクトリ
+
+    Returns
+    ----------
+    key : str
+        キャッシュキー
+
+    Example
+    ----------
+    使用方法：
+    key = cache_util.get_cache_key([g_par.INPUT_GIS_DATA], {'dropna': ['employees']})
+
+    '''
+    sha = hashlib.sha256()
+
+    for file_data in file_data_list:
+        path = file_data['file_dir'] + file_data['file_name']
+        sha.update(_hash_file(path, cache_dir).encode('utf8'))
+        # usecols / dtype も読込結果に影響するためキーに含める
+        sha.update(json.dumps(file_data, sort_keys=True,
+                              default=str).encode('utf8'))
+
+    sha.update(json.dumps(spec, sort_keys=True, default=str).encode('utf8'))
+
+    return sha.hexdigest()
+
+
+# ------------------------------------------------------------
+# [キャッシュ] 読込
+# ------------------------------------------------------------
+def load_cache(logger, key, cache_dir=CACHE_DIR):
+    '''
+    キャッシュキーに対応するDataFrameを取得する
+    - 取得したキャッシュは最終利用日時を更新する（LRUの判定に利用）
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    key : str
+        キャッシュキー
+    cache_dir : str
+        キャッシュの格納先ディレクトリ
+
+    Returns
+    ----------
+    df : DataFrame
+        キャッシュされたDataFrame（キャッシュがない場合はNone）
+
+    '''
+    # 計測開始
+    start = time.time()
+
+    path = os.path.join(cache_dir, key + CACHE_EXT)
+
+    logger.info('--[cache_util：load_cache]--------------------')
+    logger.info('PATH  : ' + path)
+
+    if not os.path.exists(path):
+        logger.info('CACHE : MISS')
+        logger.info('------------------------------------')
+        logger.info('')
+        return None
+
+    try:
+        with open(path, 'rb') as pickle_file:
+            df = pickle.load(pickle_file)
+
+    except Exception:
+        # 壊れたキャッシュは削除して再作成させる
+        logger.warning('キャッシュの読込に失敗したため削除します : ' + path)
+        os.remove(path)
+        return None
+
+    # 最終利用日時の更新
+    os.utime(path, None)
+
+    # ログ出力
+    logger.info('CACHE : HIT')
+    logger.info('SHAPE : ' + str(df.shape))
+    logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+    logger.info('------------------------------------')
+    logger.info('')
+
+    return df
+
+
+# ------------------------------------------------------------
+# [キャッシュ] 書込
+# ------------------------------------------------------------
+def write_cache(logger, df, key, cache_dir=CACHE_DIR,
+                max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+    '''
+    DataFrameをキャッシュに出力し、上限を超えた古いキャッシュを削除する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df : DataFrame
+        出力対象のDataFrame
+    key : str
+        キャッシュキー
+    cache_dir : str
+        キャッシュの格納先ディレクトリ
+    max_entries : int
+        保持するキャッシュの最大件数
+    max_bytes : int
+        保持するキャッシュの最大合計バイト数
+
+    Returns
+    ----------
+    None
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, key + CACHE_EXT)
+
+        logger.info('--[cache_util：write_cache]--------------------')
+        logger.info('PATH  : ' + path)
+        logger.info('SHAPE : ' + str(df.shape))
+
+        # 一時ファイルに出力してから置き換える
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as pickle_file:
+            pickle.dump(df, pickle_file, protocol=4)
+        os.replace(tmp_path, path)
+
+        # 上限を超えたキャッシュの削除
+        _evict(logger, cache_dir, max_entries, max_bytes, key + CACHE_EXT)
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [キャッシュ] 削除（LRU）
+# ------------------------------------------------------------
+def _evict(logger, cache_dir, max_entries, max_bytes, keep_name):
+    '''
+    最終利用日時の古い順に、件数・合計バイト数の上限まで削除する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    cache_dir : str
+        キャッシュの格納先ディレクトリ
+    max_entries : int
+        保持するキャッシュの最大件数
+    max_bytes : int
+        保持するキャッシュの最大合計バイト数
+    keep_name : str
+        削除対象外とするキャッシュファイル名（今回出力した分）
+
+    Returns
+    ----------
+    None
+
+    '''
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if not file_name.endswith(CACHE_EXT):
+            continue
+        stat = os.stat(os.path.join(cache_dir, file_name))
+        # 今回出力した分は常に先頭に並べる
+        mtime = float('inf') if file_name == keep_name else stat.st_mtime
+        entries.append((mtime, stat.st_size, file_name))
+
+    # 新しい順に並べて、上限を超えた分を削除する
+    entries.sort(reverse=True)
+    total_bytes = 0
+    for i, (_, size, file_name) in enumerate(entries):
+        total_bytes += size
+        if i >= max_entries or (i > 0 and total_bytes > max_bytes):
+            logger.info('EVICT : ' + file_name)
+            os.remove(os.path.join(cache_dir, file_name))
+
+
+# ------------------------------------------------------------
+# [キャッシュ] ファイルハッシュの取得
+# ------------------------------------------------------------
+def _hash_file(path, cache_dir):
+    '''
+    ファイル内容のハッシュを取得する
+    - サイズと更新日時が前回と同じ場合は、索引に記録したハッシュを再利用する
+
+    Parameters
+    ----------
+    path : str
+        対象ファイルのパス
+    cache_dir : str
+        キャッシュの格納先ディレクトリ（索引の格納先）
+
+    Returns
+    ----------
+    digest : str
+        ファイル内容のハッシュ
+
+    '''
+    stat = os.stat(path)
+    abs_path = os.path.abspath(path)
+    index_path = os.path.join(cache_dir, HASH_INDEX_NAME)
+
+    # 索引の読込
+    index = {}
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'r', encoding='utf8') as f:
+                index = json.load(f)
+        except ValueError:
+            index = {}
+
+    entry = index.get(abs_path)
+    if entry is not None and entry['size'] == stat.st_size \
+            and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    # ファイル内容のハッシュを計算する
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    # 索引の更新
+    index[abs_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                       'sha256': digest}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+    return digest
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】キャッシュ Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -1,69 +1,405 @@
-'''coding:utf-8'''
 # ------------------------------------------------------------
-# 処理名  ： パイプライン実行
-# 作成者  ： NRI藤田一樹
-# 作成日  ： 2020/08/30
-# 処理概要： AIモデルパイプライン処理
+# 処理名  ： 【共通】アプリケーション実行環境 Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 各スクリプトの初期処理（start_app）・終了処理（end_app）
+#            - 100_config/config のパラメーター（g_par）を読み込む
+#              （解析済みの結果をキャッシュし、configの変更時のみ解析し直す）
+#            - 800_log/ へのログ出力を設定する
+#            - 重いライブラリ（lightgbm, sklearn, matplotlib, seaborn）は
+#              lazy_import で最初に使う時点まで読込を遅らせる
+#            - 起動時間（プロセス開始 → start_app）を計測・出力する
 # ------------------------------------------------------------
 # ライブラリのインポート
+import ast
+import copy
+import datetime
+import importlib
+import logging
 import os
+import pickle
 import sys
-import traceback
+import time
+import types
 
-from util import conv_util
+from util import profile_util
 
-# グローバル変数定義
-g_bt_ymd = ''
-g_par = None
-g_logger = None
-g_python_name = os.path.basename(__file__)
-g_list = [None] * conv_util.VAR_LIST_SIZE
+# 300_src のディレクトリ（config内の相対パスの基準）
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# configファイルと、解析済みのキャッシュ
+CONFIG_PATH = os.path.join(SRC_DIR, '..', '100_config', 'config')
+CONFIG_CACHE_PATH = os.path.join(SRC_DIR, '..', '100_config', 'config.cache')
+
+# ログの書式
+LOG_FORMAT = '%(asctime)s %(levelname)-7s [%(name)s] %(message)s'
+
+# g_list の格納位置
+IDX_START = 0  # start_app の開始時刻
+IDX_PYTHON_NAME = 1  # スクリプト名
+IDX_BT_YMD = 2  # 処理日
+IDX_LOGGER = 3  # logger
+IDX_HANDLERS = 4  # start_app で追加したログのハンドラー
+VAR_LIST_SIZE = 5
+
+# プロセス内で解析済みのconfig（同じプロセスで複数回 start_app する場合に使い回す）
+# (configの更新日時, サイズ) → パラメーターのdictionary
+g_config = {}
+
+# プロセス内の start_app の呼出回数（起動時間は最初の呼出のみ計測する）
+g_app_count = 0
 
 
 # ------------------------------------------------------------
-# ★★★★★★  メイン処理部分  ★★★★★★
+# [実行環境] 初期処理
 # ------------------------------------------------------------
-def main():
+def start_app(python_name, g_list, config_path=CONFIG_PATH):
+    '''
+    パラメーターの読込・ログの設定を行い、アプリ内で利用するグローバル変数を返す
+
+    Parameters
+    ----------
+    python_name : str
+        スクリプト名（ログのファイル名・logger名に使う）
+    g_list : list
+        終了処理に引き継ぐ変数の格納先（VAR_LIST_SIZE の長さ）
+    config_path : str
+        configファイル
+
+    Returns
+    ----------
+    bt_ymd : str
+        処理日（yyyymmdd、config の BT_YMD が None の場合は当日）
+    par : SimpleNamespace
+        パラメーター（g_par.TARGET_COL のように参照する）
+    logger : logger object
+        ログ出力用のlogger
+
+    Example
+    ----------
+    使用方法：
+    g_bt_ymd, g_par, g_logger = conv_util.start_app(g_python_name, g_list)
+
+    '''
+    global g_app_count
+
+    # 計測開始
+    start = time.time()
+    g_app_count += 1
+    uptime = _process_uptime() if g_app_count == 1 else None
+
+    # パラメーターの読込
+    config, cache_status = load_config(config_path)
+    par = types.SimpleNamespace(**config)
+    config_sec = time.time() - start
+
+    bt_ymd = str(par.BT_YMD) if par.BT_YMD else datetime.date.today().strftime('%Y%m%d')
+
+    # ログの設定
+    log_dir = _resolve_path(par.LOG_DIR)
+    logger, handlers = _setup_logger(python_name, bt_ymd, log_dir, par.LOG_LEVEL)
+
+    # 計測結果の出力先・cProfile の対象ステージ
+    profile_util.configure(log_dir, par.PROFILE_STAGES)
+
+    g_list[IDX_START] = start
+    g_list[IDX_PYTHON_NAME] = python_name
+    g_list[IDX_BT_YMD] = bt_ymd
+    g_list[IDX_LOGGER] = logger
+    g_list[IDX_HANDLERS] = handlers
+
+    # ログ出力
+    logger.info('========================================')
+    logger.info('開始 ' + python_name + ' BT_YMD=' + bt_ymd)
+    logger.info('CONFIG: {} ({}) {:.3f}[sec]'.format(
+        os.path.normpath(config_path), cache_status, config_sec))
+    if uptime is not None:
+        # プロセス開始からの経過時間（インタープリターの起動・importを含む）
+        logger.info('STARTUP: {:.2f}[sec] cpu:{:.2f}[sec]'.format(
+            uptime, time.process_time()))
+        profile_util.record('startup', uptime, time.process_time(),
+                            config_cache=cache_status)
+
+    return bt_ymd, par, logger
+
+
+# ------------------------------------------------------------
+# [実行環境] 終了処理
+# ------------------------------------------------------------
+def end_app(g_list):
+    '''
+    処理時間を出力し、start_app で追加したログのハンドラーを閉じる
+
+    Parameters
+    ----------
+    g_list : list
+        start_app で設定した変数
+
+    Returns
+    ----------
+    None
+
+    Example
+    ----------
+    使用方法：
+    conv_util.end_app(g_list)
+
+    '''
+    logger = g_list[IDX_LOGGER]
+    if logger is None:
+        return
+
+    logger.info('終了 ' + str(g_list[IDX_PYTHON_NAME]))
+    logger.info('TIME  : {:.2f}'.format(time.time() - g_list[IDX_START]) + '[sec]')
+
+    for handler in g_list[IDX_HANDLERS] or []:
+        logger.removeHandler(handler)
+        handler.close()
+
+    g_list[IDX_LOGGER] = None
+    g_list[IDX_HANDLERS] = None
+
+
+# ------------------------------------------------------------
+# [実行環境] パラメーターの読込
+# ------------------------------------------------------------
+def load_config(config_path=CONFIG_PATH, cache_path=None):
+    '''
+    configファイルのパラメーターを読み込む
+    - 解析済みの結果はプロセス内・ディスク（config.cache）の順に参照し、
+      configの更新日時・サイズが変わった場合のみ解析し直す
+
+    Parameters
+    ----------
+    config_path : str
+        configファイル
+    cache_path : str
+        解析済みのキャッシュ（Noneの場合は configファイル名 + '.cache'）
+
+    Returns
+    ----------
+    config : dictionary
+        パラメーター名 → 値（呼出ごとに複製したもの）
+    cache_status : str
+        'memory'、'cache' または 'parsed'
+
+    '''
+    cache_path = cache_path or config_path + '.cache'
+    stat = os.stat(config_path)
+    version = (os.path.abspath(config_path), stat.st_mtime_ns, stat.st_size)
+
+    if version in g_config:
+        return copy.deepcopy(g_config[version]), 'memory'
+
+    config = None
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            cached_version, cached_config = pickle.load(cache_file)
+        if cached_version == version:
+            config, cache_status = cached_config, 'cache'
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        # キャッシュがない・壊れている場合は解析し直す
+        pass
 
-    # バッチ処理の記述
+    if config is None:
+        with open(config_path, encoding='utf8') as config_file:
+            config = parse_config(config_file.read(), config_path)
+        cache_status = 'parsed'
+        _write_cache(cache_path, (version, config))
+
+    g_config[version] = config
+
+    return copy.deepcopy(config), cache_status
+
+
+def parse_config(text, file_name='config'):
+    '''
+    config の記述（NAME = 値 の代入文）を解析する
+    - 値はPythonのリテラル（数値・文字列・True/False/None・list・dict など）のみ
+
+    Parameters
+    ----------
+    text : str
+        configの内容
+    file_name : str
+        エラーメッセージに出力するファイル名
+
+    Returns
+    ----------
+    config : dictionary
+        パラメーター名 → 値
+
+    '''
+    config = {}
+    for node in ast.parse(text, filename=file_name).body:
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)):
+            raise ValueError('{}:{} NAME = 値 の形式で記述してください'
+                             .format(file_name, node.lineno))
+        try:
+            config[node.targets[0].id] = ast.literal_eval(node.value)
+        except ValueError:
+            raise ValueError('{}:{} 値はリテラルで記述してください : {}'
+                             .format(file_name, node.lineno, node.targets[0].id))
+
+    return config
+
+
+def _write_cache(cache_path, value):
+    '''
+    解析済みのconfigを一時ファイル経由で出力する（書込み失敗時は何もしない）
+    '''
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
     try:
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-        # 特徴量の作成
-        os.system('python ../●●.py')
 
-        # 特徴量の作成
-        os.system('python ../●●.py')
+# ------------------------------------------------------------
+# [実行環境] ログの設定
+# ------------------------------------------------------------
+def _setup_logger(python_name, bt_ymd, log_dir, level):
+    '''
+    標準出力と 800_log/<スクリプト名>_<処理日>.log に出力するloggerを作成する
+    '''
+    logger = logging.getLogger(python_name)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    # 同じプロセスで再度 start_app した場合はハンドラーを作り直す
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
 
-        # 学習の実行
-        os.system('python ../510_predict_lightgbm_model.py')
+    os.makedirs(log_dir, exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [
+        logging.StreamHandler(sys.stdout),
+        logging.FileHandler(os.path.join(
+            log_dir, '{}_{}.log'.format(os.path.splitext(python_name)[0], bt_ymd)),
+            encoding='utf8')]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
 
-    except Exception:
-        # エラースタックを出力
-        g_logger.error('========================================')
-        g_logger.exception(traceback.format_exc())
-        g_logger.error('異常終了 ENDED CODE=1')
-        sys.exit(1)
+    return logger, handlers
 
-    else:
-        g_logger.info('========================================')
-        g_logger.info('正常終了 ENDED CODE=0')
-        sys.exit(0)
 
-    finally:
-        conv_util.end_app(g_list)
+def _resolve_path(path):
+    '''
+    config内の相対パスを 300_src 基準の絶対パスにする
+    '''
+    return os.path.normpath(os.path.join(SRC_DIR, path))
 
 
 # ------------------------------------------------------------
-# ★★★★★★  実行部分  ★★★★★★
+# [実行環境] 起動時間
 # ------------------------------------------------------------
-if __name__ == '__main__':
+def _process_uptime():
+    '''
+    プロセス開始からの経過時間[sec]（/proc を参照できない場合はNone）
+    '''
+    try:
+        with open('/proc/self/stat') as stat_file:
+            # 2番目の項目（実行ファイル名）は空白を含みうるため ')' 以降を分割する
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
 
-    # 初期処理、アプリ内で利用するグローバル変数の取得
-    g_bt_ymd, g_par, g_logger = conv_util.start_app(g_python_name, g_list)
 
-    # 実行部分
-    main()
+# ------------------------------------------------------------
+# [実行環境] 遅延読込
+# ------------------------------------------------------------
+class LazyModule(types.ModuleType):
+    '''
+    属性を最初に参照した時点でモジュールを読み込む代理のモジュール
+    - 読込時間は profile_util のステージ 'import.<モジュール名>' として出力する
+    - 読込後はモジュールの属性を複製し、以降の参照は通常のモジュールと同じ速さ
+
+    Parameters
+    ----------
+    name : str
+        モジュール名（'sklearn.metrics' のようなサブモジュールも可）
+
+    '''
+
+    def __getattr__(self, attr):
+        return getattr(load_module(self), attr)
 
+    def __dir__(self):
+        return dir(load_module(self))
+
+
+def lazy_import(name):
+    '''
+    モジュールを最初に使う時点まで読み込まない
+
+    Parameters
+    ----------
+    name : str
+        モジュール名
+
+    Returns
+    ----------
+    module : LazyModule
+        代理のモジュール（読込済みの場合はモジュール）
+
+    Example
+    ----------
+    使用方法：
+    lgbm = conv_util.lazy_import('lightgbm')
+    model = lgbm.train(...)  # ここで lightgbm を読み込む
+
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return LazyModule(name)
+
+
+def load_module(module):
+    '''
+    代理のモジュールを読み込む
+    - fork で子プロセスを作成する前に読み込んでおくと、
+      子プロセスごとに読み込み直さない
+
+    Parameters
+    ----------
+    module : LazyModule or module
+        lazy_import の戻り値
+
+    Returns
+    ----------
+    module : module
+        読込済みのモジュール
+
+    Example
+    ----------
+    使用方法：
+    conv_util.load_module(lgbm)
+
+    '''
+    if not isinstance(module, LazyModule):
+        return module
+
+    name = module.__name__
+    loaded = sys.modules.get(name)
+    if loaded is None:
+        with profile_util.stage('import.' + name):
+            loaded = importlib.import_module(name)
+
+    # 属性を複製し、以降は __getattr__ を経由しない
+    module.__dict__.update(loaded.__dict__)
+
+    return loaded
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】アプリケーション実行環境 Util関数  ★★★★★★
 # ------------------------------------------------------------
-# ★★★★★★  パイプライン実行  ★★★★★★
-# ------------------------------------------------------------
\ No newline at end of file
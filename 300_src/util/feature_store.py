@@ -0,0 +1,397 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】特徴量ストア Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 特徴量セットを列指向形式（Feather / Parquet）で
+#            400_features に保存し、必要な列のみを読み込む
+# ------------------------------------------------------------
+# ライブラリのインポート
+import json
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from util import profile_util
+
+# 特徴量ストアのデフォルト格納先（300_src からの相対パス）
+FEATURE_DIR = '../400_features/'
+
+# マニフェストのファイル名
+MANIFEST_NAME = 'manifest.json'
+
+# 形式ごとの拡張子
+FORMAT_EXT = {'feather': '.feather', 'parquet': '.parquet'}
+
+
+# ------------------------------------------------------------
+# [特徴量] ファイル書込
+# ------------------------------------------------------------
+@profile_util.profiled(rows_arg='df')
+def write_feature(logger, df, feature_name, feature_dir=FEATURE_DIR,
+                  file_format='feather', compression=None):
+    '''
+    DataFrameを列指向形式で特徴量ストアに出力し、マニフェストを更新する
+    - feather（Arrow IPC）は無圧縮で出力すると、読込時にメモリマップで
+      ゼロコピー参照できる
+    - parquetは圧縮率を優先したい場合に利用する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df : DataFrame
+        出力対象のDataFrame
+    feature_name : str
+        特徴量セット名（ファイル名の拡張子なし部分）
+    feature_dir : str
+        出力先のディレクトリ
+    file_format : str
+        出力形式の指定（'feather' or 'parquet'）
+    compression : str
+        圧縮形式の指定（Noneの場合、featherは無圧縮、parquetはsnappy）
+
+    Returns
+    ----------
+    None
+
+    Example
+    ----------
+    使用方法：
+    feature_store.write_feature(g_logger, df_feature, 'calendar')
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+
+        if file_format not in FORMAT_EXT:
+            raise ValueError('file_format が不正です : ' + str(file_format))
+
+        # ファイル情報を展開
+        file_name = feature_name + FORMAT_EXT[file_format]
+        path = os.path.join(feature_dir, file_name)
+
+        logger.info('--[feature_store：write_feature]--------------------')
+        logger.info('PATH  : ' + path)
+        logger.info('SHAPE : ' + str(df.shape))
+
+        # indexは保持しない（CSV/pickleの出力と揃える）
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        # 一時ファイルに出力してから置き換える
+        tmp_path = path + '.tmp'
+        if file_format == 'feather':
+            feather.write_feather(
+                table, tmp_path,
+                compression='uncompressed' if compression is None else compression)
+        else:
+            pq.write_table(
+                table, tmp_path,
+                compression='snappy' if compression is None else compression)
+        os.replace(tmp_path, path)
+
+        # 追記分のファイルは削除する
+        manifest = load_manifest(feature_dir)
+        for part_name in manifest.get(feature_name, {}).get('parts', []):
+            part_path = os.path.join(feature_dir, part_name)
+            if part_name != file_name and os.path.exists(part_path):
+                os.remove(part_path)
+
+        # マニフェストの更新
+        manifest[feature_name] = {
+            'file_name': file_name,
+            'parts': [file_name],
+            'format': file_format,
+            'rows': int(len(df)),
+            'columns': [str(col) for col in df.columns],
+            'dtypes': {str(col): str(dtype) for col, dtype in df.dtypes.items()},
+            'bytes': os.path.getsize(path),
+            'updated': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        _write_manifest(feature_dir, manifest)
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [特徴量] ファイル読込
+# ------------------------------------------------------------
+@profile_util.profiled()
+def load_feature(logger, feature_name, usecols=None, feature_dir=FEATURE_DIR,
+                 memory_map=True, as_table=False):
+    '''
+    特徴量ストアから特徴量セットをロードする
+    - 指定カラムのみを読み込む（ファイル全体の読込後に列を絞ることはしない）
+    - featherはメモリマップで開き、Arrowのバッファを直接参照する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    feature_name : str
+        特徴量セット名
+    usecols : list
+        読込対象のカラム指定（Noneの場合は全カラム）
+    feature_dir : str
+        読込対象のディレクトリ
+    memory_map : boolean
+        メモリマップで読み込むかの指定
+    as_table : boolean
+        Trueの場合、pyarrow.Tableのまま返す（ゼロコピー）
+
+    Returns
+    ----------
+    df : DataFrame or pyarrow.Table
+        ロードした特徴量セット
+
+    Example
+    ----------
+    使用方法：
+    df = feature_store.load_feature(g_logger, 'calendar', usecols=['nichi', 'month'])
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+
+        # マニフェストからファイル情報を取得
+        manifest = load_manifest(feature_dir)
+        if feature_name not in manifest:
+            raise FileNotFoundError(
+                '特徴量セットが登録されていません : ' + feature_name)
+        info = manifest[feature_name]
+        path = os.path.join(feature_dir, info['file_name'])
+
+        logger.info('--[feature_store：load_feature]--------------------')
+        logger.info('PATH  : ' + path)
+
+        # 追記分のファイルも含めて読み込む
+        tables = [_read_table(os.path.join(feature_dir, part_name),
+                              info['format'], usecols, memory_map)
+                  for part_name in info.get('parts', [info['file_name']])]
+        table = tables[0] if len(tables) == 1 else pa.concat_tables(tables)
+
+        if as_table:
+            df = table
+        else:
+            # 欠損のない数値列はArrowのバッファをそのまま参照する
+            df = table.to_pandas(split_blocks=True)
+            del table
+
+    except FileNotFoundError:
+        logger.error('FileNotFoundError')
+        raise
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('SHAPE : ' + str(df.shape))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return df
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [特徴量] ファイル追記
+# ------------------------------------------------------------
+@profile_util.profiled(rows_arg='df')
+def append_feature(logger, df, feature_name, feature_dir=FEATURE_DIR):
+    '''
+    登録済みの特徴量セットに行を追記する
+    - 既存のファイルは書き換えず、追記分を別ファイルとして出力する
+      （出力量は追記する行数のみに比例する）
+    - 読込時は load_feature で全ファイルをまとめて取得する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df : DataFrame
+        追記対象のDataFrame（登録済みの特徴量セットと同じカラム・型、
+        カラムの並びは登録済みの特徴量セットに揃える）
+    feature_name : str
+        特徴量セット名
+    feature_dir : str
+        出力先のディレクトリ
+
+    Returns
+    ----------
+    None
+
+    Example
+    ----------
+    使用方法：
+    feature_store.append_feature(g_logger, df_new_feature, 'features')
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+
+        manifest = load_manifest(feature_dir)
+        if feature_name not in manifest:
+            raise FileNotFoundError(
+                '特徴量セットが登録されていません : ' + feature_name)
+        info = manifest[feature_name]
+
+        # カラム・型が登録済みの特徴量セットと一致すること
+        dtypes = {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+        if dtypes != info['dtypes']:
+            raise ValueError('登録済みの特徴量セットとカラム・型が異なります : '
+                             + feature_name)
+
+        # カラムの並びを登録済みの特徴量セットに揃える
+        df = df[info['columns']]
+
+        parts = info.get('parts', [info['file_name']])
+        file_name = '{}_{:05d}{}'.format(feature_name, len(parts),
+                                         FORMAT_EXT[info['format']])
+        path = os.path.join(feature_dir, file_name)
+
+        logger.info('--[feature_store：append_feature]--------------------')
+        logger.info('PATH  : ' + path)
+        logger.info('SHAPE : ' + str(df.shape))
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if info['format'] == 'feather':
+            feather.write_feather(table, path, compression='uncompressed')
+        else:
+            pq.write_table(table, path, compression='snappy')
+
+        # マニフェストの更新
+        info['parts'] = parts + [file_name]
+        info['rows'] = info['rows'] + int(len(df))
+        info['bytes'] = info['bytes'] + os.path.getsize(path)
+        info['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        _write_manifest(feature_dir, manifest)
+
+    except FileNotFoundError:
+        logger.error('FileNotFoundError')
+        raise
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [特徴量] テーブル読込
+# ------------------------------------------------------------
+def _read_table(path, file_format, usecols, memory_map):
+    '''
+    1ファイル分の特徴量を pyarrow.Table として読み込む
+
+    Parameters
+    ----------
+    path : str
+        読込対象のファイルパス
+    file_format : str
+        ファイル形式（'feather' or 'parquet'）
+    usecols : list
+        読込対象のカラム指定（Noneの場合は全カラム）
+    memory_map : boolean
+        メモリマップで読み込むかの指定
+
+    Returns
+    ----------
+    table : pyarrow.Table
+        読み込んだテーブル
+
+    '''
+    if file_format == 'feather':
+        if memory_map:
+            # メモリマップで開き、必要な列のみを参照する
+            source = pa.memory_map(path, 'r')
+            table = pa.ipc.open_file(source).read_all()
+            if usecols is not None:
+                table = table.select(usecols)
+        else:
+            table = feather.read_table(path, columns=usecols, memory_map=False)
+    else:
+        table = pq.read_table(path, columns=usecols, memory_map=memory_map)
+
+    return table
+
+
+# ------------------------------------------------------------
+# [マニフェスト] 読込
+# ------------------------------------------------------------
+def load_manifest(feature_dir=FEATURE_DIR):
+    '''
+    特徴量ストアのマニフェストを取得する
+
+    Parameters
+    ----------
+    feature_dir : str
+        特徴量ストアのディレクトリ
+
+    Returns
+    ----------
+    manifest : dictionary
+        特徴量セット名ごとの情報（ファイル名、形式、行数、カラム、型）
+
+    '''
+    path = os.path.join(feature_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+# ------------------------------------------------------------
+# [マニフェスト] 書込
+# ------------------------------------------------------------
+def _write_manifest(feature_dir, manifest):
+    '''
+    特徴量ストアのマニフェストを出力する
+
+    Parameters
+    ----------
+    feature_dir : str
+        特徴量ストアのディレクトリ
+    manifest : dictionary
+        出力対象のマニフェスト
+
+    Returns
+    ----------
+    None
+
+    '''
+    path = os.path.join(feature_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】特徴量ストア Util関数  ★★★★★★
+# ------------------------------------------------------------
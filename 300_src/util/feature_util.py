@@ -0,0 +1,873 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】特徴量作成 Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： カレンダー特徴量と、店舗×商品の系列ごとの
+#            ラグ・移動窓・累積統計量を作成する
+#            - 日付は整数演算で分解し、strftimeは使わない
+#            - 系列は (店舗, 商品, 日付) でソートした連続配列として扱い、
+#              系列ごとのループは行わない
+#            - ラグ・移動窓は予測期間の行数（shift）以上前の実績のみで算出し、
+#              予測対象の行も学習の行と同じ条件で特徴量を作成する
+#            - 祝日は一覧（100_config/holidays.csv）を渡す。渡さない場合は
+#              jpholiday を使い、どちらもない場合は異常終了する
+# ------------------------------------------------------------
+# ライブラリのインポート
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from util import file_util
+
+try:
+    import jpholiday
+except ImportError:
+    jpholiday = None
+
+# 系列のキー・日付・ターゲットのデフォルト
+KEY_COL = ['group_mise', 'group_item']
+DATE_COL = 'nichi'
+TARGET_COL = 'target'
+
+# 移動窓・累積統計量を何行前から算出するか（予測期間の日数）と、ラグ・移動窓の行数
+SHIFT = 30
+LAGS = (30, 35, 42)
+WINDOWS = (7, 28)
+
+# 移動窓で算出する統計量
+ROLLING_STATS = ['mean', 'std', 'max', 'min']
+
+# 移動窓の最大・最小を1度に算出する要素数（行数 × 窓の行数、float64で約64MB）
+# - 全行分の (行数, 窓の行数) の配列を作らず、この要素数ごとに分けて算出する
+ROLLING_CHUNK_SIZE = 8000000
+
+
+# ------------------------------------------------------------
+# [特徴量] 作成
+# ------------------------------------------------------------
+def make_features(df, target_col=TARGET_COL, key_col=KEY_COL, date_col=DATE_COL,
+                  lags=LAGS, windows=WINDOWS, stats=ROLLING_STATS,
+                  shift=SHIFT, holidays=None):
+    '''
+    カレンダー特徴量と系列ごとのラグ・移動窓・累積統計量を作成する
+    - ラグ・移動窓は系列内の行数単位（欠番日はつめて数える）
+    - 移動窓・累積統計量は shift 行前までの値で算出する（当日の値は使わない）
+    - ラグは shift 行以上とする（shift は予測期間の行数以上にし、予測対象の行の
+      特徴量が予測期間内の実績に依存しないようにする）
+    - ターゲットが欠損の行（予測対象）は統計量の算出から除外する
+
+    Parameters
+    ----------
+    df : DataFrame
+        日付・系列キー・ターゲットを含むDataFrame
+    target_col : str
+        ターゲットのカラム名
+    key_col : list
+        系列キーのカラム名
+    date_col : str
+        日付のカラム名（yyyymmdd の整数 or datetime64）
+    lags : list
+        ラグの行数（shift 以上）
+    windows : list
+        移動窓の行数
+    stats : list
+        移動窓で算出する統計量（'mean', 'std', 'max', 'min'）
+    shift : int
+        移動窓・累積統計量を何行前から算出するか（予測期間の行数以上）
+    holidays : list
+        祝日の日付（yyyymmdd、Noneの場合は jpholiday を利用する）
+
+    Returns
+    ----------
+    df_feature : DataFrame
+        (系列キー, 日付) でソートし、特徴量を追加したDataFrame
+
+    Example
+    ----------
+    使用方法：
+    df_feature = feature_util.make_features(df_train, lags=[30, 35], windows=[7],
+                                            shift=30)
+
+    '''
+    check_lags(lags, shift)
+
+    # 系列キー・日付でソートし、連続配列にする
+    df_feature = sort_series(df, key_col, date_col)
+
+    # カレンダー特徴量
+    df_feature = add_calendar_features(df_feature, date_col, holidays)
+
+    # 系列内の位置を算出する
+    pos = series_position(df_feature, key_col)
+
+    # 系列ごとのラグ・移動窓・累積統計量
+    y = df_feature[target_col].to_numpy(dtype=np.float64)
+    features = series_features(y, pos, target_col, lags, windows, stats, shift)
+    for col, values in features.items():
+        df_feature[col] = values
+
+    return df_feature
+
+
+# ------------------------------------------------------------
+# [特徴量] 差分更新用の状態の作成
+# ------------------------------------------------------------
+def build_feature_state(df_history, target_col=TARGET_COL, key_col=KEY_COL,
+                        date_col=DATE_COL, lags=LAGS, windows=WINDOWS,
+                        stats=ROLLING_STATS, shift=SHIFT, holidays=None):
+    '''
+    実績データから差分更新用の状態を作成する
+    - 系列ごとに、ラグ・移動窓の算出に必要な直近の行（tail）を保持する
+    - tailより前の行は、累積平均用の合計・件数のみを保持する
+
+    Parameters
+    ----------
+    df_history : DataFrame
+        実績データ（日付・系列キー・ターゲットを含む）
+    target_col : str
+        ターゲットのカラム名
+    key_col : list
+        系列キーのカラム名
+    date_col : str
+        日付のカラム名
+    lags : list
+        ラグの行数
+    windows : list
+        移動窓の行数
+    stats : list
+        移動窓で算出する統計量
+    shift : int
+        移動窓・累積統計量を何行前から算出するか
+    holidays : list
+        祝日の日付（yyyymmdd、状態に保持し update_features で使う）
+
+    Returns
+    ----------
+    state : dictionary
+        差分更新用の状態（update_features に渡す）
+
+    Example
+    ----------
+    使用方法：
+    state = feature_util.build_feature_state(df_train, lags=[30, 35], windows=[7],
+                                             shift=30)
+
+    '''
+    check_lags(lags, shift)
+
+    state = {
+        'target_col': target_col,
+        'key_col': list(key_col),
+        'date_col': date_col,
+        'lags': list(lags),
+        'windows': list(windows),
+        'stats': list(stats),
+        'shift': shift,
+        'holidays': None if holidays is None else list(holidays),
+        # 保持する直近の行数
+        'tail_size': max(list(lags) + [window + shift - 1 for window in windows]
+                         + [shift]),
+    }
+
+    df_sorted = sort_series(df_history[list(key_col) + [date_col, target_col]],
+                            key_col, date_col)
+    _absorb(state, df_sorted, None)
+
+    return state
+
+
+# ------------------------------------------------------------
+# [特徴量] 差分更新
+# ------------------------------------------------------------
+def update_features(df_new, state, df_forecast=None, holidays=None):
+    '''
+    新しい日付の実績データのみについて特徴量を作成し、状態を更新する
+    - 計算量は 新しい行数 + 系列数 × tailの行数 で、履歴の長さに依存しない
+    - make_features で全履歴から作成した場合と同じ値になる
+    - 予測対象は各系列 shift 行以内であること（check_forecast_horizon）
+
+    Parameters
+    ----------
+    df_new : DataFrame
+        新しい日付の実績データ（各系列の最終日より後の日付のみ）
+    state : dictionary
+        build_feature_state または前回の update_features で作成した状態
+    df_forecast : DataFrame
+        予測対象のデータ（状態には取り込まない、ターゲットは欠損）
+    holidays : list
+        祝日の日付（Noneの場合は状態に保持した一覧、指定した場合は状態の一覧を置き換える）
+
+    Returns
+    ----------
+    df_new_feature : DataFrame
+        df_new の特徴量（系列キー・日付でソート済み）
+    df_forecast_feature : DataFrame
+        df_forecast の特徴量（df_forecast がNoneの場合はNone）
+    state : dictionary
+        df_new を取り込んだ状態
+
+    '''
+    target_col = state['target_col']
+    key_col = state['key_col']
+    date_col = state['date_col']
+    tail = state['tail']
+
+    if holidays is None:
+        holidays = state.get('holidays')
+    else:
+        state['holidays'] = list(holidays)
+
+    if df_forecast is not None:
+        check_forecast_horizon(df_forecast, state['shift'], key_col)
+
+    # 区分（0:tail, 1:新しい実績, 2:予測対象）を付けて結合する
+    frames = [tail.assign(_part=0), df_new.assign(_part=1)]
+    if df_forecast is not None:
+        frames.append(df_forecast.assign(_part=2))
+    df_all = sort_series(pd.concat(frames, axis=0, ignore_index=True)
+                         [list(df_new.columns) + ['_part']], key_col, date_col)
+    part = df_all.pop('_part').to_numpy()
+
+    # 新しい実績は各系列の最終日より後であること
+    key_index = pd.MultiIndex.from_frame(state['expanding'][key_col])
+    row_key = key_index.get_indexer(pd.MultiIndex.from_frame(df_all[key_col]))
+    last_days = state['expanding']['last_day'].to_numpy()
+    days = to_epoch_days(df_all[date_col])
+    known = (part > 0) & (row_key >= 0)
+    if np.any(days[known] <= last_days[row_key[known]]):
+        raise ValueError('状態の最終日以前の日付が含まれています')
+
+    # tailより前の合計・件数を、各行の系列に対応させる
+    pre_sum = np.where(row_key >= 0,
+                       state['expanding']['sum'].to_numpy()[row_key], 0.0)
+    pre_cnt = np.where(row_key >= 0,
+                       state['expanding']['count'].to_numpy()[row_key], 0)
+
+    pos = series_position(df_all, key_col)
+    y = df_all[target_col].to_numpy(dtype=np.float64)
+    features = series_features(y, pos, target_col, state['lags'],
+                               state['windows'], state['stats'], state['shift'],
+                               expanding_sum=pre_sum, expanding_count=pre_cnt)
+
+    # 新しい実績・予測対象の行のみに特徴量を付与する
+    results = []
+    for target_part in (1, 2):
+        is_part = part == target_part
+        df_part = add_calendar_features(
+            df_all.loc[is_part].reset_index(drop=True), date_col, holidays)
+        for col, values in features.items():
+            df_part[col] = values[is_part]
+        results.append(df_part)
+
+    # 状態の更新（予測対象は取り込まない）
+    _absorb(state, df_all.loc[part < 2, key_col + [date_col, target_col]]
+            .reset_index(drop=True), pre_sum[part < 2], pre_cnt[part < 2])
+
+    df_forecast_feature = results[1] if df_forecast is not None else None
+
+    return results[0], df_forecast_feature, state
+
+
+# ------------------------------------------------------------
+# [特徴量] ラグ・予測期間のチェック
+# ------------------------------------------------------------
+def check_lags(lags, shift):
+    '''
+    ラグが shift 行以上であることをチェックする
+    （shift 行より短いラグは、予測対象の行では予測期間内の欠損の実績を参照する）
+
+    Parameters
+    ----------
+    lags : list
+        ラグの行数
+    shift : int
+        移動窓・累積統計量を何行前から算出するか
+
+    Returns
+    ----------
+    None
+
+    '''
+    short_lags = [lag for lag in lags if lag < shift]
+    if short_lags:
+        raise ValueError('ラグは shift（{}）以上にしてください：{}'.format(
+            shift, short_lags))
+
+
+def check_forecast_horizon(df_forecast, shift, key_col=KEY_COL):
+    '''
+    予測対象の行数が各系列 shift 行以内であることをチェックする
+    （shift 行を超える予測対象の行は、特徴量が予測期間内の欠損の実績に依存する）
+
+    Parameters
+    ----------
+    df_forecast : DataFrame
+        予測対象のデータ
+    shift : int
+        移動窓・累積統計量を何行前から算出するか
+    key_col : list
+        系列キーのカラム名
+
+    Returns
+    ----------
+    None
+
+    '''
+    if len(df_forecast) == 0:
+        return
+
+    horizon = int(df_forecast.groupby(list(key_col), observed=True).size().max())
+    if horizon > shift:
+        raise ValueError('予測対象の行数（{}）が shift（{}）を超えています'.format(
+            horizon, shift))
+
+
+# ------------------------------------------------------------
+# [特徴量] 新しい日付の行の抽出
+# ------------------------------------------------------------
+def select_new_rows(df, state):
+    '''
+    各系列について、状態の最終日より後の日付の行のみを抽出する
+    （状態にない系列は全行を抽出する）
+
+    Parameters
+    ----------
+    df : DataFrame
+        実績データ
+    state : dictionary
+        差分更新用の状態
+
+    Returns
+    ----------
+    df_new : DataFrame
+        新しい日付の行
+
+    '''
+    key_col = state['key_col']
+    key_index = pd.MultiIndex.from_frame(state['expanding'][key_col])
+    row_key = key_index.get_indexer(pd.MultiIndex.from_frame(df[key_col]))
+    last_days = state['expanding']['last_day'].to_numpy()
+
+    days = to_epoch_days(df[state['date_col']])
+    is_new = (row_key < 0) | (days > last_days[np.maximum(row_key, 0)])
+
+    return df.loc[is_new]
+
+
+# ------------------------------------------------------------
+# [特徴量] 状態への取り込み
+# ------------------------------------------------------------
+def _absorb(state, df_sorted, pre_sum, pre_cnt=None):
+    '''
+    ソート済みの実績データを状態に取り込み、tailと累積の合計・件数を更新する
+
+    Parameters
+    ----------
+    state : dictionary
+        更新対象の状態
+    df_sorted : DataFrame
+        系列キー・日付でソート済みの実績データ
+    pre_sum : ndarray
+        各行の系列の、df_sorted より前の合計（Noneの場合は0）
+    pre_cnt : ndarray
+        各行の系列の、df_sorted より前の件数（Noneの場合は0）
+
+    Returns
+    ----------
+    None
+
+    '''
+    key_col = state['key_col']
+    n = len(df_sorted)
+    pos = series_position(df_sorted, key_col)
+
+    # 系列の最終行（次の行が系列の先頭、または配列の末尾）
+    is_last = np.ones(n, dtype=bool)
+    if n > 0:
+        is_last[:-1] = pos[1:] == 0
+    row = np.arange(n)
+    last_row = np.minimum.accumulate(np.where(is_last, row, n)[::-1])[::-1]
+    remaining = last_row - row
+
+    # tail から外れる行の値を累積の合計・件数に加える
+    y = df_sorted[state['target_col']].to_numpy(dtype=np.float64)
+    is_out = (remaining >= state['tail_size']) & ~np.isnan(y)
+    y_out = np.where(is_out, y, 0.0)
+    cum_sum = np.concatenate([[0.0], np.cumsum(y_out)])
+    cum_cnt = np.concatenate([[0], np.cumsum(is_out)])
+    begin = row - pos
+    out_sum = cum_sum[row + 1] - cum_sum[begin]
+    out_cnt = cum_cnt[row + 1] - cum_cnt[begin]
+    if pre_sum is not None:
+        out_sum = out_sum + pre_sum
+        out_cnt = out_cnt + pre_cnt
+
+    df_expanding = df_sorted.loc[is_last, key_col].reset_index(drop=True)
+    df_expanding['sum'] = out_sum[is_last]
+    df_expanding['count'] = out_cnt[is_last]
+    df_expanding['last_day'] = to_epoch_days(
+        df_sorted.loc[is_last, state['date_col']])
+
+    state['tail'] = df_sorted.loc[remaining < state['tail_size']] \
+        .reset_index(drop=True)
+    state['expanding'] = df_expanding
+
+
+# ------------------------------------------------------------
+# [特徴量] 系列キー・日付でソート
+# ------------------------------------------------------------
+def sort_series(df, key_col=KEY_COL, date_col=DATE_COL):
+    '''
+    (系列キー, 日付) の順にソートし、indexを振り直す
+
+    Parameters
+    ----------
+    df : DataFrame
+        対象のDataFrame
+    key_col : list
+        系列キーのカラム名
+    date_col : str
+        日付のカラム名
+
+    Returns
+    ----------
+    df_sorted : DataFrame
+        ソート済みのDataFrame
+
+    '''
+    # lexsortは最後のキーが第1ソートキー
+    sort_keys = [df[date_col].to_numpy()]
+    for col in reversed(key_col):
+        sort_keys.append(pd.factorize(df[col], sort=True)[0])
+    order = np.lexsort(sort_keys)
+
+    return df.iloc[order].reset_index(drop=True)
+
+
+# ------------------------------------------------------------
+# [特徴量] 系列内の位置
+# ------------------------------------------------------------
+def series_position(df_sorted, key_col=KEY_COL):
+    '''
+    ソート済みのDataFrameについて、各行の系列内の位置（0始まり）を算出する
+
+    Parameters
+    ----------
+    df_sorted : DataFrame
+        sort_series でソート済みのDataFrame
+    key_col : list
+        系列キーのカラム名
+
+    Returns
+    ----------
+    pos : ndarray
+        系列内の位置
+
+    '''
+    n = len(df_sorted)
+    is_start = np.zeros(n, dtype=bool)
+    if n > 0:
+        is_start[0] = True
+    for col in key_col:
+        values = df_sorted[col].to_numpy()
+        is_start[1:] |= values[1:] != values[:-1]
+
+    # 行番号から、その行が属する系列の先頭行番号を引く
+    row = np.arange(n)
+    start_row = np.maximum.accumulate(np.where(is_start, row, 0))
+
+    return row - start_row
+
+
+# ------------------------------------------------------------
+# [特徴量] カレンダー特徴量
+# ------------------------------------------------------------
+def add_calendar_features(df, date_col=DATE_COL, holidays=None):
+    '''
+    日付から整数のカレンダー特徴量と休日フラグを作成する
+
+    Parameters
+    ----------
+    df : DataFrame
+        対象のDataFrame
+    date_col : str
+        日付のカラム名（yyyymmdd の整数 or datetime64）
+    holidays : list
+        祝日の日付（yyyymmdd、Noneの場合は jpholiday を利用する）
+        - 対象の日付の年がすべて含まれていること（check_holidays）
+
+    Returns
+    ----------
+    df : DataFrame
+        以下のカラムを追加したDataFrame
+        year, month, day, dayofweek（月曜=0）, dayofyear, weekofmonth,
+        is_weekend, is_holiday, is_dayoff, is_before_holiday, is_after_holiday
+
+    '''
+    days = to_epoch_days(df[date_col])
+
+    # 年・月・日に分解する
+    date = days.astype('datetime64[D]')
+    year_start = date.astype('datetime64[Y]')
+    month_start = date.astype('datetime64[M]')
+    year = year_start.astype(np.int64) + 1970
+    month = month_start.astype(np.int64) % 12 + 1
+    day = (date - month_start).astype(np.int64) + 1
+
+    # 1970-01-01 は木曜日
+    dayofweek = (days + 3) % 7
+
+    df['year'] = year.astype(np.int16)
+    df['month'] = month.astype(np.int8)
+    df['day'] = day.astype(np.int8)
+    df['dayofweek'] = dayofweek.astype(np.int8)
+    df['dayofyear'] = ((date - year_start).astype(np.int64) + 1).astype(np.int16)
+    df['weekofmonth'] = ((day - 1) // 7 + 1).astype(np.int8)
+
+    # 休日フラグ
+    if holidays is None:
+        holidays = get_holidays(days.min(), days.max() + 1) if len(days) else []
+    else:
+        check_holidays(holidays, year)
+    holiday_days = to_epoch_days(pd.Series(holidays, dtype=object)) \
+        if len(holidays) else np.array([], dtype=np.int64)
+    is_weekend = dayofweek >= 5
+    is_holiday = np.isin(days, holiday_days)
+    is_dayoff_next = np.isin(days + 1, holiday_days) | ((days + 1 + 3) % 7 >= 5)
+    is_dayoff_prev = np.isin(days - 1, holiday_days) | ((days - 1 + 3) % 7 >= 5)
+
+    df['is_weekend'] = is_weekend.astype(np.int8)
+    df['is_holiday'] = is_holiday.astype(np.int8)
+    df['is_dayoff'] = (is_weekend | is_holiday).astype(np.int8)
+    df['is_before_holiday'] = is_dayoff_next.astype(np.int8)
+    df['is_after_holiday'] = is_dayoff_prev.astype(np.int8)
+
+    return df
+
+
+# ------------------------------------------------------------
+# [特徴量] 日付の変換
+# ------------------------------------------------------------
+def to_epoch_days(dates):
+    '''
+    日付を1970-01-01からの経過日数に変換する
+
+    Parameters
+    ----------
+    dates : Series
+        日付（yyyymmdd の整数・文字列、datetime64、date）
+
+    Returns
+    ----------
+    days : ndarray
+        経過日数（int64）
+
+    '''
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.to_numpy().astype('datetime64[D]').astype(np.int64)
+
+    if pd.api.types.is_integer_dtype(dates):
+        ymd = dates.to_numpy(dtype=np.int64)
+    else:
+        try:
+            ymd = pd.to_numeric(dates).to_numpy(dtype=np.int64)
+        except (TypeError, ValueError):
+            return pd.to_datetime(dates).to_numpy() \
+                .astype('datetime64[D]').astype(np.int64)
+
+    # yyyymmdd を整数演算で年・月・日に分解する
+    year = ymd // 10000
+    month = ymd // 100 % 100
+    day = ymd % 100
+    date = ((year - 1970).astype('datetime64[Y]').astype('datetime64[M]')
+            + (month - 1).astype('timedelta64[M]')).astype('datetime64[D]') \
+        + (day - 1).astype('timedelta64[D]')
+
+    return date.astype(np.int64)
+
+
+# ------------------------------------------------------------
+# [特徴量] 祝日の取得
+# ------------------------------------------------------------
+def load_holidays(logger, file_data, date_col=DATE_COL):
+    '''
+    祝日の一覧（100_config/holidays.csv）を読み込む
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    file_data : dictionary
+        祝日のファイルの情報（g_par.INPUT_HOLIDAY_DATA）
+    date_col : str
+        日付のカラム名
+
+    Returns
+    ----------
+    holidays : list
+        祝日の日付（yyyymmdd）
+
+    Example
+    ----------
+    使用方法：
+    holidays = feature_util.load_holidays(g_logger, g_par.INPUT_HOLIDAY_DATA)
+
+    '''
+    return file_util.load_csv(logger, file_data)[date_col].tolist()
+
+
+def get_holidays(start_day, end_day):
+    '''
+    jpholiday から期間内の祝日を取得する
+    - jpholiday がない場合は、祝日がすべて平日になるためエラーにする
+
+    Parameters
+    ----------
+    start_day : int
+        期間の開始（1970-01-01からの経過日数）
+    end_day : int
+        期間の終了（経過日数、この日を含まない）
+
+    Returns
+    ----------
+    holidays : list
+        祝日の日付（datetime.date）
+
+    '''
+    if jpholiday is None:
+        raise ValueError('祝日の一覧（holidays）を指定するか、jpholiday をインストールしてください')
+
+    start = pd.Timestamp(np.datetime64(int(start_day), 'D')).date()
+    end = pd.Timestamp(np.datetime64(int(end_day) - 1, 'D')).date()
+
+    return [day for day, _ in jpholiday.between(start, end)]
+
+
+def check_holidays(holidays, year):
+    '''
+    祝日の一覧に、対象の日付の年がすべて含まれているかを確認する
+    - 毎年祝日はあるため、一覧にない年は祝日が記載されていないとみなす
+
+    Parameters
+    ----------
+    holidays : list
+        祝日の日付（yyyymmdd）
+    year : ndarray
+        対象の日付の年
+
+    Returns
+    ----------
+    None
+
+    '''
+    holiday_year = to_epoch_days(pd.Series(holidays, dtype=object)) \
+        .astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970 \
+        if len(holidays) else np.array([], dtype=np.int64)
+    missing = np.setdiff1d(year, holiday_year)
+    if len(missing):
+        raise ValueError('祝日の一覧に含まれない年の日付があります : '
+                         + ', '.join(str(y) for y in missing))
+
+
+# ------------------------------------------------------------
+# [特徴量] 系列ごとの統計量
+# ------------------------------------------------------------
+def series_features(y, pos, target_col=TARGET_COL, lags=LAGS,
+                    windows=WINDOWS, stats=ROLLING_STATS, shift=SHIFT,
+                    expanding_sum=None, expanding_count=None):
+    '''
+    ソート済みの系列についてラグ・移動窓・累積統計量を算出する
+
+    Parameters
+    ----------
+    y : ndarray
+        ターゲットの値（系列キー・日付でソート済み、欠損はNaN）
+    pos : ndarray
+        各行の系列内の位置
+    target_col : str
+        特徴量名の接頭辞
+    lags : list
+        ラグの行数（shift 以上）
+    windows : list
+        移動窓の行数
+    stats : list
+        移動窓で算出する統計量
+    shift : int
+        移動窓・累積統計量を何行前から算出するか
+    expanding_sum : ndarray
+        各行の系列の、配列より前の期間の合計（差分更新時に利用）
+    expanding_count : ndarray
+        各行の系列の、配列より前の期間の件数（差分更新時に利用）
+
+    Returns
+    ----------
+    features : dictionary
+        特徴量名ごとの配列
+
+    '''
+    features = {}
+
+    # ラグ
+    for lag in lags:
+        features['{}_lag_{}'.format(target_col, lag)] = _shift(y, pos, lag)
+
+    # 移動窓・累積統計量は shift 行前までの値で算出する
+    x = _shift(y, pos, shift)
+    is_valid = ~np.isnan(x)
+    x0 = np.where(is_valid, x, 0.0)
+
+    # 累積和（先頭に0を付けて、区間和を差分で求める）
+    cum_sum = np.concatenate([[0.0], np.cumsum(x0)])
+    cum_sq = np.concatenate([[0.0], np.cumsum(x0 * x0)])
+    cum_cnt = np.concatenate([[0], np.cumsum(is_valid)])
+
+    row = np.arange(len(y))
+    for window in windows:
+        # 窓の開始行（系列の先頭より前には広げない）
+        begin = row - np.minimum(pos, window - 1)
+        w_sum = cum_sum[row + 1] - cum_sum[begin]
+        w_sq = cum_sq[row + 1] - cum_sq[begin]
+        w_cnt = cum_cnt[row + 1] - cum_cnt[begin]
+
+        prefix = '{}_roll_{}_'.format(target_col, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if 'mean' in stats:
+                features[prefix + 'mean'] = np.where(w_cnt > 0, w_sum / w_cnt, np.nan)
+            if 'std' in stats:
+                # 不偏分散（pandas の rolling().std() と同じ ddof=1）
+                var = (w_sq - w_sum * w_sum / np.maximum(w_cnt, 1)) \
+                    / np.maximum(w_cnt - 1, 1)
+                features[prefix + 'std'] = np.where(
+                    w_cnt > 1, np.sqrt(np.maximum(var, 0.0)), np.nan)
+        extrema = _rolling_extrema(x, pos, window,
+                                   [stat for stat in ('max', 'min') if stat in stats])
+        for stat, values in extrema.items():
+            features[prefix + stat] = values
+
+    # 累積平均（系列の先頭から shift 行前まで）
+    begin = row - pos
+    e_sum = cum_sum[row + 1] - cum_sum[begin]
+    e_cnt = cum_cnt[row + 1] - cum_cnt[begin]
+    if expanding_sum is not None:
+        e_sum = e_sum + expanding_sum
+        e_cnt = e_cnt + expanding_count
+    with np.errstate(invalid='ignore', divide='ignore'):
+        features['{}_expanding_mean'.format(target_col)] = \
+            np.where(e_cnt > 0, e_sum / e_cnt, np.nan)
+
+    return features
+
+
+# ------------------------------------------------------------
+# [特徴量] 系列内のシフト
+# ------------------------------------------------------------
+def _shift(y, pos, n):
+    '''
+    系列内で n 行後ろにずらす（系列の先頭 n 行はNaN）
+
+    Parameters
+    ----------
+    y : ndarray
+        対象の配列
+    pos : ndarray
+        各行の系列内の位置
+    n : int
+        ずらす行数
+
+    Returns
+    ----------
+    shifted : ndarray
+        ずらした配列
+
+    '''
+    shifted = np.full(len(y), np.nan)
+    if n < len(y):
+        shifted[n:] = y[:len(y) - n]
+    shifted[pos < n] = np.nan
+
+    return shifted
+
+
+# ------------------------------------------------------------
+# [特徴量] 移動窓の最大・最小
+# ------------------------------------------------------------
+def _rolling_extrema(x, pos, window, stats, chunk_size=ROLLING_CHUNK_SIZE):
+    '''
+    系列内の直近 window 行の最大・最小（欠損は除く）を行を分けて算出する
+    - 作業領域は chunk_size 要素分のみで、行数に比例するのは出力の配列のみ
+
+    Parameters
+    ----------
+    x : ndarray
+        対象の配列
+    pos : ndarray
+        各行の系列内の位置
+    window : int
+        窓の行数
+    stats : list
+        算出する統計量（'max', 'min'）
+    chunk_size : int
+        1度に算出する要素数（行数 × 窓の行数）
+
+    Returns
+    ----------
+    extrema : dictionary
+        統計量ごとの配列
+
+    '''
+    reducers = {'max': np.fmax, 'min': np.fmin}
+    extrema = {stat: np.empty(len(x)) for stat in stats}
+    if not stats:
+        return extrema
+
+    step = max(1, chunk_size // window)
+    for start in range(0, len(x), step):
+        end = min(start + step, len(x))
+        x_window = _window_view(x, pos, window, start, end)
+        with np.errstate(invalid='ignore'):
+            for stat in stats:
+                reducers[stat].reduce(x_window, axis=1, out=extrema[stat][start:end])
+
+    return extrema
+
+
+def _window_view(x, pos, window, start=0, end=None):
+    '''
+    start 〜 end の各行について直近 window 行の値を並べた2次元配列を作成する
+    （系列の先頭より前の位置はNaN）
+
+    Parameters
+    ----------
+    x : ndarray
+        対象の配列
+    pos : ndarray
+        各行の系列内の位置
+    window : int
+        窓の行数
+    start : int
+        対象の先頭行
+    end : int
+        対象の最終行の次（Noneの場合は最後まで）
+
+    Returns
+    ----------
+    x_window : ndarray
+        (end - start, window) の配列（列の右端が当日）
+
+    '''
+    end = len(x) if end is None else end
+
+    # 対象の行の window - 1 行前から（配列の先頭より前はNaN）
+    head = start - (window - 1)
+    padded = x[max(head, 0):end]
+    if head < 0:
+        padded = np.concatenate([np.full(-head, np.nan), padded])
+    x_window = sliding_window_view(padded, window)
+
+    # 系列の先頭より前の位置をマスクする
+    offset = np.arange(window - 1, -1, -1)
+    return np.where(offset[np.newaxis, :] <= pos[start:end, np.newaxis], x_window, np.nan)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】特徴量作成 Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -6,18 +6,37 @@
 # ライブラリのインポート
 import pickle
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
 
+from util import profile_util
+
+# ストリーミング読込で1度に読み込む行数
+CHUNK_SIZE = 500000
+
+# 型の最適化で日付型に変換するカラム
+DATE_COLS = ['nichi']
+
+# 型の最適化でcategory型に変換する、行数に対するユニーク数の割合の上限
+CATEGORY_RATIO = 0.5
+
+# チャンク単位で集計できる集計関数（集計結果を再集計する関数）
+CHUNK_AGG = {'sum': 'sum', 'count': 'sum', 'size': 'sum', 'min': 'min',
+             'max': 'max'}
+
 
 # ------------------------------------------------------------
 # [csv] ファイル読込
 # ------------------------------------------------------------
-def load_csv(logger, file_data, encode='utf8'):
+@profile_util.profiled()
+def load_csv(logger, file_data, encode='utf8', optimize=False):
     '''
     csv形式のファイルをロードし、DataFrameに格納する
     - SEJ基幹とのIF時は、encode='cp932'を設定してロードする
     - AI基盤内は、UTF-8で稼働するので、デフォルトで利用する
+    - optimize=True の場合、ロード後に optimize_dtypes で型を最適化する
 
     Parameters
     ----------
@@ -35,6 +54,8 @@ def load_csv(logger, file_data, encode='utf8'):
             カラムごとの型指定
     encode: str
         読込対象のエンコードの指定
+    optimize : boolean
+        Trueの場合、数値の縮小・category型・日付型への変換を行う
 
     Returns
     ----------
@@ -69,6 +90,9 @@ def load_csv(logger, file_data, encode='utf8'):
             df = pd.read_csv(path, usecols=col, dtype=col_type, engine='c',
                              memory_map=True, encoding=encode, na_filter=True)
 
+        if optimize:
+            df = optimize_dtypes(logger, df, keep=col_type)
+
     except FileNotFoundError:
         logger.error('FileNotFoundError')
         raise
@@ -92,6 +116,7 @@ def load_csv(logger, file_data, encode='utf8'):
 # ------------------------------------------------------------
 # [csv] ファイル書込
 # ------------------------------------------------------------
+@profile_util.profiled(rows_arg='df')
 def write_csv(logger, df, file_data, encode='utf8', out_header=True):
     '''
     DataFrameをcsv形式でファイルに出力する
@@ -164,6 +189,7 @@ def write_csv(logger, df, file_data, encode='utf8', out_header=True):
 # ------------------------------------------------------------
 # [pickle型] ファイル読込
 # ------------------------------------------------------------
+@profile_util.profiled()
 def load_pickle(logger, file_data):
     '''
     pickle型のファイルをロードし、DataFrameに格納する
@@ -228,6 +254,7 @@ def load_pickle(logger, file_data):
 # ------------------------------------------------------------
 # [pickle型] ファイル書込
 # ------------------------------------------------------------
+@profile_util.profiled(rows_arg='df')
 def write_pickle(logger, df, file_data):
     '''
     DataFrameをpickle型でファイルに出力する
@@ -300,6 +327,7 @@ def write_pickle(logger, df, file_data):
 # ------------------------------------------------------------
 # [flat file型] ファイル読込
 # ------------------------------------------------------------
+@profile_util.profiled()
 def load_flat(logger, file_data, encode='cp932'):
     '''
     flat形式のファイルをロードし、DataFrameに変換する
@@ -367,7 +395,8 @@ def load_flat(logger, file_data, encode='cp932'):
 # ------------------------------------------------------------
 # [dat] ファイル読込
 # ------------------------------------------------------------
-def load_dat(logger, file_data, encode='cp932'):
+@profile_util.profiled()
+def load_dat(logger, file_data, encode='cp932', optimize=False):
     '''
     dat形式※のファイルをロードし、DataFrameに格納する
     （※区切り文字 '|'、文字コードは SJIS（cp932））
@@ -390,6 +419,8 @@ def load_dat(logger, file_data, encode='cp932'):
             読込対象のカラム指定
     encode : str
         読込対象のエンコード指定
+    optimize : boolean
+        Trueの場合、数値の縮小・category型・日付型への変換を行う
 
     Returns
     ----------
@@ -419,6 +450,9 @@ def load_dat(logger, file_data, encode='cp932'):
         if col is not None:
             df = df[col]
 
+        if optimize:
+            df = optimize_dtypes(logger, df, keep=col_type)
+
     except FileNotFoundError:
         logger.error('FileNotFoundError')
         raise
@@ -442,6 +476,7 @@ def load_dat(logger, file_data, encode='cp932'):
 # ------------------------------------------------------------
 # [dat] ファイル書込
 # ------------------------------------------------------------
+@profile_util.profiled()
 def write_dat(logger, str_data, file_data, encode='cp932'):
     '''
     str型の文字列をファイル出力する
@@ -493,6 +528,534 @@ def write_dat(logger, str_data, file_data, encode='cp932'):
         pass
 
 
+# ------------------------------------------------------------
+# [共通] 複数ファイルの並列読込
+# ------------------------------------------------------------
+@profile_util.profiled()
+def load_files(logger, file_data_dict, file_type='csv', max_workers=None,
+               use_process=False, optimize=False):
+    '''
+    複数のファイルをスレッド（またはプロセス）プールで同時に読み込む
+    - 読込はファイルごとに独立しており、大半はCパーサ・I/O待ちのため
+      スレッドでも並列に進む
+    - ファイルごとの読込時間と、全体の経過時間を出力する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    file_data_dict : dictionary
+        名前 → 読込対象のファイルの情報（load_csv などと同じ）
+        file_data に 'file_type' / 'encode' を含めると、ファイルごとに
+        読込関数・エンコードを指定できる
+    file_type : str
+        読込関数の指定（'csv' / 'dat' / 'flat' / 'pickle'）
+    max_workers : int
+        同時に読み込むファイル数（Noneの場合はファイル数）
+    use_process : boolean
+        Trueの場合、プロセスプールで読み込む
+    optimize : boolean
+        Trueの場合、csv / dat の読込後に型を最適化する
+
+    Returns
+    ----------
+    df_dict : dictionary
+        名前 → ロードしたDataFrame
+
+    Example
+    ----------
+    使用方法：
+    df_dict = file_util.load_files(g_logger, {'train': g_par.INPUT_TRAIN_DATA,
+                                              'test': g_par.INPUT_TEST_DATA})
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+
+        max_workers = max_workers or max(len(file_data_dict), 1)
+        pool = ProcessPoolExecutor if use_process else ThreadPoolExecutor
+
+        with pool(max_workers=max_workers) as executor:
+            futures = {name: executor.submit(_load_file, logger, file_data,
+                                             file_type, optimize)
+                       for name, file_data in file_data_dict.items()}
+            results = {name: future.result() for name, future in futures.items()}
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('--[file_util：load_files]--------------------')
+        for name, (df, seconds) in results.items():
+            logger.info('{:<20}: {} {:.2f}[sec]'.format(name, df.shape, seconds))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return {name: df for name, (df, _) in results.items()}
+
+    finally:
+        pass
+
+
+def _load_file(logger, file_data, file_type, optimize):
+    '''
+    1つのファイルを読み込み、DataFrameと読込時間を返す
+    '''
+    start = time.time()
+    file_type = file_data.get('file_type', file_type)
+    kwargs = {'encode': file_data['encode']} if 'encode' in file_data else {}
+
+    if file_type == 'csv':
+        df = load_csv(logger, file_data, optimize=optimize, **kwargs)
+    elif file_type == 'dat':
+        df = load_dat(logger, file_data, optimize=optimize, **kwargs)
+    elif file_type == 'flat':
+        df = load_flat(logger, file_data, **kwargs)
+    elif file_type == 'pickle':
+        df = load_pickle(logger, file_data)
+    else:
+        raise ValueError('file_type の指定が不正です : ' + str(file_type))
+
+    return df, time.time() - start
+
+
+# ------------------------------------------------------------
+# [csv] ストリーミング読込
+# ------------------------------------------------------------
+def iter_csv(logger, file_data, encode='utf8', chunksize=CHUNK_SIZE,
+             downcast=False):
+    '''
+    csv形式のファイルを chunksize 行ずつ読み込み、DataFrameを順に返す
+    - 全行をメモリに載せないため、ファイルサイズによらずメモリ使用量が一定
+    - usecols の指定は読込時に適用し、不要なカラムは変換しない
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    file_data : dictionary
+        読込対象のファイルの情報（load_csv と同じ）
+    encode: str
+        読込対象のエンコードの指定
+    chunksize : int
+        1度に読み込む行数
+    downcast : boolean
+        Trueの場合、チャンクごとに数値カラムを小さい型に変換する
+
+    Returns
+    ----------
+    df_chunk : DataFrame（generator）
+        chunksize 行ずつのDataFrame
+
+    Example
+    ----------
+    使用方法：
+    for df_chunk in file_util.iter_csv(g_logger, g_par.INPUT_TRAIN_DATA):
+        ...
+
+    '''
+    path = file_data['file_dir'] + file_data['file_name']
+
+    logger.info('--[file_util：iter_csv]--------------------')
+    logger.info('PATH  : ' + path)
+
+    reader = pd.read_csv(path, usecols=file_data['usecols'],
+                         dtype=file_data['dtype'], engine='c', encoding=encode,
+                         na_filter=True, chunksize=chunksize)
+
+    yield from _iter_chunks(logger, reader, None, downcast)
+
+
+# ------------------------------------------------------------
+# [flat file型] ストリーミング読込
+# ------------------------------------------------------------
+def iter_flat(logger, file_data, encode='cp932', chunksize=CHUNK_SIZE,
+              downcast=False):
+    '''
+    flat形式のファイルを chunksize 行ずつ読み込み、DataFrameを順に返す
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    file_data : dictionary
+        読込対象のファイルの情報（load_flat と同じ）
+    encode : str
+        読込対象のエンコード指定
+    chunksize : int
+        1度に読み込む行数
+    downcast : boolean
+        Trueの場合、チャンクごとに数値カラムを小さい型に変換する
+
+    Returns
+    ----------
+    df_chunk : DataFrame（generator）
+        chunksize 行ずつのDataFrame
+
+    '''
+    path = file_data['path']
+
+    logger.info('--[file_util：iter_flat]--------------------')
+    logger.info('PATH  : ' + path)
+
+    reader = pd.read_fwf(path, names=file_data['usecols'],
+                         colspecs=file_data['colspecs'],
+                         converters=file_data['dtype'], encoding=encode,
+                         chunksize=chunksize)
+
+    yield from _iter_chunks(logger, reader, None, downcast)
+
+
+# ------------------------------------------------------------
+# [dat] ストリーミング読込
+# ------------------------------------------------------------
+def iter_dat(logger, file_data, encode='cp932', chunksize=CHUNK_SIZE,
+             downcast=False):
+    '''
+    dat形式のファイルを chunksize 行ずつ読み込み、DataFrameを順に返す
+    - usecols の指定は読込時に適用し、不要なカラムは変換しない
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    file_data : dictionary
+        読込対象のファイルの情報（load_dat と同じ）
+    encode : str
+        読込対象のエンコード指定
+    chunksize : int
+        1度に読み込む行数
+    downcast : boolean
+        Trueの場合、チャンクごとに数値カラムを小さい型に変換する
+
+    Returns
+    ----------
+    df_chunk : DataFrame（generator）
+        chunksize 行ずつのDataFrame
+
+    '''
+    path = file_data['file_dir'] + file_data['file_name']
+    col = file_data['usecols']
+
+    logger.info('--[file_util：iter_dat]--------------------')
+    logger.info('PATH  : ' + path)
+
+    reader = pd.read_csv(
+        path, names=file_data['filecols'], usecols=col,
+        dtype=file_data['dtype'], engine='c', header=None, encoding=encode,
+        sep='|', na_filter=True, chunksize=chunksize)
+
+    # usecols 指定時も、カラムの並びは指定順にする
+    yield from _iter_chunks(logger, reader, col, downcast)
+
+
+def _iter_chunks(logger, reader, col, downcast):
+    '''
+    読込中のチャンクを順に返し、読込終了時に行数・時間を出力する
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+        rows = 0
+        chunks = 0
+
+        with reader:
+            for df_chunk in reader:
+                if col is not None:
+                    df_chunk = df_chunk[col]
+                if downcast:
+                    df_chunk = downcast_chunk(df_chunk)
+                rows += len(df_chunk)
+                chunks += 1
+                yield df_chunk
+
+    except FileNotFoundError:
+        logger.error('FileNotFoundError')
+        raise
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('ROWS  : ' + str(rows))
+        logger.info('CHUNK : ' + str(chunks))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [共通] チャンクの型変換
+# ------------------------------------------------------------
+def downcast_chunk(df_chunk):
+    '''
+    数値カラムを値が収まる最小の型に変換する
+    - 整数はチャンク内の値の範囲で決めるため、チャンクごとに型が異なる場合がある
+      （pd.concat で結合すると大きい方の型に揃う）
+    - 浮動小数はfloat32に変換する
+
+    Parameters
+    ----------
+    df_chunk : DataFrame
+        変換対象のDataFrame
+
+    Returns
+    ----------
+    df_chunk : DataFrame
+        変換後のDataFrame
+
+    '''
+    for col in df_chunk.columns:
+        dtype = df_chunk[col].dtype
+        if pd.api.types.is_integer_dtype(dtype) and not isinstance(
+                dtype, pd.api.extensions.ExtensionDtype):
+            df_chunk[col] = pd.to_numeric(df_chunk[col], downcast='integer')
+        elif pd.api.types.is_float_dtype(dtype) and dtype == np.float64:
+            df_chunk[col] = df_chunk[col].astype(np.float32)
+
+    return df_chunk
+
+
+# ------------------------------------------------------------
+# [共通] 型の最適化
+# ------------------------------------------------------------
+def optimize_dtypes(logger, df, date_cols=DATE_COLS, category_ratio=CATEGORY_RATIO,
+                    keep=None):
+    '''
+    DataFrameの型をメモリ使用量の小さい型に変換し、削減量を出力する
+    - 整数：値が収まる最小の整数型
+    - 浮動小数：float32で値が変わらない場合のみfloat32
+    - 文字列：ユニーク数が行数 × category_ratio 以下の場合はcategory型
+    - 日付（date_cols）：yyyymmdd の整数・文字列をdatetime64に変換する
+      （ユニークな値のみ変換し、行に展開する）
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df : DataFrame
+        変換対象のDataFrame
+    date_cols : list
+        日付型に変換するカラム（存在しないカラムは無視する）
+    category_ratio : float
+        category型に変換する、行数に対するユニーク数の割合の上限
+    keep : dictionary
+        型を変換しないカラム（file_data の dtype で指定済みのカラム）
+
+    Returns
+    ----------
+    df : DataFrame
+        変換後のDataFrame
+
+    Example
+    ----------
+    使用方法：
+    df_tenki = file_util.optimize_dtypes(g_logger, df_tenki)
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+        before = df.memory_usage(deep=True).sum()
+
+        keep = keep if isinstance(keep, dict) else {}
+        df = df.copy()
+        for col in df.columns:
+            if col in keep:
+                continue
+            values = df[col]
+            dtype = values.dtype
+
+            if col in date_cols:
+                df[col] = _to_date(values)
+            elif isinstance(dtype, pd.api.extensions.ExtensionDtype):
+                continue
+            elif pd.api.types.is_bool_dtype(dtype):
+                continue
+            elif pd.api.types.is_integer_dtype(dtype):
+                df[col] = pd.to_numeric(values, downcast='integer')
+            elif pd.api.types.is_float_dtype(dtype):
+                df[col] = _to_float32(values)
+            elif dtype == object:
+                if values.nunique(dropna=True) <= len(values) * category_ratio:
+                    df[col] = values.astype('category')
+
+        after = df.memory_usage(deep=True).sum()
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('--[file_util：optimize_dtypes]--------------------')
+        logger.info('MEMORY: {:,} → {:,}[byte]'.format(before, after))
+        logger.info('SAVED : {:,}[byte]'.format(before - after))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return df
+
+    finally:
+        pass
+
+
+def _to_date(values):
+    '''
+    日付のカラムをdatetime64に変換する（ユニークな値のみ変換する）
+    '''
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values
+
+    codes, uniques = pd.factorize(values)
+    if pd.api.types.is_numeric_dtype(uniques.dtype):
+        dates = pd.to_datetime(pd.Series(uniques).astype(np.int64).astype(str),
+                               format='%Y%m%d')
+    else:
+        dates = pd.to_datetime(pd.Series(uniques).astype(str), format='mixed')
+
+    return pd.Series(pd.DatetimeIndex(dates).take(codes, allow_fill=True,
+                                                  fill_value=pd.NaT),
+                     index=values.index, name=values.name)
+
+
+def _to_float32(values):
+    '''
+    float32で値が変わらない場合のみ、float32に変換する
+    '''
+    values32 = values.astype(np.float32)
+    if np.array_equal(values32.to_numpy(dtype=np.float64), values.to_numpy(),
+                      equal_nan=True):
+        return values32
+
+    return values
+
+
+# ------------------------------------------------------------
+# [共通] チャンクの集約
+# ------------------------------------------------------------
+def reduce_chunks(logger, chunks, func, initial=None):
+    '''
+    チャンクを順に func(集約結果, チャンク) に渡して集約する
+    - チャンクは集約後に破棄するため、メモリ使用量は集約結果 + 1チャンク分
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    chunks : iterable
+        iter_csv などで読み込むチャンク
+    func : function
+        (集約結果, チャンク) を受け取り、新しい集約結果を返す関数
+    initial : object
+        集約結果の初期値
+
+    Returns
+    ----------
+    result : object
+        集約結果
+
+    Example
+    ----------
+    使用方法：
+    rows = file_util.reduce_chunks(g_logger, file_util.iter_csv(g_logger, file_data),
+                                   lambda total, df: total + len(df), 0)
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+
+        result = initial
+        for df_chunk in chunks:
+            result = func(result, df_chunk)
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('--[file_util：reduce_chunks]--------------------')
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return result
+
+    finally:
+        pass
+
+
+def aggregate_chunks(logger, chunks, by, agg):
+    '''
+    チャンクごとに groupby で集計し、チャンクの集計結果を再集計する
+    - 使用できる集計関数は sum / count / size / min / max / mean
+      （mean は合計と件数から算出する）
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    chunks : iterable
+        iter_csv などで読み込むチャンク
+    by : list
+        集計キーのカラム名
+    agg : dictionary
+        カラム名 → 集計関数名
+
+    Returns
+    ----------
+    df_agg : DataFrame
+        集計キーごとの集計結果（カラム名は '<カラム名>_<集計関数名>'）
+
+    Example
+    ----------
+    使用方法：
+    df_agg = file_util.aggregate_chunks(
+        g_logger, file_util.iter_csv(g_logger, g_par.INPUT_TRAIN_DATA),
+        ['group_mise', 'group_item'], {'target': 'mean'})
+
+    '''
+    # チャンク単位の集計関数に分解する（mean → sum, count）
+    chunk_agg = {}
+    for col, func in agg.items():
+        funcs = ['sum', 'count'] if func == 'mean' else [func]
+        for chunk_func in funcs:
+            if chunk_func not in CHUNK_AGG:
+                raise ValueError('チャンク単位で集計できない集計関数です : ' + func)
+            chunk_agg[col + '_' + chunk_func] = (col, chunk_func)
+
+    def combine(df_total, df_chunk):
+        df_part = df_chunk.groupby(by, observed=True, sort=False) \
+            .agg(**chunk_agg)
+        if df_total is not None:
+            df_part = pd.concat([df_total, df_part], axis=0)
+            df_part = df_part.groupby(level=list(range(len(by))), sort=False) \
+                .agg({name: CHUNK_AGG[func] for name, (_, func)
+                      in chunk_agg.items()})
+        return df_part
+
+    df_agg = reduce_chunks(logger, chunks, combine)
+
+    outcols = [col + '_' + func for col, func in agg.items()]
+    if df_agg is None:
+        return pd.DataFrame(columns=by + outcols)
+
+    # 指定の集計関数のカラムにする
+    for col, func in agg.items():
+        if func == 'mean':
+            df_agg[col + '_mean'] = df_agg[col + '_sum'] / df_agg[col + '_count']
+
+    return df_agg[outcols].sort_index().reset_index()
+
+
 # ------------------------------------------------------------
 # ★★★★★★  【共通】ファイル系 Util関数  ★★★★★★
 # ------------------------------------------------------------
@@ -0,0 +1,231 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】結合 Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 日付・店舗などのキーを密な整数コードに1度だけ変換し、
+#            サイドテーブル（売上・客数・天気・GIS・店マスタ等）の
+#            カラムを配列の添字参照で付与する
+#            - pd.merge のように結合ごとに左側を再ハッシュ・複製しない
+# ------------------------------------------------------------
+# ライブラリのインポート
+import time
+
+import numpy as np
+import pandas as pd
+
+# 密な参照表を作成するキーの組合せ数の上限（超える場合は二分探索で参照する）
+MAX_DENSE_SIZE = 50000000
+
+
+# ------------------------------------------------------------
+# [結合] サイドテーブルの付与
+# ------------------------------------------------------------
+def enrich(logger, df, side_tables, how='left'):
+    '''
+    複数のサイドテーブルのカラムを、キーの整数コードによる参照で一括して付与する
+    - 左側のキーは結合キーの組合せごとに1度だけ整数コードに変換する
+    - サイドテーブルはキーが一意であること（重複する場合はValueError）
+    - 付与したカラムは最後に1度だけ結合し、結合ごとの中間DataFrameを作らない
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df : DataFrame
+        付与先のDataFrame
+    side_tables : dictionary
+        名前 → サイドテーブルの指定（以下の情報を含む）
+        df : DataFrame
+            サイドテーブル
+        on : list
+            結合キーのカラム名（付与先・サイドテーブルで同じ型であること）
+        cols : list
+            付与するカラム（省略時はキー以外の全カラム）
+    how : str
+        'left'：付与先の全行を残す（該当なしは欠損）
+        'inner'：いずれかのサイドテーブルに該当がない行を除く
+
+    Returns
+    ----------
+    df_enrich : DataFrame
+        サイドテーブルのカラムを付与したDataFrame
+        （付与先と同名のカラムは '<カラム名>_<名前>' とする）
+
+    Example
+    ----------
+    使用方法：
+    df_train = join_util.enrich(g_logger, df_train, {
+        'uriage': {'df': df_uriage, 'on': ['nichi', 'group_mise']},
+        'tenki': {'df': df_tenki, 'on': ['nichi']}})
+
+    '''
+    try:
+        # 計測開始
+        start = time.time()
+
+        if how not in ('left', 'inner'):
+            raise ValueError('how の指定が不正です : ' + str(how))
+
+        logger.info('--[join_util：enrich]--------------------')
+
+        # 付与先の各行に対応する、サイドテーブルごとの行番号
+        key_cache = {}
+        rows = {}
+        for name, side in side_tables.items():
+            on = list(side['on'])
+
+            # 付与先のキーの整数コード（結合キーの組合せごとに1度だけ作成）
+            if tuple(on) not in key_cache:
+                key_cache[tuple(on)] = encode_keys(df, on)
+            rows[name] = lookup_rows(key_cache[tuple(on)], side['df'], name)
+
+            logger.info('{:<20}: {} {:.1%}'.format(
+                name, str(on), float(np.mean(rows[name] >= 0)) if len(df) else 1.0))
+
+        # inner の場合は、先に該当のない行を除く（付与するカラムの型を保つ）
+        df_base = df
+        if how == 'inner':
+            matched = np.ones(len(df), dtype=bool)
+            for row in rows.values():
+                matched &= row >= 0
+            df_base = df.loc[matched]
+            rows = {name: row[matched] for name, row in rows.items()}
+
+        # サイドテーブルのカラムを行番号で参照する
+        columns = {}
+        for name, side in side_tables.items():
+            df_side = side['df']
+            cols = side.get('cols') or [col for col in df_side.columns
+                                        if col not in side['on']]
+            for col in cols:
+                out_col = col if col not in df.columns and col not in columns \
+                    else col + '_' + name
+                columns[out_col] = df_side[col].array.take(rows[name],
+                                                           allow_fill=True)
+
+        # 付与先とは1度だけ結合する（付与先は複製しない）
+        df_enrich = pd.concat([df_base, pd.DataFrame(columns, index=df_base.index)],
+                              axis=1, copy=False)
+        df_enrich.index = pd.RangeIndex(len(df_enrich))
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        logger.info('SHAPE : ' + str(df_enrich.shape))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return df_enrich
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [結合] キーの整数コード化
+# ------------------------------------------------------------
+def encode_keys(df, on):
+    '''
+    結合キーのカラムを、カラムごとのユニーク値の番号の組合せ（混合基数）で
+    1つの整数コードに変換する
+
+    Parameters
+    ----------
+    df : DataFrame
+        変換対象のDataFrame
+    on : list
+        結合キーのカラム名
+
+    Returns
+    ----------
+    key : dictionary
+        on : 結合キーのカラム名
+        uniques : カラムごとのユニーク値（Index）
+        code : 行ごとの整数コード（キーに欠損がある行は-1）
+        size : 整数コードの取り得る数
+
+    '''
+    code = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    uniques = []
+    size = 1
+    for col in on:
+        col_code, col_uniques = pd.factorize(df[col])
+        uniques.append(pd.Index(col_uniques))
+        valid &= col_code >= 0
+        code = code * max(len(col_uniques), 1) + col_code
+        size *= max(len(col_uniques), 1)
+
+    return {'on': on, 'uniques': uniques, 'code': np.where(valid, code, -1),
+            'size': size}
+
+
+def _side_code(key, df_side):
+    '''
+    サイドテーブルのキーを、付与先と同じ整数コードに変換する
+    （付与先にないキーは-1）
+    '''
+    code = np.zeros(len(df_side), dtype=np.int64)
+    valid = np.ones(len(df_side), dtype=bool)
+    for col, col_uniques in zip(key['on'], key['uniques']):
+        col_code = col_uniques.get_indexer(df_side[col])
+        valid &= col_code >= 0
+        code = code * max(len(col_uniques), 1) + col_code
+
+    return np.where(valid, code, -1)
+
+
+# ------------------------------------------------------------
+# [結合] 行番号の参照
+# ------------------------------------------------------------
+def lookup_rows(key, df_side, name=''):
+    '''
+    付与先の各行に対応するサイドテーブルの行番号を求める
+    - キーの組合せ数が MAX_DENSE_SIZE 以下の場合は密な参照表の添字参照、
+      超える場合はソート済みのコードの二分探索で求める
+
+    Parameters
+    ----------
+    key : dictionary
+        付与先のキー（encode_keys の戻り値）
+    df_side : DataFrame
+        サイドテーブル
+    name : str
+        サイドテーブルの名前（エラー出力用）
+
+    Returns
+    ----------
+    row : ndarray
+        サイドテーブルの行番号（該当なしは-1）
+
+    '''
+    side_code = _side_code(key, df_side)
+    side_row = np.flatnonzero(side_code >= 0)
+    side_code = side_code[side_row]
+
+    if len(np.unique(side_code)) < len(side_code):
+        raise ValueError('サイドテーブルのキーが一意ではありません : ' + name)
+
+    code = key['code']
+    valid = code >= 0
+    if key['size'] <= MAX_DENSE_SIZE:
+        table = np.full(key['size'], -1, dtype=np.int64)
+        table[side_code] = side_row
+        return np.where(valid, table[np.maximum(code, 0)], -1)
+
+    if len(side_code) == 0:
+        return np.full(len(code), -1, dtype=np.int64)
+
+    order = np.argsort(side_code)
+    sorted_code = side_code[order]
+    pos = np.minimum(np.searchsorted(sorted_code, code), len(sorted_code) - 1)
+    found = valid & (sorted_code[pos] == code)
+
+    return np.where(found, side_row[order[pos]], -1)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】結合 Util関数  ★★★★★★
+# ------------------------------------------------------------
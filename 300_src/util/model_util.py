@@ -0,0 +1,537 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】モデル Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 学習済みfoldモデルの読込（プロセス内キャッシュ）と
+#            foldアンサンブルによる予測、特徴量の重要度の集計・出力
+# ------------------------------------------------------------
+# ライブラリのインポート
+import glob
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from util import preprocessing
+
+# foldモデルのファイル名（save_lightgbm_model の出力形式）
+MODEL_FILE_PATTERN = 'lightGBM_model*.model'
+
+# モデルの格納先と、最新の学習結果を記録するファイル
+MODEL_ROOT = '../600_model/'
+LATEST_FILE_NAME = 'latest_model.json'
+
+# 予測時に1度に処理する行数
+CHUNK_SIZE = 100000
+
+# 読込済みのfoldモデル（モデルのディレクトリ → モデルのリスト）
+g_model_cache = {}
+
+# 読込済みのエンコーダ（モデルのディレクトリ → エンコーダ、ない場合はNone）
+g_encoder_cache = {}
+
+# 特徴量の重要度の出力ファイル名（拡張子なし）・形式・図に出力する特徴量数
+IMPORTANCE_FILE_NAME = 'feature_importance'
+IMPORTANCE_FORMATS = ['csv', 'parquet']
+IMPORTANCE_TOP_N = 50
+
+
+# ------------------------------------------------------------
+# [モデル] foldモデルの読込
+# ------------------------------------------------------------
+def load_fold_models(logger, model_dir):
+    '''
+    学習済みのfoldモデルをfold順に読み込む
+    - 読み込んだモデルはプロセス内でキャッシュし、2回目以降は再読込しない
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    model_dir : str
+        foldモデルの格納先（600_model/<time>/）
+
+    Returns
+    ----------
+    models : list
+        foldモデル（Booster）のリスト
+
+    Example
+    ----------
+    使用方法：
+    models = model_util.load_fold_models(g_logger, '../600_model/20201010120000/')
+
+    '''
+    key = os.path.abspath(model_dir)
+    if key in g_model_cache:
+        return g_model_cache[key]
+
+    try:
+        # 計測開始
+        start = time.time()
+
+        logger.info('--[model_util：load_fold_models]--------------------')
+        logger.info('PATH  : ' + model_dir)
+
+        paths = glob.glob(os.path.join(model_dir, MODEL_FILE_PATTERN))
+        if not paths:
+            raise FileNotFoundError('foldモデルが存在しません : ' + model_dir)
+
+        # fold番号の順に並べる
+        paths.sort(key=lambda path: int(re.findall(r'\d+', os.path.basename(path))[-1]))
+
+        models = []
+        for path in paths:
+            with open(path, 'rb') as pickle_file:
+                models.append(pickle.load(pickle_file))
+
+    except FileNotFoundError:
+        logger.error('FileNotFoundError')
+        raise
+
+    except Exception:
+        raise
+
+    else:
+        g_model_cache[key] = models
+
+        # ログ出力
+        logger.info('FOLD  : ' + str(len(models)))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return models
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [モデル] キャッシュのクリア
+# ------------------------------------------------------------
+def clear_model_cache():
+    '''
+    読込済みのfoldモデル・エンコーダのキャッシュをクリアする
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    ----------
+    None
+
+    '''
+    g_model_cache.clear()
+    g_encoder_cache.clear()
+
+
+# ------------------------------------------------------------
+# [モデル] カテゴリ変数の変換
+# ------------------------------------------------------------
+def encode_features(logger, df_feature, model_dir):
+    '''
+    学習時に保存したエンコーダで、カテゴリ変数を学習時の番号に変換する
+    - エンコーダはプロセス内でキャッシュする
+    - エンコーダがない（カテゴリ変数が数値の）場合はそのまま返す
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df_feature : DataFrame
+        特徴量のDataFrame
+    model_dir : str
+        foldモデルの格納先
+
+    Returns
+    ----------
+    df_feature : DataFrame
+        変換後の特徴量のDataFrame
+
+    '''
+    key = os.path.abspath(model_dir)
+    if key not in g_encoder_cache:
+        path = os.path.join(model_dir, preprocessing.ENCODER_FILE_NAME)
+        g_encoder_cache[key] = preprocessing.CategoryEncoder.load(
+            logger, model_dir) if os.path.exists(path) else None
+
+    encoder = g_encoder_cache[key]
+    if encoder is None:
+        return df_feature
+
+    return encoder.transform(df_feature)
+
+
+# ------------------------------------------------------------
+# [モデル] foldアンサンブルの予測
+# ------------------------------------------------------------
+def predict_folds(models, x_feature, chunk_size=CHUNK_SIZE):
+    '''
+    foldモデルの予測値を平均する
+    - chunk_size 行ずつ予測し、作業メモリを一定に抑える
+    - 学習時と同様に0以下の予測値は0に置換する
+
+    Parameters
+    ----------
+    models : list
+        foldモデル（Booster）のリスト
+    x_feature : ndarray
+        特徴量の配列（to_feature_array で変換したもの）
+    chunk_size : int
+        1度に予測する行数
+
+    Returns
+    ----------
+    preds : ndarray
+        予測値
+
+    '''
+    n = len(x_feature)
+    preds = np.zeros(n)
+
+    for begin in range(0, n, chunk_size):
+        end = min(begin + chunk_size, n)
+        for model in models:
+            preds[begin:end] += model.predict(x_feature[begin:end],
+                                              num_iteration=model.best_iteration)
+
+    preds /= len(models)
+
+    # 日販0以下を0に置換する
+    return np.where(preds > 0, preds, 0)
+
+
+# ------------------------------------------------------------
+# [モデル] バッチの予測
+# ------------------------------------------------------------
+def predict_batch(logger, df_batch, model_dir, feature_col, chunk_size=CHUNK_SIZE):
+    '''
+    test.csv 形式のバッチについて、foldアンサンブルの予測値を算出する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df_batch : DataFrame
+        特徴量を含む予測対象のDataFrame
+    model_dir : str
+        foldモデルの格納先
+    feature_col : list
+        特徴量のカラム名（学習時と同じ並び）
+    chunk_size : int
+        1度に予測する行数
+
+    Returns
+    ----------
+    preds : ndarray
+        予測値
+
+    '''
+    models = load_fold_models(logger, model_dir)
+    x_feature = to_feature_array(
+        encode_features(logger, df_batch[feature_col], model_dir))
+
+    return predict_folds(models, x_feature, chunk_size)
+
+
+# ------------------------------------------------------------
+# [モデル] 特徴量の配列変換
+# ------------------------------------------------------------
+def to_feature_array(df_feature):
+    '''
+    特徴量のDataFrameを学習・予測用の2次元配列に変換する
+    - category型のカラムはカテゴリコードに変換する（欠損はNaN）
+
+    Parameters
+    ----------
+    df_feature : DataFrame
+        特徴量のDataFrame
+
+    Returns
+    ----------
+    x_feature : ndarray
+        特徴量の配列（float64）
+
+    '''
+    x_feature = np.empty(df_feature.shape, dtype=np.float64)
+    for i, col in enumerate(df_feature.columns):
+        values = df_feature[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+            x_feature[:, i] = np.where(codes >= 0, codes, np.nan)
+        else:
+            x_feature[:, i] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    return x_feature
+
+
+# ------------------------------------------------------------
+# [モデル] 最新の学習結果の記録
+# ------------------------------------------------------------
+def write_latest_model(logger, model_time, model_root=MODEL_ROOT, **info):
+    '''
+    学習が完了したモデルのディレクトリを latest_model.json に記録する
+    （パイプラインの学習ステージの出力。予測はこのディレクトリのモデルを使う）
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    model_time : str
+        実行時間（モデルのディレクトリ名）
+    model_root : str
+        モデルの格納先
+    info : dictionary
+        記録に追加する項目
+
+    Returns
+    ----------
+    path : str
+        出力したファイルのパス
+
+    Example
+    ----------
+    使用方法：
+    model_util.write_latest_model(g_logger, time, rows=len(df_train))
+
+    '''
+    path = os.path.join(model_root, LATEST_FILE_NAME)
+    latest = dict(info, time=str(model_time),
+                  model_dir=os.path.join(model_root, str(model_time), ''),
+                  updated=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    # 読込中のプロセスが途中の内容を読まないよう、一時ファイルから置き換える
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as json_file:
+        json.dump(latest, json_file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    logger.info('LATEST: ' + path + ' → ' + latest['model_dir'])
+
+    return path
+
+
+def resolve_model_dir(logger, model_time='', model_root=MODEL_ROOT):
+    '''
+    予測に使うモデルのディレクトリを決定する
+    - model_time の指定がある場合はそのディレクトリ
+    - 指定がない場合は latest_model.json に記録されたディレクトリ
+      （ない場合は、foldモデルがある最新の実行時間のディレクトリ）
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    model_time : str
+        実行時間（モデルのディレクトリ名、空の場合は最新）
+    model_root : str
+        モデルの格納先
+
+    Returns
+    ----------
+    model_dir : str
+        モデルのディレクトリ（末尾は '/'）
+
+    Example
+    ----------
+    使用方法：
+    model_dir = model_util.resolve_model_dir(g_logger, g_par.PREDICT_MODEL_TIME)
+
+    '''
+    if model_time:
+        return os.path.join(model_root, str(model_time), '')
+
+    # 学習ステージが記録した最新のモデル
+    path = os.path.join(model_root, LATEST_FILE_NAME)
+    if os.path.exists(path):
+        with open(path) as json_file:
+            model_dir = os.path.join(model_root, json.load(json_file)['time'], '')
+        if glob.glob(os.path.join(model_dir, MODEL_FILE_PATTERN)):
+            logger.info('MODEL : ' + model_dir + ' (' + LATEST_FILE_NAME + ')')
+            return model_dir
+        logger.warning('記録されたモデルが存在しません : ' + model_dir)
+
+    # foldモデルがある実行時間（yyyymmddhhmmss）のディレクトリのうち最新のもの
+    model_dirs = sorted(
+        name for name in os.listdir(model_root)
+        if re.fullmatch(r'\d{14}', name)
+        and glob.glob(os.path.join(model_root, name, MODEL_FILE_PATTERN)))
+    if not model_dirs:
+        raise FileNotFoundError('foldモデルが存在しません : ' + model_root)
+
+    model_dir = os.path.join(model_root, model_dirs[-1], '')
+    logger.info('MODEL : ' + model_dir + ' (latest)')
+
+    return model_dir
+
+
+# ------------------------------------------------------------
+# [モデル] 特徴量の重要度
+# ------------------------------------------------------------
+def summarize_importance(df_feature_importance):
+    '''
+    foldごとの特徴量の重要度を、特徴量ごとの平均・標準偏差に集計する
+
+    Parameters
+    ----------
+    df_feature_importance : DataFrame
+        foldごとの重要度（feature, importance, fold）
+
+    Returns
+    ----------
+    df_importance : DataFrame
+        特徴量ごとの重要度（rank, feature, importance_mean, importance_std,
+        importance_min, importance_max, n_fold）、平均の降順
+
+    '''
+    df_importance = df_feature_importance.groupby('feature', sort=False)['importance'] \
+        .agg(['mean', 'std', 'min', 'max', 'count'])
+    df_importance.columns = ['importance_mean', 'importance_std', 'importance_min',
+                             'importance_max', 'n_fold']
+    df_importance['importance_std'] = df_importance['importance_std'].fillna(0.0)
+    df_importance = df_importance.sort_values('importance_mean', ascending=False,
+                                              kind='stable').reset_index()
+    df_importance.insert(0, 'rank', np.arange(1, len(df_importance) + 1))
+
+    return df_importance
+
+
+def write_importance(logger, df_importance, model_dir, file_format='csv'):
+    '''
+    集計した特徴量の重要度を csv または parquet で出力する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df_importance : DataFrame
+        summarize_importance の戻り値
+    model_dir : str
+        出力先のディレクトリ
+    file_format : str
+        'csv' または 'parquet'
+
+    Returns
+    ----------
+    path : str
+        出力したファイルのパス
+
+    Example
+    ----------
+    使用方法：
+    model_util.write_importance(g_logger, df_importance, '../600_model/' + time + '/')
+
+    '''
+    if file_format not in IMPORTANCE_FORMATS:
+        raise ValueError('file_format の指定が不正です : ' + str(file_format))
+
+    try:
+        # 計測開始
+        start = time.time()
+        path = os.path.join(model_dir, IMPORTANCE_FILE_NAME + '.' + file_format)
+
+        logger.info('--[model_util：write_importance]--------------------')
+        logger.info('PATH  : ' + path)
+        logger.info('SHAPE : ' + str(df_importance.shape))
+
+        if file_format == 'csv':
+            df_importance.to_csv(path, index=False)
+        else:
+            df_importance.to_parquet(path, index=False)
+
+    except Exception:
+        logger.error('write_importance で例外が発生しました')
+        raise
+
+    else:
+        # ログ出力
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+    return path
+
+
+def plot_importance(df_importance, path, top_n=IMPORTANCE_TOP_N):
+    '''
+    重要度の上位 top_n 件を、foldの標準偏差のエラーバー付きの横棒グラフで出力する
+    - matplotlib はこの関数の呼出時に非対話型のバックエンド（Agg）で読み込む
+
+    Parameters
+    ----------
+    df_importance : DataFrame
+        summarize_importance の戻り値
+    path : str
+        出力先の画像ファイル
+    top_n : int
+        出力する特徴量数
+
+    Returns
+    ----------
+    path : str
+        出力先の画像ファイル
+
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    df_top = df_importance.head(top_n).iloc[::-1]
+    fig, ax = plt.subplots(figsize=(10, max(3.0, 0.25 * len(df_top) + 1.0)))
+    try:
+        ax.barh(df_top['feature'], df_top['importance_mean'],
+                xerr=df_top['importance_std'], color='tab:blue', ecolor='gray')
+        ax.set_xlabel('importance')
+        ax.set_title('LightGBM Features (avg over folds)')
+        fig.tight_layout()
+        fig.savefig(path)
+    finally:
+        plt.close(fig)
+
+    return path
+
+
+def submit_plot_importance(df_importance, path, top_n=IMPORTANCE_TOP_N):
+    '''
+    plot_importance を子プロセスで実行する（呼出元は待たずに処理を続ける）
+
+    Parameters
+    ----------
+    df_importance : DataFrame
+        summarize_importance の戻り値
+    path : str
+        出力先の画像ファイル
+    top_n : int
+        出力する特徴量数
+
+    Returns
+    ----------
+    future : Future
+        出力の完了を待つ場合は future.result() を呼ぶ
+
+    Example
+    ----------
+    使用方法：
+    future = model_util.submit_plot_importance(df_importance, path)
+    ...
+    future.result()
+
+    '''
+    executor = ProcessPoolExecutor(max_workers=1,
+                                   mp_context=multiprocessing.get_context('fork'))
+    future = executor.submit(plot_importance, df_importance, path, top_n)
+    # 実行中のタスクは完了まで続き、プロセスはタスクの完了後に終了する
+    executor.shutdown(wait=False)
+
+    return future
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】モデル Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,415 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】パイプライン Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 入出力を宣言したステージのDAGを実行する
+#            - 出力が入力より新しいステージはスキップする
+#            - 依存関係のないステージはワーカープロセスで同時に実行する
+#            - 最初に失敗したステージで停止する（実行中のステージも終了させる）
+# ------------------------------------------------------------
+# ライブラリのインポート
+import importlib
+import multiprocessing
+import multiprocessing.connection
+import os
+import runpy
+import signal
+import sys
+import time
+
+# 実行モード
+MODE_INPROCESS = 'inprocess'
+MODE_PROCESS = 'process'
+
+# ワーカープロセスの起動前に読み込んでおくモジュール
+PRELOAD_MODULES = ['numpy', 'pandas', 'sklearn', 'lightgbm']
+
+# 停止時に実行中のステージの終了を待つ秒数（超えた場合は強制終了する）
+STOP_TIMEOUT = 10
+
+
+# ------------------------------------------------------------
+# [パイプライン] 実行
+# ------------------------------------------------------------
+def run_pipeline(logger, stages, mode=MODE_PROCESS, max_workers=None,
+                 force=False, preload=PRELOAD_MODULES):
+    '''
+    ステージのDAGを依存順に実行する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    stages : list
+        ステージ情報（以下の情報を含む dictionary）のリスト
+        name : str
+            ステージ名
+        script : str
+            実行するスクリプトのパス
+        inputs : list
+            入力ファイルのパス
+        outputs : list
+            出力ファイルのパス（空の場合は常に実行する）
+        deps : list
+            先に実行するステージ名（省略可）
+    mode : str
+        'inprocess'：現在のプロセスで順に実行する（importを使い回す）
+        'process'：ワーカープロセスで実行し、独立したステージは同時に実行する
+    max_workers : int
+        同時に実行するステージ数の上限（'process'のみ）
+    force : boolean
+        Trueの場合、出力が新しいステージもスキップせずに実行する
+    preload : list
+        ワーカープロセスの起動前に読み込んでおくモジュール名
+
+    Returns
+    ----------
+    results : dictionary
+        ステージ名ごとの実行結果（'done' or 'skipped'）
+
+    Example
+    ----------
+    使用方法：
+    pipeline_util.run_pipeline(g_logger, STAGES, mode='process', max_workers=2)
+
+    '''
+    # 計測開始
+    start = time.time()
+
+    logger.info('--[pipeline_util：run_pipeline]--------------------')
+    logger.info('MODE  : ' + mode)
+
+    # 依存関係の解決（出力→入力の対応も依存関係とみなす）
+    stage_map = {stage['name']: stage for stage in stages}
+    deps = _resolve_deps(stages)
+    order = _topological_sort(stage_map, deps)
+
+    results = {}
+    if mode == MODE_INPROCESS:
+        for name in order:
+            results[name] = _run_or_skip(logger, stage_map[name], force, None)
+
+    elif mode == MODE_PROCESS:
+        # 重いimportは起動前に済ませ、forkでワーカーに引き継ぐ
+        for module_name in preload:
+            try:
+                importlib.import_module(module_name)
+            except ImportError:
+                logger.warning('preloadできません : ' + module_name)
+
+        pending = list(order)
+        running = {}
+        context = multiprocessing.get_context('fork')
+        try:
+            while pending or running:
+                # 依存先がすべて完了したステージを起動する（同時実行数の上限まで）
+                for name in list(pending):
+                    if max_workers and len(running) >= max_workers:
+                        break
+                    if all(dep in results for dep in deps[name]):
+                        pending.remove(name)
+                        result = _run_or_skip(logger, stage_map[name], force,
+                                              context)
+                        if result == 'skipped':
+                            results[name] = result
+                        else:
+                            running[result.sentinel] = (name, result)
+
+                if not running:
+                    continue
+
+                for sentinel in multiprocessing.connection.wait(list(running)):
+                    name, process = running.pop(sentinel)
+                    process.join()
+                    try:
+                        _check_exit_code(name, process.exitcode)
+                    except Exception:
+                        logger.error('[{}] 異常終了'.format(name))
+                        raise
+                    logger.info('[{}] 正常終了'.format(name))
+                    results[name] = 'done'
+
+        finally:
+            # 異常終了時は、実行待ちのステージは起動せず、実行中のステージを終了させる
+            for name, process in running.values():
+                logger.warning('[{}] 停止'.format(name))
+                _stop_process(process)
+
+    else:
+        raise ValueError('mode が不正です : ' + str(mode))
+
+    # ログ出力
+    logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+    logger.info('------------------------------------')
+    logger.info('')
+
+    return results
+
+
+# ------------------------------------------------------------
+# [パイプライン] ステージの実行またはスキップ
+# ------------------------------------------------------------
+def _run_or_skip(logger, stage, force, context):
+    '''
+    出力が入力より新しい場合はスキップし、それ以外は実行する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    stage : dictionary
+        ステージ情報
+    force : boolean
+        スキップ判定を行わない場合はTrue
+    context : multiprocessing context
+        ワーカープロセスの起動方法（Noneの場合は現在のプロセスで実行する）
+
+    Returns
+    ----------
+    result : str or Process
+        'skipped'、'done'、またはワーカーで実行中のProcess
+
+    '''
+    name = stage['name']
+
+    if not force and _is_up_to_date(stage):
+        logger.info('[{}] 出力が最新のためスキップ'.format(name))
+        return 'skipped'
+
+    logger.info('[{}] 実行 : {}'.format(name, stage['script']))
+
+    if context is not None:
+        process = context.Process(target=_run_worker, args=(stage['script'],),
+                                  name=name)
+        process.start()
+        return process
+
+    try:
+        _check_exit_code(name, run_script(stage['script']))
+    except Exception:
+        logger.error('[{}] 異常終了'.format(name))
+        raise
+    logger.info('[{}] 正常終了'.format(name))
+
+    return 'done'
+
+
+# ------------------------------------------------------------
+# [パイプライン] スクリプトの実行
+# ------------------------------------------------------------
+def run_script(script):
+    '''
+    スクリプトを '__main__' として現在のプロセスで実行する
+    - 読込済みのモジュール（pandas, lightgbm など）はそのまま使い回す
+    - スクリプト内の sys.exit は終了コードとして返す
+
+    Parameters
+    ----------
+    script : str
+        実行するスクリプトのパス
+
+    Returns
+    ----------
+    code : int
+        終了コード
+
+    '''
+    script = os.path.abspath(script)
+    script_dir = os.path.dirname(script)
+
+    # カレントディレクトリ・引数・パスを退避する
+    cwd = os.getcwd()
+    argv = sys.argv
+    path = list(sys.path)
+
+    try:
+        os.chdir(script_dir)
+        sys.argv = [script]
+        sys.path.insert(0, script_dir)
+        runpy.run_path(script, run_name='__main__')
+        code = 0
+
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            code = 1
+
+    finally:
+        os.chdir(cwd)
+        sys.argv = argv
+        sys.path[:] = path
+
+    return code
+
+
+def _run_worker(script):
+    '''
+    ワーカープロセスでスクリプトを実行し、終了コードでプロセスを終了する
+    - ステージが起動した子プロセスもまとめて停止できるよう、
+      プロセスグループを分ける
+    '''
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    sys.exit(run_script(script))
+
+
+def _stop_process(process):
+    '''
+    実行中のステージのプロセス（プロセスグループ）を終了させる
+    '''
+    if process.is_alive():
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except (AttributeError, OSError):
+            process.terminate()
+        process.join(STOP_TIMEOUT)
+
+    if process.is_alive():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (AttributeError, OSError):
+            process.kill()
+        process.join()
+
+
+# ------------------------------------------------------------
+# [パイプライン] 終了コードの確認
+# ------------------------------------------------------------
+def _check_exit_code(name, code):
+    '''
+    終了コードが0以外の場合は例外を発生させる
+
+    Parameters
+    ----------
+    name : str
+        ステージ名
+    code : int
+        終了コード（シグナルで終了した場合は負の値）
+
+    Returns
+    ----------
+    None
+
+    '''
+    if code != 0:
+        raise RuntimeError('ステージ [{}] が異常終了しました ENDED CODE={}'
+                           .format(name, code))
+
+
+# ------------------------------------------------------------
+# [パイプライン] 出力の鮮度判定
+# ------------------------------------------------------------
+def _is_up_to_date(stage):
+    '''
+    すべての出力が存在し、すべての入力より新しいかを判定する
+
+    Parameters
+    ----------
+    stage : dictionary
+        ステージ情報
+
+    Returns
+    ----------
+    up_to_date : boolean
+        スキップできる場合はTrue
+
+    '''
+    outputs = stage.get('outputs', [])
+    if not outputs:
+        return False
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+
+    # スクリプト自体の変更も入力とみなす
+    inputs = list(stage.get('inputs', [])) + [stage['script']]
+    if not all(os.path.exists(path) for path in inputs):
+        return False
+
+    oldest_output = min(os.path.getmtime(path) for path in outputs)
+    newest_input = max(os.path.getmtime(path) for path in inputs)
+
+    return oldest_output >= newest_input
+
+
+# ------------------------------------------------------------
+# [パイプライン] 依存関係の解決
+# ------------------------------------------------------------
+def _resolve_deps(stages):
+    '''
+    明示的な依存関係と、出力→入力の対応から依存関係を作成する
+
+    Parameters
+    ----------
+    stages : list
+        ステージ情報のリスト
+
+    Returns
+    ----------
+    deps : dictionary
+        ステージ名ごとの依存先ステージ名のset
+
+    '''
+    producer = {}
+    for stage in stages:
+        for path in stage.get('outputs', []):
+            producer[os.path.abspath(path)] = stage['name']
+
+    deps = {}
+    for stage in stages:
+        dep = set(stage.get('deps', []))
+        for path in stage.get('inputs', []):
+            name = producer.get(os.path.abspath(path))
+            if name is not None and name != stage['name']:
+                dep.add(name)
+        deps[stage['name']] = dep
+
+    return deps
+
+
+# ------------------------------------------------------------
+# [パイプライン] 実行順の決定
+# ------------------------------------------------------------
+def _topological_sort(stage_map, deps):
+    '''
+    依存関係から実行順を決定する（循環がある場合は例外）
+
+    Parameters
+    ----------
+    stage_map : dictionary
+        ステージ名ごとのステージ情報
+    deps : dictionary
+        ステージ名ごとの依存先ステージ名のset
+
+    Returns
+    ----------
+    order : list
+        実行順のステージ名
+
+    '''
+    for name, dep in deps.items():
+        unknown = dep - set(stage_map)
+        if unknown:
+            raise ValueError('ステージ [{}] の依存先が存在しません : {}'
+                             .format(name, sorted(unknown)))
+
+    order = []
+    done = set()
+    remaining = list(stage_map)
+    while remaining:
+        ready = [name for name in remaining if deps[name] <= done]
+        if not ready:
+            raise ValueError('ステージの依存関係が循環しています : '
+                             + str(remaining))
+        for name in ready:
+            order.append(name)
+            done.add(name)
+            remaining.remove(name)
+
+    return order
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】パイプライン Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -4,92 +4,442 @@
 # 作成日  ： 2020.09.08
 # ------------------------------------------------------------
 # ライブラリのインポート
+import os
+import pickle
 import time
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
+
+from util import conv_util
+
+# スケーラは使用時に読み込む（sklearn の読込は起動時間の大半を占める）
+sk_preprocessing = conv_util.lazy_import('sklearn.preprocessing')
+
+# 学習時にないカテゴリのコード（label）
+UNKNOWN_CODE = -1
+
+# 学習済みエンコーダ・スケーラのファイル名（600_model/<time>/ に出力する）
+ENCODER_FILE_NAME = 'encoder.pkl'
+SCALER_FILE_NAME = 'scaler.pkl'
+
+# スケーラで1度に変換する行数
+SCALE_CHUNK_SIZE = 100000
+
+# スケーラの種類（sklearn.preprocessing のクラス名）
+SCALERS = {'mms': 'MinMaxScaler', 'stds': 'StandardScaler', 'norms': 'Normalizer'}
+
+
+# ------------------------------------------------------------
+# 学習済みエンコーダ
+# ------------------------------------------------------------
+class CategoryEncoder:
+    '''
+    名義尺度の数値化の加工ルールを学習・保存し、予測時に同じ変換を行う
+    - label  ：カテゴリの番号（学習時にないカテゴリは UNKNOWN_CODE）
+    - onehot ：カテゴリごとのダミー変数（学習時にないカテゴリは全て0）
+    - dummy  ：onehot から先頭のカテゴリを除いたもの（多重共線性を回避）
+    - 変換はバッチ内のユニーク値のみ学習時のカテゴリと照合し、
+      行への展開はNumPyの参照表（ユニーク値 → コード）で行う
+
+    Parameters
+    ----------
+    mode : str
+        'label' / 'onehot' / 'dummy'
+    columns : list
+        対象のカラム（Noneの場合は学習時の object / category 型のカラム）
+
+    Example
+    ----------
+    使用方法：
+    encoder = preprocessing.CategoryEncoder('label').fit(df_train)
+    encoder.save(g_logger, '../600_model/' + time + '/')
+    encoder = preprocessing.CategoryEncoder.load(g_logger, model_dir)
+    df_test = encoder.transform(df_test)
+
+    '''
+
+    def __init__(self, mode='label', columns=None):
+        if mode not in ('label', 'onehot', 'dummy'):
+            raise ValueError('mode の指定が不正です : ' + str(mode))
+        self.mode = mode
+        self.columns = columns
+        self.categories = {}
+
+    def fit(self, df):
+        '''
+        カラムごとのカテゴリ（昇順）を学習する
+        '''
+        columns = self.columns
+        if columns is None:
+            columns = list(df.select_dtypes(include=['object', 'category']))
+        self.columns = list(columns)
+        self.categories = {col: np.sort(pd.unique(df[col].dropna()).astype(object))
+                           for col in self.columns}
+        return self
+
+    def codes(self, values, col):
+        '''
+        カラムの値を学習時のカテゴリの番号に変換する（学習時にないカテゴリは-1）
+        '''
+        index = pd.Index(self.categories[col])
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # category型は、カテゴリ → 番号 の参照表をカテゴリコードで引く
+            table = index.get_indexer(values.cat.categories)
+            row_codes = values.cat.codes.to_numpy()
+        else:
+            row_codes, uniques = pd.factorize(values)
+            table = index.get_indexer(uniques)
+
+        # 欠損（コード-1）は参照表の末尾（-1）を引く
+        table = np.append(table, -1)
+        return table[row_codes]
+
+    def feature_names(self, col):
+        '''
+        onehot / dummy のカラム名
+        '''
+        categories = list(self.categories[col])
+        if self.mode == 'dummy':
+            return categories[1:]
+        return [str(col) + '_' + str(category) for category in categories]
+
+    def transform(self, df, sparse_output=False):
+        '''
+        学習時のカテゴリで変換する
+
+        Parameters
+        ----------
+        df : DataFrame
+            変換対象のDataFrame
+        sparse_output : boolean
+            onehot / dummy の場合、Trueの場合はCSR形式の疎行列を返す
+            （カラムの並びは output_columns で取得する）
+
+        Returns
+        ----------
+        df_encode : DataFrame / csr_matrix
+            label の場合は、対象カラムをカテゴリの番号に置き換えたDataFrame
+            onehot の場合は、ダミー変数 + 対象外のカラム
+            dummy の場合は、対象外のカラム + ダミー変数
+
+        '''
+        if sparse_output and self.mode != 'label':
+            return self._transform_sparse(df)
+
+        if self.mode == 'label':
+            df_encode = df.copy()
+            for col in self.columns:
+                code = self.codes(df[col], col)
+                df_encode[col] = np.where(code >= 0, code, UNKNOWN_CODE)
+            return df_encode
+
+        dummies = []
+        for col in self.columns:
+            code = self.codes(df[col], col)
+            n_category = len(self.categories[col])
+            dummy = np.zeros((len(df), n_category), dtype=np.uint8)
+            is_known = code >= 0
+            dummy[np.flatnonzero(is_known), code[is_known]] = 1
+            if self.mode == 'dummy':
+                dummy = dummy[:, 1:]
+            dummies.append(pd.DataFrame(dummy, columns=self.feature_names(col),
+                                        index=df.index))
+
+        df_other = df.drop(self.columns, axis=1)
+        if self.mode == 'onehot':
+            return pd.concat([d.astype(np.float64) for d in dummies] + [df_other],
+                             axis=1)
+        return pd.concat([df_other] + dummies, axis=1)
+
+    def output_columns(self, df):
+        '''
+        onehot / dummy の変換後のカラム名（transform と同じ並び）
+        '''
+        dummy_columns = [name for col in self.columns
+                         for name in self.feature_names(col)]
+        other_columns = [col for col in df.columns if col not in self.columns]
+        if self.mode == 'onehot':
+            return dummy_columns + other_columns
+        return other_columns + dummy_columns
+
+    def _transform_sparse(self, df):
+        '''
+        全カラムのダミー変数を1度に疎行列として作成する
+        - 値が0でない要素の (行, 列, 値) のみを作成し、1回でCSR形式に変換する
+        - 対象外のカラムは数値に変換して疎行列に含める
+        '''
+        n = len(df)
+        other_columns = [col for col in df.columns if col not in self.columns]
+
+        # カラムごとの (行, 列, 値) を、変換後のカラムの並びで作成する
+        blocks = []
+        for col in self.columns:
+            code = self.codes(df[col], col)
+            if self.mode == 'dummy':
+                code = code - 1
+            row = np.flatnonzero(code >= 0)
+            blocks.append((len(self.feature_names(col)), row, code[row],
+                           np.ones(len(row))))
+        for col in other_columns:
+            values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            row = np.flatnonzero(values != 0)
+            blocks.append((1, row, np.zeros(len(row), dtype=np.int64), values[row]))
+        if self.mode == 'onehot':
+            order = range(len(blocks))
+        else:
+            order = list(range(len(self.columns), len(blocks))) \
+                + list(range(len(self.columns)))
+
+        rows, cols, data = [], [], []
+        offset = 0
+        for i in order:
+            width, row, col_index, values = blocks[i]
+            rows.append(row)
+            cols.append(col_index + offset)
+            data.append(values)
+            offset += width
+
+        return sparse.csr_matrix(
+            (np.concatenate(data) if data else np.zeros(0),
+             (np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64),
+              np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64))),
+            shape=(n, offset))
+
+    def fit_transform(self, df):
+        '''
+        学習と変換を行う
+        '''
+        return self.fit(df).transform(df)
+
+    def save(self, logger, model_dir, file_name=ENCODER_FILE_NAME):
+        '''
+        学習済みエンコーダをモデルの格納先に出力する
+        '''
+        save_fitted(logger, self, model_dir, file_name)
+
+    @staticmethod
+    def load(logger, model_dir, file_name=ENCODER_FILE_NAME):
+        '''
+        モデルの格納先から学習済みエンコーダを読み込む
+        '''
+        return load_fitted(logger, model_dir, file_name)
+
+
+# ------------------------------------------------------------
+# 学習済みスケーラ
+# ------------------------------------------------------------
+class FeatureScaler:
+    '''
+    数値カラムの正規化・標準化の統計量を学習・保存し、float32で変換する
+    - partial_fit でチャンクごとに統計量を更新できる
+      （メモリに載らないデータは file_util.iter_csv のチャンクで学習する）
+    - norms（行ごとの正規化）は統計量を持たないため、学習は不要
+
+    Parameters
+    ----------
+    scaler : str
+        'mms'（最小最大）/ 'stds'（標準化）/ 'norms'（行ごとの正規化）
+    columns : list
+        対象のカラム（Noneの場合は最初に学習したデータの数値カラム）
+
+    Example
+    ----------
+    使用方法：
+    scaler = preprocessing.FeatureScaler('stds')
+    for df_chunk in file_util.iter_csv(g_logger, file_data):
+        scaler.partial_fit(df_chunk)
+    scaler.save(g_logger, '../600_model/' + time + '/')
+    df_scaled = scaler.transform(df_test)
+
+    '''
+
+    def __init__(self, scaler='stds', columns=None):
+        if scaler not in SCALERS:
+            raise ValueError('scaler の指定が不正です : ' + str(scaler))
+        self.scaler = scaler
+        self.columns = columns
+        self.model = getattr(sk_preprocessing, SCALERS[scaler])()
+
+    def _values(self, df):
+        if self.columns is None:
+            self.columns = list(df.select_dtypes(include='number'))
+        return df[self.columns].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    def fit(self, df):
+        '''
+        統計量を学習する
+        '''
+        self.model = getattr(sk_preprocessing, SCALERS[self.scaler])()
+        return self.partial_fit(df)
+
+    def partial_fit(self, df):
+        '''
+        チャンクで統計量を更新する
+        '''
+        values = self._values(df)
+        if self.scaler == 'norms':
+            self.model.fit(values)
+        else:
+            self.model.partial_fit(values)
+        return self
+
+    def transform(self, df, chunk_size=SCALE_CHUNK_SIZE):
+        '''
+        対象カラムを変換する（対象外のカラムはそのまま）
+
+        Parameters
+        ----------
+        df : DataFrame
+            変換対象のDataFrame
+        chunk_size : int
+            1度に変換する行数（float64の作業領域をこの行数に抑える）
+
+        Returns
+        ----------
+        df_scaled : DataFrame
+            対象カラムをfloat32で変換したDataFrame
+
+        '''
+        scaled = np.empty((len(df), len(self.columns)), dtype=np.float32)
+        for begin in range(0, len(df), chunk_size):
+            df_chunk = df.iloc[begin:begin + chunk_size]
+            scaled[begin:begin + chunk_size] = self.model.transform(
+                self._values(df_chunk))
+
+        df_scaled = df.copy()
+        for i, col in enumerate(self.columns):
+            df_scaled[col] = scaled[:, i]
+        return df_scaled
+
+    def fit_transform(self, df):
+        '''
+        学習と変換を行う
+        '''
+        return self.fit(df).transform(df)
+
+    def save(self, logger, model_dir, file_name=SCALER_FILE_NAME):
+        '''
+        学習済みスケーラをモデルの格納先に出力する
+        '''
+        save_fitted(logger, self, model_dir, file_name)
+
+    @staticmethod
+    def load(logger, model_dir, file_name=SCALER_FILE_NAME):
+        '''
+        モデルの格納先から学習済みスケーラを読み込む
+        '''
+        return load_fitted(logger, model_dir, file_name)
+
+
+# ------------------------------------------------------------
+# 学習済みの加工ルールの保存・読込
+# ------------------------------------------------------------
+def save_fitted(logger, fitted, model_dir, file_name):
+    '''
+    学習済みのエンコーダ・スケーラをpickle形式で出力する
+    '''
+    path = os.path.join(model_dir, file_name)
+    logger.info('--[preprocessing：save_fitted]--------------------')
+    logger.info('PATH  : ' + path)
+    with open(path, 'wb') as pickle_file:
+        pickle.dump(fitted, pickle_file, protocol=4)
+
+
+def load_fitted(logger, model_dir, file_name):
+    '''
+    学習済みのエンコーダ・スケーラを読み込む
+    '''
+    path = os.path.join(model_dir, file_name)
+    logger.info('--[preprocessing：load_fitted]--------------------')
+    logger.info('PATH  : ' + path)
+    with open(path, 'rb') as pickle_file:
+        return pickle.load(pickle_file)
 
-from sklearn.preprocessing import LabelEncoder
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.preprocessing import MinMaxScaler, Normalizer, StandardScaler
 
 # ------------------------------------------------------------
 # 名義尺度の数値化(決定木分析、ランダムフォレスト)
 # ------------------------------------------------------------
-def label_encoding(df_category):
-    category = df_category.select_dtypes(include='object')
-    for col in list(category):
-        # LabelEncoderのインスタンス作成
-        le = LabelEncoder()
-        # ラベルをfit
-        le.fit(df_category[col])
-        # ラベルを整数に変換
-        df_category[col] = le.transform(df_category[col])
+def label_encoding(df_category, encoder=None):
+    '''
+    encoder を指定した場合は、学習済みのカテゴリの番号に変換する
+    （予測時は学習時に保存したエンコーダを指定する）
+    '''
+    if encoder is None:
+        encoder = CategoryEncoder('label',
+                                  list(df_category.select_dtypes(include='object')))
+        encoder.fit(df_category)
 
-    return df_category
+    return encoder.transform(df_category)
 
 
 # ------------------------------------------------------------
 # 名義尺度の数値化(回帰分析)
 # ------------------------------------------------------------
-def one_hot_encoding(df_category):
+def one_hot_encoding(df_category, encoder=None, sparse_output=False):
     '''
     OneHotEncoderを使った場合
     多重共線性に注意する必要あり
     カテゴリーごとに列の削減を行うべき
+    encoder を指定した場合は、学習済みのカテゴリでダミー変数化する
+    sparse_output=True の場合は疎行列のDataFrame（pandas sparse）を返す
+    （LightGBM・線形モデルには df.sparse.to_coo().tocsr() で渡す）
     '''
+    if encoder is None:
+        encoder = CategoryEncoder('onehot',
+                                  list(df_category.select_dtypes(include='object')))
+        encoder.fit(df_category)
 
-    # 定性データと定量データに分割
-    category_data = df_category.select_dtypes(include='object')
-    numeric_data = df_category.select_dtypes(exclude='object')
-
-    # OneHotEncoderのインスタンス作成
-    ohe = OneHotEncoder(handle_unknown='ignore')
-    # ダミー変数化したいデータをfit
-    ohe.fit(category_data)
-    # ダミー変数に変換して、Numpy配列の形へ
-    dummy_data = ohe.transform(category_data).toarray()
-    # ダミー変数の列名を作成
-    dummies_name = ohe.get_feature_names(category_data.columns)
-    # データフレームに変換
-    df_dummies = pd.DataFrame(dummy_data, columns=dummies_name)
-    # 元データに結合
-    df_merge = pd.concat([df_dummies, numeric_data], axis=1)
+    if sparse_output:
+        return _to_sparse_frame(encoder, df_category)
 
-    return df_merge
+    return encoder.transform(df_category)
 
 
 # ------------------------------------------------------------
 # 名義尺度の数値化(回帰分析・多重共線性を回避)
 # ------------------------------------------------------------
-def multicollinearity(df_category):
+def multicollinearity(df_category, encoder=None, sparse_output=False):
     '''
-    学習済みの加工ルールを保存できないため
-    学習時と同じ加工処理を予測データに対しても行いたい場合は
-    scikit-learnメソッドを使うべき
+    先頭のカテゴリを除いてダミー変数化する
+    学習時と同じ加工処理を予測データに対しても行う場合は、
+    学習時に保存した CategoryEncoder('dummy') を encoder に指定する
+    sparse_output=True の場合は疎行列のDataFrame（pandas sparse）を返す
     '''
+    if encoder is None:
+        encoder = CategoryEncoder('dummy',
+                                  list(df_category.select_dtypes(include='object')))
+        encoder.fit(df_category)
+
+    if sparse_output:
+        return _to_sparse_frame(encoder, df_category)
 
-    category = df_category.select_dtypes(include='object')
-    for col in list(category):
-        df_dummy = pd.get_dummies(df_category[col], drop_first=True)
-        df_category = pd.concat([df_category.drop([col], axis=1), df_dummy], axis=1)
+    return encoder.transform(df_category)
 
-    return df_category
+
+def _to_sparse_frame(encoder, df_category):
+    '''
+    ダミー変数化した疎行列を、カラム名付きの疎行列のDataFrameにする
+    '''
+    return pd.DataFrame.sparse.from_spmatrix(
+        encoder.transform(df_category, sparse_output=True),
+        index=df_category.index, columns=encoder.output_columns(df_category))
 
 
 # ------------------------------------------------------------
 # 正規化・標準化
 # ------------------------------------------------------------
-def stds_norms_mms(df, scaler):
-    if scaler == 'mms':
-        mms = MinMaxScaler()
-        mms.fit_transform(df)
-    elif scaler == 'stds':
-        stds = StandardScaler()
-        stds.fit_transform(df)
-    elif scaler == 'norms':
-        norms = Normalizer()
-        norms.fit_transform(df)
-    return df
+def stds_norms_mms(df, scaler, fitted=None):
+    '''
+    数値カラムを正規化・標準化したDataFrame（float32）を返す
+    fitted を指定した場合は、学習済みの FeatureScaler で変換する
+    （予測時は学習時に保存したスケーラを指定する）
+    '''
+    if fitted is None:
+        fitted = FeatureScaler(scaler).fit(df)
+
+    return fitted.transform(df)
 
 
 # ------------------------------------------------------------
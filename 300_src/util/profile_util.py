@@ -0,0 +1,395 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】処理時間計測 Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 処理（ステージ）ごとの経過時間・CPU時間・最大メモリ使用量・
+#            処理行数を計測し、800_log/ にJSON Lines形式で出力する
+#            - デコレータ（profiled）またはwith文（stage）で計測する
+#            - 最大メモリ使用量はステージ内の値（開始時の使用量と、開始時からの増分）
+#              （Linuxでは開始時にプロセスの最大値（VmHWM）をリセットして計測する。
+#               リセットできない環境では開始時・終了時の使用量の大きい方）
+#            - 指定したステージは cProfile の結果（.prof）も出力する
+#              （snakeviz / pstats で参照する。py-spy で計測する場合は
+#               出力されたpidに py-spy record --pid で接続する）
+# ------------------------------------------------------------
+# ライブラリのインポート
+import contextlib
+import cProfile
+import datetime
+import functools
+import inspect
+import json
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# 計測結果の出力先
+LOG_DIR = '../800_log/'
+METRICS_FILE_NAME = 'metrics.jsonl'
+PROFILE_DIR_NAME = 'profile'
+
+# 出力先・cProfile を出力するステージ（configure で変更する）
+g_log_dir = LOG_DIR
+g_profile_stages = set()
+
+# 実行の識別子（同じ実行の計測結果をまとめる）
+g_run_id = datetime.datetime.now().strftime('%Y%m%d%H%M%S') + '_' + str(os.getpid())
+
+# メモリ使用量の取得元（Linux）
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+# 計測中のステージ（入れ子のステージの最大メモリ使用量を外側に反映する）
+# 要素は [開始時の使用量[KB], ステージ内の最大使用量[KB], 最大値をリセットできたか]
+g_rss_stack = []
+
+
+# ------------------------------------------------------------
+# [計測] 設定
+# ------------------------------------------------------------
+def configure(log_dir=None, profile_stages=None):
+    '''
+    計測結果の出力先と、cProfile を出力するステージを設定する
+
+    Parameters
+    ----------
+    log_dir : str
+        出力先のディレクトリ（Noneの場合は変更しない）
+    profile_stages : list
+        cProfile を出力するステージ名（'*' は全ステージ）
+
+    Returns
+    ----------
+    None
+
+    '''
+    global g_log_dir, g_profile_stages
+
+    if log_dir is not None:
+        g_log_dir = log_dir
+    if profile_stages is not None:
+        g_profile_stages = set(profile_stages)
+
+
+# ------------------------------------------------------------
+# [計測] with文による計測
+# ------------------------------------------------------------
+@contextlib.contextmanager
+def stage(name, rows=None, logger=None, **extra):
+    '''
+    with文のブロックを1つのステージとして計測し、計測結果を出力する
+    - ブロック内で record['rows'] や任意の項目を設定できる
+
+    Parameters
+    ----------
+    name : str
+        ステージ名
+    rows : int
+        処理行数（行数/秒の算出に使う）
+    logger : logger object
+        指定した場合、計測結果をログにも出力する
+    extra : dictionary
+        計測結果に追加する項目（fold番号など）
+
+    Returns
+    ----------
+    record : dictionary
+        計測結果（ブロックの終了時に出力する）
+
+    Example
+    ----------
+    使用方法：
+    with profile_util.stage('train_fold', rows=len(trn_idx), fold=fold_):
+        model = lgbm.train(...)
+
+    '''
+    record = dict(extra, stage=name, rows=rows)
+    profiler = None
+    if name in g_profile_stages or '*' in g_profile_stages:
+        profiler = cProfile.Profile()
+
+    rss = _start_rss()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    children = os.times()
+    status = 'ok'
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield record
+
+    except BaseException:
+        status = 'error'
+        raise
+
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        times = os.times()
+        record['status'] = status
+        record['wall_sec'] = round(time.perf_counter() - wall, 6)
+        record['cpu_sec'] = round(time.process_time() - cpu, 6)
+        # プロセスプールの子プロセスのCPU時間（終了済みのもの）
+        record['child_cpu_sec'] = round(
+            (times.children_user - children.children_user)
+            + (times.children_system - children.children_system), 6)
+        _end_rss(record, rss)
+        _finish(record, profiler, logger)
+
+
+# ------------------------------------------------------------
+# [計測] デコレータによる計測
+# ------------------------------------------------------------
+def profiled(name=None, rows_arg=None):
+    '''
+    関数の呼出を1つのステージとして計測するデコレータ
+    - 処理行数は rows_arg の引数の行数、指定がない場合は戻り値の行数
+    - 関数に logger 引数がある場合は、計測結果をログにも出力する
+
+    Parameters
+    ----------
+    name : str
+        ステージ名（Noneの場合は <モジュール名>.<関数名>）
+    rows_arg : str
+        処理行数を取得する引数名（書込み処理の出力対象など）
+
+    Returns
+    ----------
+    decorator : function
+        デコレータ
+
+    Example
+    ----------
+    使用方法：
+    @profile_util.profiled(rows_arg='df')
+    def write_csv(logger, df, file_data, ...):
+
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+        stage_name = name or func.__module__.split('.')[-1] + '.' + func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            logger = bound.get('logger')
+            with stage(stage_name, logger=logger) as record:
+                result = func(*args, **kwargs)
+                record['rows'] = _count_rows(
+                    bound.get(rows_arg) if rows_arg else result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def record(name, wall_sec, cpu_sec, rows=None, logger=None, **extra):
+    '''
+    with文・デコレータで囲めない計測結果（起動時間など）を出力する
+
+    Parameters
+    ----------
+    name : str
+        ステージ名
+    wall_sec : float
+        経過時間[sec]
+    cpu_sec : float
+        CPU時間[sec]
+    rows : int
+        処理行数
+    logger : logger object
+        指定した場合、計測結果をログにも出力する
+    extra : dictionary
+        計測結果に追加する項目
+
+    Returns
+    ----------
+    None
+
+    Example
+    ----------
+    使用方法：
+    profile_util.record('startup', uptime, time.process_time())
+
+    '''
+    _finish(dict(extra, stage=name, rows=rows, status='ok',
+                 wall_sec=round(wall_sec, 6), cpu_sec=round(cpu_sec, 6)),
+            None, logger)
+
+
+# ------------------------------------------------------------
+# [計測] ステージ内のメモリ使用量
+# ------------------------------------------------------------
+def _read_status():
+    '''
+    現在・最大のメモリ使用量[KB]（VmRSS, VmHWM、取得できない場合はNone）
+    '''
+    values = {}
+    try:
+        with open(PROC_STATUS) as status_file:
+            for line in status_file:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    values[line[:5]] = int(line.split()[1])
+    except OSError:
+        pass
+
+    return values.get('VmRSS'), values.get('VmHWM')
+
+
+def _reset_hwm():
+    '''
+    プロセスの最大メモリ使用量（VmHWM）を現在の使用量にリセットする
+    '''
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as clear_file:
+            clear_file.write('5')
+    except OSError:
+        return False
+
+    return True
+
+
+def _start_rss():
+    '''
+    ステージ開始時のメモリ使用量を記録し、最大値をリセットする
+    '''
+    current, peak = _read_status()
+    if current is None:
+        return None
+
+    # リセット前の最大値を、計測中の外側のステージに反映する
+    for outer in g_rss_stack:
+        outer[1] = max(outer[1], peak)
+
+    rss = [current, current, _reset_hwm()]
+    g_rss_stack.append(rss)
+
+    return rss
+
+
+def _end_rss(record, rss):
+    '''
+    ステージ内の最大メモリ使用量と、開始時からの増分を計測結果に追加する
+    '''
+    record['rss_start_mb'] = None
+    record['peak_rss_mb'] = None
+    record['peak_rss_delta_mb'] = None
+    if rss is None:
+        return
+
+    g_rss_stack[:] = [item for item in g_rss_stack if item is not rss]
+
+    current, peak = _read_status()
+    start, inner_peak, is_reset = rss
+    peak = max(inner_peak, current, peak if is_reset else current)
+
+    # 外側のステージにも反映する（外側の開始後の最大値はリセットされているため）
+    for outer in g_rss_stack:
+        outer[1] = max(outer[1], peak)
+
+    record['rss_start_mb'] = round(start / 1024, 1)
+    record['peak_rss_mb'] = round(peak / 1024, 1)
+    record['peak_rss_delta_mb'] = round((peak - start) / 1024, 1)
+
+
+def _count_rows(value):
+    '''
+    DataFrame・配列の行数（それ以外はNone）
+    '''
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return int(len(value))
+    if isinstance(value, tuple) and value and \
+            isinstance(value[0], (pd.DataFrame, pd.Series, np.ndarray)):
+        return int(len(value[0]))
+    return None
+
+
+# ------------------------------------------------------------
+# [計測] 計測結果の出力
+# ------------------------------------------------------------
+def _finish(record, profiler, logger):
+    '''
+    プロセス全体の最大メモリ使用量・行数/秒を算出し、計測結果を1行追記する
+    '''
+    # プロセス開始からの最大値（子プロセスを含む）。ru_maxrss は Linux では KB、macOS では byte
+    unit = 1 if sys.platform == 'darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    record['process_peak_rss_mb'] = round(peak * unit / 1024 / 1024, 1)
+    record['rows_per_sec'] = round(record['rows'] / record['wall_sec'], 1) \
+        if record.get('rows') and record['wall_sec'] > 0 else None
+
+    record = dict({'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+                   'run_id': g_run_id,
+                   'script': os.path.basename(sys.argv[0]),
+                   'pid': os.getpid()}, **record)
+
+    try:
+        os.makedirs(g_log_dir, exist_ok=True)
+        if profiler is not None:
+            profile_dir = os.path.join(g_log_dir, PROFILE_DIR_NAME)
+            os.makedirs(profile_dir, exist_ok=True)
+            record['profile'] = os.path.join(
+                profile_dir, '{}_{}_{}.prof'.format(record['stage'], g_run_id,
+                                                   int(time.time() * 1000)))
+            profiler.dump_stats(record['profile'])
+
+        # 1行を1回の書込みで追記する（子プロセスからの追記と混ざらない）
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        fd = os.open(os.path.join(g_log_dir, METRICS_FILE_NAME),
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf8'))
+        finally:
+            os.close(fd)
+
+    except OSError:
+        # 計測結果の出力失敗で本処理を止めない
+        if logger is not None:
+            logger.warning('計測結果を出力できませんでした : ' + record['stage'])
+
+    if logger is not None:
+        logger.info('PROFILE: {} wall:{:.2f}[sec] cpu:{:.2f}[sec] rss:{}(+{})[MB] rows:{}'.format(
+            record['stage'], record['wall_sec'], record['cpu_sec'],
+            record.get('peak_rss_mb'), record.get('peak_rss_delta_mb'), record['rows']))
+
+
+# ------------------------------------------------------------
+# [計測] 計測結果の読込
+# ------------------------------------------------------------
+def load_metrics(log_dir=None, run_id=None):
+    '''
+    計測結果のファイルを読み込む
+
+    Parameters
+    ----------
+    log_dir : str
+        出力先のディレクトリ（Noneの場合は設定値）
+    run_id : str
+        実行の識別子（指定した場合はその実行のみ）
+
+    Returns
+    ----------
+    df_metrics : DataFrame
+        計測結果（1行が1ステージ）
+
+    '''
+    path = os.path.join(log_dir or g_log_dir, METRICS_FILE_NAME)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+
+    # run_id（yyyymmddhhmmss_pid）は数値に変換されないよう文字列で読み込む
+    df_metrics = pd.read_json(path, lines=True, dtype={'run_id': str})
+    if run_id is not None and len(df_metrics) > 0:
+        df_metrics = df_metrics.loc[df_metrics['run_id'] == run_id]
+
+    return df_metrics.reset_index(drop=True)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】処理時間計測 Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,437 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】階層予測の整合化 Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 全体 → 店舗 / 商品 → 店舗×商品 の階層の予測値を、
+#            集計の関係が成り立つように整合化する
+#            - 階層の集計関係は疎な集計行列 S（ノード数 × 最下層の系列数）で表す
+#            - 整合化は 予測値 → S @ (G @ 予測値) の行列演算のみで行い、
+#              G は整合化の方法ごとに1度だけ作成する
+#              （ols / wls は G を密行列にせず、上位階層のノード数の疎行列の
+#               LU分解を1度だけ行い、整合化のたびに連立方程式を解く）
+# ------------------------------------------------------------
+# ライブラリのインポート
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+from util import backtest_util
+from util import feature_util
+
+# 階層（集計のキー、最後が最下層）
+LEVELS = [[], ['group_mise'], ['group_item'], ['group_mise', 'group_item']]
+
+# 集計したキーの表示
+ALL_LABEL = '*'
+
+# 整合化の方法
+METHODS = ['bottom_up', 'top_down', 'ols', 'wls_struct', 'wls_var']
+
+# 上位階層の予測に使う、同じ曜日の直近の週数
+WEEKS = 4
+
+
+# ------------------------------------------------------------
+# [整合化] 集計行列の作成
+# ------------------------------------------------------------
+def build_summing_matrix(df_bottom, levels=LEVELS):
+    '''
+    最下層の系列から、各階層のノードへの疎な集計行列を作成する
+
+    Parameters
+    ----------
+    df_bottom : DataFrame
+        最下層の系列のキーを含むDataFrame（重複可）
+    levels : list
+        階層ごとの集計のキー（[] は全体、最後が最下層）
+
+    Returns
+    ----------
+    summing : csr_matrix
+        集計行列 S（ノード数 × 最下層の系列数、値は0/1）
+    df_nodes : DataFrame
+        ノードの階層名（level）とキー（集計したキーは ALL_LABEL）
+        最下層のノードは最後の系列数行で、S の列と同じ順
+
+    Example
+    ----------
+    使用方法：
+    summing, df_nodes = reconcile_util.build_summing_matrix(df_train)
+
+    '''
+    key_col = list(levels[-1])
+    df_bottom = df_bottom[key_col].drop_duplicates() \
+        .sort_values(key_col).reset_index(drop=True)
+    n_bottom = len(df_bottom)
+
+    blocks = []
+    frames = []
+    for level in levels:
+        if level:
+            codes, uniques = pd.factorize(
+                pd.MultiIndex.from_frame(df_bottom[list(level)]), sort=True)
+            df_level = pd.DataFrame(list(uniques), columns=list(level))
+        else:
+            codes = np.zeros(n_bottom, dtype=np.int64)
+            df_level = pd.DataFrame(index=[0])
+        blocks.append(sparse.csr_matrix(
+            (np.ones(n_bottom), (codes, np.arange(n_bottom))),
+            shape=(len(df_level), n_bottom)))
+
+        for col in key_col:
+            if col not in level:
+                df_level[col] = ALL_LABEL
+        df_level.insert(0, 'level', '×'.join(level) if level else 'total')
+        frames.append(df_level[['level'] + key_col])
+
+    return sparse.vstack(blocks, format='csr'), \
+        pd.concat(frames, axis=0, ignore_index=True)
+
+
+# ------------------------------------------------------------
+# [整合化] 整合化
+# ------------------------------------------------------------
+class Reconciler:
+    '''
+    各ノードの予測値を、集計の関係が成り立つ予測値に整合化する
+    - 整合化後の予測値 = S @ G @ 予測値（G は作成時に1度だけ算出する）
+      bottom_up  : 最下層の予測値を集計する
+      top_down   : 全体の予測値を過去の構成比で按分する
+      ols        : G = (S'S)^-1 S'
+      wls_struct : G = (S'W^-1 S)^-1 S'W^-1、W = 各ノードの系列数
+      wls_var    : 同上、W = 各ノードの予測誤差の分散（MinTの対角近似）
+    - ols / wls は G を作らず、整合化のたびに (S'W^-1 S) x = S'W^-1 予測値 を解く
+      S = [S_u; I]（上位階層・最下層）のため S'W^-1 S = W_b^-1 + S_u' W_u^-1 S_u で、
+      全体のノードがあると密行列になるため、Woodburyの公式で
+      上位階層のノード数の疎行列 W_u + S_u W_b S_u' のみをLU分解する
+      （最下層の系列数の2乗の行列を作らない）
+
+    Parameters
+    ----------
+    summing : csr_matrix
+        集計行列 S
+    method : str
+        整合化の方法
+    variances : ndarray
+        ノードごとの予測誤差の分散（wls_var の場合）
+    proportions : ndarray
+        最下層の系列ごとの全体に対する構成比（top_down の場合）
+
+    Example
+    ----------
+    使用方法：
+    reconciler = reconcile_util.Reconciler(summing, 'wls_struct')
+    y_reconciled = reconciler.reconcile(y_forecast)
+
+    '''
+
+    def __init__(self, summing, method='wls_struct', variances=None, proportions=None):
+        if method not in METHODS:
+            raise ValueError('method の指定が不正です : ' + str(method))
+
+        self.summing = sparse.csr_matrix(summing)
+        self.method = method
+        self.mapping = None
+        self.solve = None
+        n_node, n_bottom = self.summing.shape
+        n_upper = n_node - n_bottom
+
+        if method == 'bottom_up':
+            # 最下層のノード（最後の系列数行）を選択する
+            self.mapping = sparse.csr_matrix(
+                (np.ones(n_bottom), (np.arange(n_bottom),
+                                     np.arange(n_node - n_bottom, n_node))),
+                shape=(n_bottom, n_node))
+
+        elif method == 'top_down':
+            if proportions is None:
+                raise ValueError('top_down には proportions が必要です')
+            # 全体のノード（先頭行）を構成比で按分する
+            self.mapping = sparse.csr_matrix(
+                (np.asarray(proportions, dtype=np.float64),
+                 (np.arange(n_bottom), np.zeros(n_bottom, dtype=np.int64))),
+                shape=(n_bottom, n_node))
+
+        else:
+            if method == 'ols':
+                weights = np.ones(n_node)
+            elif method == 'wls_struct':
+                weights = np.asarray(self.summing.sum(axis=1)).ravel()
+            else:
+                if variances is None:
+                    raise ValueError('wls_var には variances が必要です')
+                weights = np.maximum(np.asarray(variances, dtype=np.float64), 1e-12)
+
+            # 最下層のノード（最後の系列数行）は単位行列であること
+            bottom = self.summing[n_upper:]
+            if (bottom != sparse.identity(n_bottom, format='csr')).nnz > 0:
+                raise ValueError('集計行列の最後の系列数行が最下層の単位行列ではありません')
+
+            # S'W^-1 と、Woodburyの公式に使う W_b・S_u・(W_u + S_u W_b S_u') のLU分解
+            self.mapping = (self.summing.T @ sparse.diags(1.0 / weights)).tocsr()
+            self.bottom_weights = weights[n_upper:]
+            self.upper = self.summing[:n_upper]
+            if n_upper > 0:
+                inner = sparse.diags(weights[:n_upper]) \
+                    + self.upper @ sparse.diags(self.bottom_weights) @ self.upper.T
+                self.solve = sparse_linalg.factorized(inner.tocsc())
+
+    def reconcile(self, y_forecast):
+        '''
+        予測値を整合化する
+
+        Parameters
+        ----------
+        y_forecast : ndarray
+            ノードごとの予測値（ノード数 × 日数）
+
+        Returns
+        ----------
+        y_reconciled : ndarray
+            整合化後の予測値（ノード数 × 日数）
+
+        '''
+        y_bottom = self.mapping @ y_forecast
+        if self.method in ('ols', 'wls_struct', 'wls_var'):
+            # x = W_b b - W_b S_u' (W_u + S_u W_b S_u')^-1 S_u W_b b（b = S'W^-1 予測値）
+            weights = self.bottom_weights if y_bottom.ndim == 1 \
+                else self.bottom_weights[:, np.newaxis]
+            y_bottom = weights * np.asarray(y_bottom, dtype=np.float64)
+            if self.solve is not None:
+                rhs = np.asarray(self.upper @ y_bottom)
+                if rhs.ndim == 1:
+                    correction = self.solve(rhs)
+                else:
+                    # 日付（列）ごとに解く
+                    correction = np.column_stack([self.solve(rhs[:, col])
+                                                  for col in range(rhs.shape[1])])
+                y_bottom = y_bottom - weights * np.asarray(self.upper.T @ correction)
+
+        return np.asarray(self.summing @ y_bottom)
+
+
+# ------------------------------------------------------------
+# [整合化] ノードの行列
+# ------------------------------------------------------------
+def to_node_matrix(df, summing, df_nodes, value_col='target',
+                   date_col=feature_util.DATE_COL):
+    '''
+    最下層のデータを日付ごとに並べ、全ノードに集計した行列を作成する
+    （欠番の日は0として集計する）
+
+    Parameters
+    ----------
+    df : DataFrame
+        最下層のキー・日付・値を含むDataFrame
+    summing : csr_matrix
+        集計行列 S
+    df_nodes : DataFrame
+        build_summing_matrix で作成したノード
+    value_col : str
+        値のカラム名
+    date_col : str
+        日付のカラム名
+
+    Returns
+    ----------
+    y_node : ndarray
+        ノードごとの値（ノード数 × 日数）
+    days : ndarray
+        列の日付（経過日数、昇順）
+
+    '''
+    n_bottom = summing.shape[1]
+    df_bottom = df_nodes.iloc[-n_bottom:].drop(columns='level')
+    key_col = list(df_bottom.columns)
+
+    row = pd.MultiIndex.from_frame(df_bottom) \
+        .get_indexer(pd.MultiIndex.from_frame(df[key_col]))
+    if np.any(row < 0):
+        raise ValueError('集計行列にない系列が含まれています')
+    day_codes, days = pd.factorize(feature_util.to_epoch_days(df[date_col]), sort=True)
+
+    values = df[value_col].to_numpy(dtype=np.float64)
+    y_bottom = sparse.csr_matrix(
+        (np.nan_to_num(values), (row, day_codes)),
+        shape=(n_bottom, len(days))).toarray()
+
+    return np.asarray(summing @ y_bottom), np.asarray(days)
+
+
+def to_frame(y_node, df_nodes, days, value_col='target', date_col=feature_util.DATE_COL):
+    '''
+    ノードの行列を、ノードのキー・日付・値の縦持ちのDataFrameに変換する
+
+    Parameters
+    ----------
+    y_node : ndarray
+        ノードごとの値（ノード数 × 日数）
+    df_nodes : DataFrame
+        ノード
+    days : ndarray
+        列の日付（経過日数）
+    value_col : str
+        値のカラム名
+    date_col : str
+        日付のカラム名（yyyymmdd の整数で出力する）
+
+    Returns
+    ----------
+    df : DataFrame
+        ノード・日付ごとの値
+
+    '''
+    n_node, n_day = y_node.shape
+    df = df_nodes.iloc[np.repeat(np.arange(n_node), n_day)].reset_index(drop=True)
+    df.insert(1, date_col, np.tile(backtest_util.to_ymd(days), n_node))
+    df[value_col] = y_node.ravel()
+
+    return df
+
+
+# ------------------------------------------------------------
+# [整合化] 上位階層の簡易予測
+# ------------------------------------------------------------
+def forecast_seasonal(y_history, history_days, forecast_days, weeks=WEEKS):
+    '''
+    各ノードについて、同じ曜日の直近 weeks 週の平均を予測値とする
+    （上位階層はLightGBMの代わりにこの簡易予測を使う）
+
+    Parameters
+    ----------
+    y_history : ndarray
+        ノードごとの実績（ノード数 × 日数）
+    history_days : ndarray
+        実績の日付（経過日数）
+    forecast_days : ndarray
+        予測対象の日付（経過日数）
+    weeks : int
+        平均する週数
+
+    Returns
+    ----------
+    y_forecast : ndarray
+        ノードごとの予測値（ノード数 × 予測対象の日数）
+
+    '''
+    history_days = np.asarray(history_days)
+    forecast_days = np.asarray(forecast_days)
+    y_forecast = np.full((y_history.shape[0], len(forecast_days)), np.nan)
+
+    # 曜日ごとに、直近 weeks 日分（同じ曜日）の平均を算出する
+    for dayofweek in range(7):
+        target = forecast_days % 7 == dayofweek
+        source = np.flatnonzero(history_days % 7 == dayofweek)[-weeks:]
+        if target.any() and len(source) > 0:
+            y_forecast[:, target] = y_history[:, source].mean(axis=1, keepdims=True)
+
+    return y_forecast
+
+
+# ------------------------------------------------------------
+# [整合化] 予測誤差の分散（wls_var）
+# ------------------------------------------------------------
+def seasonal_residuals(y_history, history_days, cutoffs, horizon, weeks=WEEKS):
+    '''
+    基準日ごとに簡易予測（forecast_seasonal）を行い、予測期間の残差を算出する
+    （上位階層の予測誤差の分散に使う。最下層のLightGBMの残差と同じ基準日・
+      予測期間で算出する）
+
+    Parameters
+    ----------
+    y_history : ndarray
+        ノードごとの実績（ノード数 × 日数）
+    history_days : ndarray
+        実績の日付（経過日数）
+    cutoffs : list
+        基準日（経過日数）
+    horizon : int
+        予測期間の日数
+    weeks : int
+        平均する週数
+
+    Returns
+    ----------
+    residuals : ndarray
+        ノードごとの残差（実績 - 予測値、ノード数 × 全基準日の予測期間の日数）
+
+    '''
+    history_days = np.asarray(history_days)
+    residuals = []
+    for cutoff in cutoffs:
+        is_train = history_days <= cutoff
+        is_forecast = (history_days > cutoff) & (history_days <= cutoff + horizon)
+        y_forecast = forecast_seasonal(y_history[:, is_train], history_days[is_train],
+                                       history_days[is_forecast], weeks)
+        residuals.append(y_history[:, is_forecast] - y_forecast)
+
+    return np.concatenate(residuals, axis=1)
+
+
+def bottom_variance(df_result, summing, df_nodes, target_col='target', pred_col='pred'):
+    '''
+    最下層の系列ごとの、予測値（LightGBM）の残差の2乗平均
+    （実績が欠損の行は除く）
+
+    Parameters
+    ----------
+    df_result : DataFrame
+        系列キー・日付・実績・予測値（oof_result.csv / backtest_result.csv）
+    summing : csr_matrix
+        集計行列 S
+    df_nodes : DataFrame
+        build_summing_matrix で作成したノード
+    target_col : str
+        実績のカラム名
+    pred_col : str
+        予測値のカラム名
+
+    Returns
+    ----------
+    variances : ndarray
+        最下層の系列ごとの分散（残差がない系列はNaN）
+
+    '''
+    n_bottom = summing.shape[1]
+    df_bottom = df_nodes.iloc[-n_bottom:].drop(columns='level')
+    key_col = list(df_bottom.columns)
+
+    df_result = df_result.loc[df_result[target_col].notna()]
+    errors = (df_result[target_col].to_numpy(dtype=np.float64)
+              - df_result[pred_col].to_numpy(dtype=np.float64)) ** 2
+    df_error = pd.DataFrame({'error': errors}).join(
+        df_result[key_col].reset_index(drop=True))
+    variances = df_error.groupby(key_col, observed=True)['error'].mean()
+
+    return variances.reindex(pd.MultiIndex.from_frame(df_bottom)).to_numpy()
+
+
+# ------------------------------------------------------------
+# [整合化] 最下層の構成比（top_down）
+# ------------------------------------------------------------
+def bottom_proportions(y_history, summing):
+    '''
+    最下層の系列ごとの、実績の合計に対する構成比（top_down に使う）
+
+    Parameters
+    ----------
+    y_history : ndarray
+        ノードごとの実績（ノード数 × 日数）
+    summing : csr_matrix
+        集計行列 S
+
+    Returns
+    ----------
+    proportions : ndarray
+        最下層の系列ごとの構成比
+
+    '''
+    n_bottom = summing.shape[1]
+    totals = y_history[-n_bottom:].sum(axis=1)
+
+    return totals / totals.sum() if totals.sum() > 0 else np.full(n_bottom, 1.0 / n_bottom)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】階層予測の整合化 Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,379 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】ハイパーパラメータ探索 Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： LightGBMのパラメータの候補をプロセスプールで評価し、
+#            明らかに劣る候補は途中で打ち切って、順位表を出力する
+#            - binning済みのDatasetは1度だけ作成し、forkで各プロセスに共有する
+#            - 打ち切りは、その時点の最良の候補との比較で判定する
+#              （最初のfoldの prune_rounds 回目の評価値・foldごとの評価値の平均）
+#            - 学習率を探索する場合、学習回数での打ち切りは学習率の小さい候補を
+#              必ず打ち切るため、判定する回数を学習率に反比例させる（prune_scale_lr）
+# ------------------------------------------------------------
+# ライブラリのインポート
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from util import conv_util
+
+# LightGBMは最初に使う時点で読み込む
+lgbm = conv_util.lazy_import('lightgbm')
+
+# binning済みDatasetと共有できないため、探索対象にできないパラメータ
+DATASET_PARAMS = ['max_bin', 'max_bin_by_feature', 'min_data_in_bin',
+                  'bin_construct_sample_cnt', 'categorical_feature',
+                  'feature_pre_filter', 'linear_tree']
+
+# 打ち切りの判定を行う学習回数と、最良の候補に対する許容幅（評価値の比率）
+PRUNE_ROUNDS = 50
+PRUNE_MARGIN = 0.1
+
+# 判定する回数を学習率で補正する場合の基準の学習率
+# （学習率 lr の候補は prune_rounds * PRUNE_BASE_LR / lr 回目で判定する）
+PRUNE_BASE_LR = 0.1
+
+# 順位表のファイル名（600_model/<time>/ に出力する）
+LEADERBOARD_FILE_NAME = 'search_leaderboard.csv'
+BEST_PARAM_FILE_NAME = 'search_best_param.json'
+
+# 子プロセスへ引き継ぐ探索データ（forkで共有する）
+# (binning済みのDataset, foldごとの(train, val)の行番号)
+g_search_data = None
+
+
+# ------------------------------------------------------------
+# [探索] パラメータの候補の作成
+# ------------------------------------------------------------
+def sample_params(space, n_trials, seed=2020, prune_rounds=0, prune_scale_lr=False):
+    '''
+    探索範囲からパラメータの候補をランダムに作成する
+    - 学習率を探索し、学習回数での打ち切りを補正せずに行う組み合わせはエラーにする
+
+    Parameters
+    ----------
+    space : dictionary
+        パラメータ名 → 探索範囲
+        list                   : 候補から選ぶ（例 ['gbdt', 'dart']）
+        {'int': [下限, 上限]}   : 整数（上限を含む）
+        {'float': [下限, 上限]} : 一様分布
+        {'log': [下限, 上限]}   : 対数一様分布
+    n_trials : int
+        候補の数
+    seed : int
+        乱数のシード
+    prune_rounds : int
+        run_search で打ち切りを判定する学習回数（0の場合は判定しない）
+    prune_scale_lr : boolean
+        run_search で判定する回数を学習率で補正する場合はTrue
+
+    Returns
+    ----------
+    trials : list
+        パラメータの候補（dictionary）のリスト
+
+    Example
+    ----------
+    使用方法：
+    trials = search_util.sample_params(
+        {'num_leaves': {'int': [15, 255]}, 'learning_rate': {'log': [0.01, 0.3]}}, 50)
+
+    '''
+    invalid = [name for name in space if name in DATASET_PARAMS]
+    if invalid:
+        raise ValueError('binning済みDatasetと共有できないパラメータです : '
+                         + str(invalid))
+
+    # 学習率の小さい候補は同じ学習回数では評価値が劣り、常に打ち切られる
+    if 'learning_rate' in space and prune_rounds and not prune_scale_lr:
+        raise ValueError('learning_rate を探索する場合は prune_rounds を0にするか、'
+                         'prune_scale_lr を指定してください')
+
+    rng = np.random.RandomState(seed)
+    trials = []
+    for _ in range(n_trials):
+        param = {}
+        for name, spec in space.items():
+            if isinstance(spec, dict):
+                kind, (low, high) = next(iter(spec.items()))
+                if kind == 'int':
+                    param[name] = int(rng.randint(low, high + 1))
+                elif kind == 'float':
+                    param[name] = float(rng.uniform(low, high))
+                elif kind == 'log':
+                    param[name] = float(math.exp(rng.uniform(math.log(low),
+                                                              math.log(high))))
+                else:
+                    raise ValueError('探索範囲の指定が不正です : ' + name)
+            else:
+                param[name] = spec[rng.randint(len(spec))]
+        trials.append(param)
+
+    return trials
+
+
+# ------------------------------------------------------------
+# [探索] 探索の実行
+# ------------------------------------------------------------
+def run_search(logger, train_set, fold_idx, base_param, trials, n_jobs=1,
+               num_round=10000, early_stopping_rounds=20,
+               prune_rounds=PRUNE_ROUNDS, prune_margin=PRUNE_MARGIN,
+               prune_scale_lr=False):
+    '''
+    パラメータの候補をKFoldで評価する
+    - n_jobs 個の候補を同時に評価し、1つ終わるごとに次の候補を投入する
+    - 投入時点の最良の候補の評価値を渡し、明らかに劣る候補は打ち切る
+    - 評価値は base_param の metric（小さいほど良いもの：rmse など）
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    train_set : Dataset
+        全データでbinning済みのDataset（feature_pre_filter=False で作成する）
+    fold_idx : list
+        foldごとの (trainの行番号, valの行番号)
+    base_param : dictionary
+        LightGBMの基本のパラメータ（候補のパラメータで上書きする）
+    trials : list
+        パラメータの候補のリスト
+    n_jobs : int
+        同時に評価する候補の数
+    num_round : int
+        学習の最大回数
+    early_stopping_rounds : int
+        early_stopping数
+    prune_rounds : int
+        最初のfoldで打ち切りを判定する学習回数（0の場合は判定しない）
+    prune_margin : float
+        最良の候補の評価値に対する許容幅（比率）
+    prune_scale_lr : boolean
+        Trueの場合、判定する学習回数を候補の学習率に反比例させる
+        （学習率を探索する場合に、同じ学習の進み具合で比較する）
+
+    Returns
+    ----------
+    results : list
+        候補ごとの評価結果（dictionary）
+
+    '''
+    global g_search_data
+
+    try:
+        # 計測開始
+        start = time.time()
+
+        logger.info('--[search_util：run_search]--------------------')
+        logger.info('TRIAL : ' + str(len(trials)))
+
+        # 子プロセスへ引き継ぐ探索データをセット
+        g_search_data = (train_set, fold_idx)
+
+        n_jobs = max(1, min(n_jobs, len(trials)))
+        nthread = max(1, multiprocessing.cpu_count() // n_jobs)
+        options = {'num_round': num_round,
+                   'early_stopping_rounds': early_stopping_rounds,
+                   'prune_rounds': prune_rounds, 'prune_margin': prune_margin,
+                   'prune_scale_lr': prune_scale_lr}
+
+        def make_param(param):
+            return dict(base_param, **param, nthread=nthread, verbosity=-1)
+
+        results = []
+        if n_jobs == 1:
+            for trial_no, param in enumerate(trials):
+                results.append(_run_trial(trial_no, make_param(param), param,
+                                          _reference(results), options))
+                _log_trial(logger, results[-1])
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    mp_context=multiprocessing.get_context('fork')) as executor:
+                pending = set()
+                queue = list(enumerate(trials))
+                while queue or pending:
+                    # 空いたプロセスに、その時点の最良の候補を基準にして投入する
+                    while queue and len(pending) < n_jobs:
+                        trial_no, param = queue.pop(0)
+                        pending.add(executor.submit(
+                            _run_trial, trial_no, make_param(param), param,
+                            _reference(results), options))
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results.append(future.result())
+                        _log_trial(logger, results[-1])
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        n_pruned = sum(result['status'] == 'pruned' for result in results)
+        logger.info('PRUNED: ' + str(n_pruned))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return sorted(results, key=lambda result: result['trial'])
+
+    finally:
+        g_search_data = None
+
+
+class TrialPruned(Exception):
+    '''
+    候補の評価を打ち切る場合の例外
+    '''
+
+
+def _reference(results):
+    '''
+    打ち切りの基準にする、最後まで評価した候補のうち最良のもの
+    '''
+    complete = [result for result in results if result['status'] == 'complete']
+    if not complete:
+        return None
+    return min(complete, key=lambda result: result['score'])
+
+
+def _run_trial(trial_no, param, searched, reference, options):
+    '''
+    1つの候補をKFoldで評価する（子プロセスで実行される）
+    '''
+    start = time.time()
+    train_set, fold_idx = g_search_data
+    result = {'trial': trial_no, 'status': 'complete', 'params': searched,
+              'fold_scores': [], 'round_score': None, 'best_iterations': []}
+
+    # 打ち切りを判定する学習回数（学習率で補正する場合は学習率に反比例させる）
+    prune_rounds = options['prune_rounds']
+    if prune_rounds and options['prune_scale_lr']:
+        prune_rounds = max(1, int(round(
+            prune_rounds * PRUNE_BASE_LR / param.get('learning_rate', PRUNE_BASE_LR))))
+
+    def prune_callback(env):
+        # 最初のfoldの prune_rounds 回目の評価値で判定する
+        if not prune_rounds or env.iteration + 1 != prune_rounds:
+            return
+        score = env.evaluation_result_list[0][2]
+        result['round_score'] = score
+        if reference is not None and reference['round_score'] is not None \
+                and score > reference['round_score'] * (1 + options['prune_margin']):
+            raise TrialPruned()
+
+    try:
+        for fold_, (trn_idx, val_idx) in enumerate(fold_idx):
+            train_data = train_set.subset(trn_idx)
+            val_data = train_set.subset(val_idx)
+            model = lgbm.train(param, train_data, options['num_round'],
+                               valid_sets=[val_data],
+                               feature_name=train_set.feature_name,
+                               categorical_feature=train_set.categorical_feature,
+                               callbacks=[prune_callback] if fold_ == 0 else None,
+                               verbose_eval=False,
+                               early_stopping_rounds=options['early_stopping_rounds'])
+            result['fold_scores'].append(
+                float(next(iter(model.best_score['valid_0'].values()))))
+            result['best_iterations'].append(int(model.best_iteration))
+
+            # foldごとの評価値の平均を、最良の候補の同じfold数の平均と比較する
+            n_fold = len(result['fold_scores'])
+            if reference is not None and n_fold < len(fold_idx) \
+                    and np.mean(result['fold_scores']) > \
+                    np.mean(reference['fold_scores'][:n_fold]) * (1 + options['prune_margin']):
+                raise TrialPruned()
+
+    except TrialPruned:
+        result['status'] = 'pruned'
+
+    result['score'] = float(np.mean(result['fold_scores'])) \
+        if result['fold_scores'] else float('nan')
+    result['seconds'] = time.time() - start
+
+    return result
+
+
+def _log_trial(logger, result):
+    '''
+    候補の評価結果を出力する
+    '''
+    logger.info('trial {:>4} {:<8} folds:{} score:{:.5f} {:.1f}[sec] {}'.format(
+        result['trial'], result['status'], len(result['fold_scores']),
+        result['score'], result['seconds'], json.dumps(result['params'])))
+
+
+# ------------------------------------------------------------
+# [探索] 順位表の出力
+# ------------------------------------------------------------
+def write_leaderboard(logger, results, model_dir):
+    '''
+    評価結果の順位表と、最良の候補のパラメータを出力する
+    - 最後まで評価した候補を評価値の順に並べ、打ち切った候補はその後に並べる
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    results : list
+        run_search の戻り値
+    model_dir : str
+        出力先（600_model/<time>/）
+
+    Returns
+    ----------
+    df_leaderboard : DataFrame
+        順位表
+
+    '''
+    try:
+        logger.info('--[search_util：write_leaderboard]--------------------')
+
+        df_leaderboard = pd.DataFrame({
+            'trial': [result['trial'] for result in results],
+            'status': [result['status'] for result in results],
+            'score': [result['score'] for result in results],
+            'folds': [len(result['fold_scores']) for result in results],
+            'best_iteration': [float(np.mean(result['best_iterations']))
+                               if result['best_iterations'] else float('nan')
+                               for result in results],
+            'seconds': [round(result['seconds'], 2) for result in results],
+            'params': [json.dumps(result['params']) for result in results],
+        })
+        df_leaderboard['is_pruned'] = df_leaderboard['status'] == 'pruned'
+        df_leaderboard = df_leaderboard.sort_values(
+            ['is_pruned', 'score']).drop(columns='is_pruned').reset_index(drop=True)
+        df_leaderboard.insert(0, 'rank', np.arange(1, len(df_leaderboard) + 1))
+
+        path = os.path.join(model_dir, LEADERBOARD_FILE_NAME)
+        logger.info('PATH  : ' + path)
+        df_leaderboard.to_csv(path, index=False)
+
+        # 最良の候補のパラメータ
+        best = _reference(results)
+        if best is not None:
+            with open(os.path.join(model_dir, BEST_PARAM_FILE_NAME), 'w') as json_file:
+                json.dump(best['params'], json_file, indent=2)
+            logger.info('BEST  : trial {} score:{:.5f}'.format(best['trial'],
+                                                               best['score']))
+
+    except Exception:
+        raise
+
+    else:
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return df_leaderboard
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】ハイパーパラメータ探索 Util関数  ★★★★★★
+# ------------------------------------------------------------
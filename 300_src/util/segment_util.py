@@ -0,0 +1,392 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】セグメント別モデル Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： 店舗・商品・店舗×商品のセグメントごとに LightGBM モデルを学習し、
+#            全体モデルと組み合わせて予測する
+#            - separate : セグメントのデータのみで学習したモデルで予測する
+#            - residual : 全体モデルの予測値を初期値とし、残差を学習する
+#            - 行数の少ないセグメントは全体モデルで予測する
+#            - 学習データが前回と同じセグメントは再学習せず、前回のモデルを使う
+# ------------------------------------------------------------
+# ライブラリのインポート
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from util import backtest_util
+from util import conv_util
+from util import feature_util
+from util import model_util
+
+# LightGBMは最初に使う時点で読み込む
+lgbm = conv_util.lazy_import('lightgbm')
+
+# セグメントの単位 → セグメントのキー
+SEGMENT_BY = {
+    'mise': ['group_mise'],
+    'item': ['group_item'],
+    'mise_item': ['group_mise', 'group_item'],
+}
+
+# セグメントの学習方法
+SEGMENT_MODES = ['separate', 'residual']
+
+# セグメント別モデルを学習する最小の行数（未満は全体モデルで予測する）
+MIN_ROWS = 200
+
+# セグメント別モデルの格納先（モデルのディレクトリ内）
+SEGMENT_DIR = 'segments'
+MANIFEST_NAME = 'segments.json'
+
+# 子プロセスへ引き継ぐ学習データ（forkで共有する）
+# (binning済みのDataset, 行ごとの経過日数, 学習の設定)
+g_segment_data = None
+
+# 読込済みのセグメント別モデル（モデルのディレクトリ → (manifest, モデルのdict)）
+g_segment_cache = {}
+
+
+# ------------------------------------------------------------
+# [セグメント] セグメントの作成
+# ------------------------------------------------------------
+def plan_segments(df, by, min_rows=MIN_ROWS):
+    '''
+    セグメントごとの行番号と行数を作成する（行数の多い順）
+
+    Parameters
+    ----------
+    df : DataFrame
+        学習データ
+    by : list
+        セグメントのキーのカラム名
+    min_rows : int
+        セグメント別モデルを学習する最小の行数
+
+    Returns
+    ----------
+    segments : list
+        セグメントごとの情報（dictionary）
+        key : キーの値のリスト
+        rows : 行番号
+        is_sparse : 全体モデルで予測するか
+
+    '''
+    codes, uniques = pd.MultiIndex.from_frame(df[by]).factorize()
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+    segments = []
+    for i, key in enumerate(uniques):
+        rows = order[bounds[i]:bounds[i + 1]]
+        segments.append({'key': [_to_json_value(value) for value in key],
+                         'rows': rows, 'is_sparse': len(rows) < min_rows})
+
+    # 大きいセグメントから投入し、プロセス間の負荷を揃える
+    return sorted(segments, key=lambda segment: -len(segment['rows']))
+
+
+def _to_json_value(value):
+    '''
+    キーの値をJSONに出力できる型に変換する
+    '''
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# ------------------------------------------------------------
+# [セグメント] 学習
+# ------------------------------------------------------------
+def train_segments(logger, train_set, df_key, dates, model_dir, param, mode='separate',
+                   by=SEGMENT_BY['mise_item'], min_rows=MIN_ROWS, n_jobs=1,
+                   horizon=backtest_util.HORIZON, base_dir=None):
+    '''
+    セグメントごとのモデルをプロセスプールで学習し、格納先に出力する
+    - セグメントは行数の多い順に投入し、空いたプロセスから次を学習する
+    - 各セグメントは学習期間の最後の horizon 日間でearly_stoppingする
+    - base_dir の前回の学習結果と学習データが同じセグメントは、
+      前回のモデルを複製して再学習しない
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    train_set : Dataset
+        全データでbinning済みのDataset
+        （residualの場合は全体モデルの予測値を init_score に設定する）
+    df_key : DataFrame
+        行ごとのセグメントのキー（train_set と同じ行順）
+    dates : Series
+        行ごとの日付
+    model_dir : str
+        出力先（600_model/<time>/）
+    param : dictionary
+        LightGBMのパラメーター
+    mode : str
+        'separate' または 'residual'
+    by : list
+        セグメントのキーのカラム名
+    min_rows : int
+        セグメント別モデルを学習する最小の行数
+    n_jobs : int
+        同時に学習するセグメント数
+    horizon : int
+        early_stopping用の検証期間の日数
+    base_dir : str
+        前回の学習結果の格納先（Noneの場合は全セグメントを学習する）
+
+    Returns
+    ----------
+    manifest : dictionary
+        セグメント別モデルの一覧
+
+    '''
+    global g_segment_data
+
+    try:
+        # 計測開始
+        start = time.time()
+
+        if mode not in SEGMENT_MODES:
+            raise ValueError('mode の指定が不正です : ' + str(mode))
+
+        logger.info('--[segment_util：train_segments]--------------------')
+        logger.info('MODE  : ' + mode + ' ' + str(by))
+
+        os.makedirs(os.path.join(model_dir, SEGMENT_DIR), exist_ok=True)
+        segments = plan_segments(df_key, by, min_rows)
+
+        # 前回の学習結果（学習データのハッシュ → モデルのファイル）
+        reuse = {}
+        if base_dir is not None and os.path.exists(os.path.join(base_dir, MANIFEST_NAME)):
+            with open(os.path.join(base_dir, MANIFEST_NAME)) as json_file:
+                base_manifest = json.load(json_file)
+            if base_manifest['mode'] == mode and base_manifest['by'] == list(by):
+                reuse = {segment['hash']: segment['file']
+                         for segment in base_manifest['segments'] if segment['file']}
+
+        # 子プロセスへ引き継ぐ学習データをセット
+        segment_param = dict(param, nthread=1)
+        g_segment_data = (train_set, feature_util.to_epoch_days(dates),
+                          segment_param, horizon)
+
+        # 学習データ以外で学習結果が変わる指定（パラメーター・モード・検証期間・特徴量）
+        train_spec = json.dumps({'param': segment_param, 'mode': mode, 'horizon': horizon,
+                                 'feature_name': train_set.feature_name},
+                                sort_keys=True, default=str)
+
+        # 学習データのハッシュが前回と同じセグメントは複製する
+        entries = []
+        tasks = []
+        for segment in segments:
+            entry = {'key': segment['key'], 'rows': int(len(segment['rows'])),
+                     'hash': _segment_hash(train_set, segment['rows'], train_spec),
+                     'file': None}
+            entries.append(entry)
+            if segment['is_sparse']:
+                continue
+            if entry['hash'] in reuse:
+                entry['file'] = reuse[entry['hash']]
+                shutil.copyfile(os.path.join(base_dir, SEGMENT_DIR, entry['file']),
+                                os.path.join(model_dir, SEGMENT_DIR, entry['file']))
+                continue
+            entry['file'] = entry['hash'] + '.model'
+            tasks.append((entry, segment['rows'],
+                          os.path.join(model_dir, SEGMENT_DIR, entry['file'])))
+
+        # 行数の多い順に投入する
+        n_jobs = max(1, min(n_jobs, len(tasks)))
+        if n_jobs == 1:
+            trained = [_train_segment(rows, path) for _, rows, path in tasks]
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = [executor.submit(_train_segment, rows, path)
+                           for _, rows, path in tasks]
+                trained = [future.result() for future in futures]
+
+        # 検証期間がなく学習できなかったセグメントは全体モデルで予測する
+        for (entry, _, _), is_trained in zip(tasks, trained):
+            if not is_trained:
+                entry['file'] = None
+
+        manifest = {'mode': mode, 'by': list(by), 'segments': entries}
+        with open(os.path.join(model_dir, MANIFEST_NAME), 'w') as json_file:
+            json.dump(manifest, json_file, ensure_ascii=False, indent=2)
+
+    except Exception:
+        raise
+
+    else:
+        # ログ出力
+        n_model = sum(entry['file'] is not None for entry in entries)
+        logger.info('SEGMENT: {} MODEL:{} TRAINED:{} REUSED:{} FALLBACK:{}'.format(
+            len(entries), n_model, sum(trained), n_model - sum(trained),
+            len(entries) - n_model))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return manifest
+
+    finally:
+        g_segment_data = None
+
+
+def _segment_hash(train_set, rows, train_spec):
+    '''
+    セグメントの学習データ（特徴量・ターゲット・初期値）と学習の指定のハッシュ
+    '''
+    digest = hashlib.md5(train_spec.encode('utf8'))
+    digest.update(np.ascontiguousarray(train_set.data[rows]).tobytes())
+    digest.update(np.ascontiguousarray(train_set.get_label()[rows]).tobytes())
+    init_score = train_set.get_init_score()
+    if init_score is not None:
+        digest.update(np.ascontiguousarray(init_score[rows]).tobytes())
+
+    return digest.hexdigest()
+
+
+def _train_segment(rows, path):
+    '''
+    1つのセグメントのモデルを学習して出力する（子プロセスで実行される）
+    '''
+    train_set, days, param, horizon = g_segment_data
+
+    # 学習期間の最後の horizon 日間で検証する
+    cutoff = int(days[rows].max()) - horizon
+    is_train = days[rows] <= cutoff
+    if is_train.all() or not is_train.any():
+        return False
+
+    model = lgbm.train(param,
+                       train_set.subset(rows[is_train]),
+                       10000,
+                       valid_sets=[train_set.subset(rows[~is_train])],
+                       feature_name=train_set.feature_name,
+                       categorical_feature=train_set.categorical_feature,
+                       verbose_eval=False,
+                       early_stopping_rounds=20)
+
+    with open(path, 'wb') as pickle_file:
+        pickle.dump(model, pickle_file)
+
+    return True
+
+
+# ------------------------------------------------------------
+# [セグメント] 予測
+# ------------------------------------------------------------
+def load_segments(logger, model_dir):
+    '''
+    セグメント別モデルの一覧とモデルを読み込む（プロセス内でキャッシュする）
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    model_dir : str
+        モデルの格納先
+
+    Returns
+    ----------
+    manifest : dictionary
+        セグメント別モデルの一覧（ない場合はNone）
+    models : dictionary
+        モデルのファイル名 → Booster
+
+    '''
+    key = os.path.abspath(model_dir)
+    if key in g_segment_cache:
+        return g_segment_cache[key]
+
+    path = os.path.join(model_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        g_segment_cache[key] = (None, {})
+        return g_segment_cache[key]
+
+    with open(path) as json_file:
+        manifest = json.load(json_file)
+
+    models = {}
+    for segment in manifest['segments']:
+        if segment['file'] and segment['file'] not in models:
+            with open(os.path.join(model_dir, SEGMENT_DIR, segment['file']),
+                      'rb') as pickle_file:
+                models[segment['file']] = pickle.load(pickle_file)
+
+    logger.info('SEGMENT: ' + path + ' MODEL:' + str(len(models)))
+    g_segment_cache[key] = (manifest, models)
+
+    return g_segment_cache[key]
+
+
+def predict_segments(logger, df_batch, model_dir, feature_col,
+                     chunk_size=model_util.CHUNK_SIZE):
+    '''
+    全体モデルとセグメント別モデルで予測する
+    - セグメント別モデルがない格納先は、全体モデル（foldアンサンブル）のみで予測する
+    - 学習時にないセグメント・行数の少ないセグメントは全体モデルで予測する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    df_batch : DataFrame
+        特徴量とセグメントのキーを含む予測対象のDataFrame
+    model_dir : str
+        モデルの格納先
+    feature_col : list
+        特徴量のカラム名
+    chunk_size : int
+        1度に予測する行数
+
+    Returns
+    ----------
+    preds : ndarray
+        予測値
+
+    '''
+    preds = model_util.predict_batch(logger, df_batch, model_dir, feature_col,
+                                     chunk_size)
+    manifest, models = load_segments(logger, model_dir)
+    if manifest is None:
+        return preds
+
+    by = manifest['by']
+    segments = [segment for segment in manifest['segments'] if segment['file']]
+    if not segments:
+        return preds
+
+    # 行ごとのセグメント（セグメント別モデルがない場合は-1）
+    segment_index = pd.MultiIndex.from_tuples(
+        [tuple(segment['key']) for segment in segments], names=by)
+    row_segment = segment_index.get_indexer(pd.MultiIndex.from_frame(df_batch[by]))
+    if not np.any(row_segment >= 0):
+        return preds
+
+    x_feature = model_util.to_feature_array(model_util.encode_features(
+        logger, df_batch[feature_col], model_dir))
+    for i in np.unique(row_segment[row_segment >= 0]):
+        rows = np.flatnonzero(row_segment == i)
+        model = models[segments[i]['file']]
+        segment_preds = model.predict(x_feature[rows],
+                                      num_iteration=model.best_iteration)
+        if manifest['mode'] == 'residual':
+            segment_preds = preds[rows] + segment_preds
+        preds[rows] = segment_preds
+
+    # 日販0以下を0に置換する
+    return np.where(preds > 0, preds, 0)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】セグメント別モデル Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,333 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】予測サーバ Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： asyncioによるHTTPサーバと、同時に届いた予測リクエストを
+#            1回の予測呼出にまとめるマイクロバッチ処理、応答時間の集計
+# ------------------------------------------------------------
+# ライブラリのインポート
+import asyncio
+import collections
+import json
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# マイクロバッチの最大行数・最大待ち時間[sec]
+MAX_BATCH = 256
+MAX_WAIT = 0.005
+
+# 応答時間を保持する件数（直近の件数で p50 / p99 を算出する）
+LATENCY_WINDOW = 10000
+
+# リクエストの最大サイズ[byte]
+MAX_BODY_BYTES = 1024 * 1024
+
+# HTTPステータス
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+# ------------------------------------------------------------
+# [サーバ] マイクロバッチ
+# ------------------------------------------------------------
+class MicroBatcher:
+    '''
+    同時に届いたリクエストの行をまとめて、1回の予測関数の呼出で予測する
+    - 最初の行が届いてから max_wait 秒、または max_batch 行に達するまで待つ
+    - 予測関数は専用のスレッド1本で実行し、イベントループを止めない
+      （予測中に届いたリクエストは次のバッチにまとまる）
+
+    Parameters
+    ----------
+    predict_fn : function
+        DataFrame を受け取り、行ごとの予測値（ndarray）を返す関数
+    max_batch : int
+        1バッチの最大行数
+    max_wait : float
+        バッチを待つ最大時間[sec]
+
+    Example
+    ----------
+    使用方法：
+    batcher = serve_util.MicroBatcher(predict_request)
+    preds = await batcher.predict(df_request)
+
+    '''
+
+    def __init__(self, predict_fn, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batch_count = 0
+        self.row_count = 0
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        '''
+        バッチ処理のタスクを開始する（イベントループ内で呼び出す）
+        '''
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        '''
+        バッチ処理のタスクを停止する
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    async def predict(self, df_request):
+        '''
+        リクエストの行を次のバッチに加え、予測値を待つ
+
+        Parameters
+        ----------
+        df_request : DataFrame
+            予測対象の行
+
+        Returns
+        ----------
+        preds : ndarray
+            予測値
+
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((df_request, future))
+        return await future
+
+    async def _run(self):
+        '''
+        キューからリクエストを取り出し、バッチごとに予測する
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            rows = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+
+            # 最大行数または最大待ち時間まで、後続のリクエストを集める
+            while rows < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                rows += len(item[0])
+
+            await self._predict_batch(loop, batch)
+
+    async def _predict_batch(self, loop, batch):
+        '''
+        バッチをまとめて予測し、リクエストごとに予測値を返す
+        '''
+        frames = [df_request for df_request, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            df_batch = pd.concat(frames, axis=0, ignore_index=True)
+            preds = await loop.run_in_executor(self._executor,
+                                               self.predict_fn, df_batch)
+        except Exception as error:
+            if len(batch) == 1:
+                if not futures[0].done():
+                    futures[0].set_exception(error)
+                return
+
+            # 不正なリクエストが他のリクエストを巻き込まないよう、1件ずつ予測し直す
+            for item in batch:
+                await self._predict_batch(loop, [item])
+            return
+
+        self.batch_count += 1
+        self.row_count += len(df_batch)
+
+        # リクエストごとの行数で予測値を分割する
+        bounds = np.cumsum([0] + [len(frame) for frame in frames])
+        for i, future in enumerate(futures):
+            if not future.done():
+                future.set_result(preds[bounds[i]:bounds[i + 1]])
+
+
+# ------------------------------------------------------------
+# [サーバ] 応答時間の集計
+# ------------------------------------------------------------
+class LatencyStats:
+    '''
+    直近 window 件の応答時間を保持し、p50 / p99 を算出する
+
+    Parameters
+    ----------
+    window : int
+        保持する件数
+
+    '''
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.count = 0
+        self._latencies = collections.deque(maxlen=window)
+
+    def add(self, seconds):
+        '''
+        応答時間[sec]を記録する
+        '''
+        self.count += 1
+        self._latencies.append(seconds)
+
+    def summary(self):
+        '''
+        応答時間の集計結果を返す
+
+        Returns
+        ----------
+        summary : dictionary
+            件数と、直近の応答時間の p50 / p99 / 最大[ms]
+
+        '''
+        if not self._latencies:
+            return {'count': self.count, 'p50_ms': None, 'p99_ms': None,
+                    'max_ms': None}
+
+        latencies = np.array(self._latencies) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99])
+        return {'count': self.count, 'p50_ms': round(float(p50), 3),
+                'p99_ms': round(float(p99), 3),
+                'max_ms': round(float(latencies.max()), 3)}
+
+
+# ------------------------------------------------------------
+# [サーバ] HTTPサーバの実行
+# ------------------------------------------------------------
+async def serve(logger, handler, host, port, stop_event):
+    '''
+    HTTP/1.1 サーバを起動し、stop_event がセットされるまで応答する
+    - keep-alive に対応し、接続ごとに複数のリクエストを処理する
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    handler : coroutine function
+        (method, path, query, body) を受け取り (status, 応答のdict) を返す関数
+    host : str
+        待ち受けるホスト
+    port : int
+        待ち受けるポート
+    stop_event : asyncio.Event
+        停止の合図
+
+    Returns
+    ----------
+    None
+
+    Example
+    ----------
+    使用方法：
+    await serve_util.serve(g_logger, handle_request, '127.0.0.1', 8080, stop_event)
+
+    '''
+    async def on_connect(reader, writer):
+        await _handle_connection(logger, handler, reader, writer)
+
+    server = await asyncio.start_server(on_connect, host, port)
+
+    logger.info('--[serve_util：serve]--------------------')
+    logger.info('LISTEN: http://' + host + ':' + str(port))
+    logger.info('------------------------------------')
+    logger.info('')
+
+    async with server:
+        await stop_event.wait()
+
+
+async def _handle_connection(logger, handler, reader, writer):
+    '''
+    1つの接続について、リクエストを読み込み応答を返す
+    '''
+    try:
+        while True:
+            request = await _read_request(reader)
+            if request is None:
+                break
+            method, target, headers, body = request
+
+            url = urllib.parse.urlsplit(target)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                status, response = await handler(method, url.path, query, body)
+            except Exception:
+                logger.exception('リクエストの処理で例外が発生しました : ' + target)
+                status, response = 500, {'error': 'internal error'}
+
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            _write_response(writer, status, response, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+
+    except ValueError as error:
+        # 不正なリクエスト
+        _write_response(writer, 400, {'error': str(error)}, False)
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+
+    finally:
+        writer.close()
+
+
+async def _read_request(reader):
+    '''
+    HTTPリクエストを読み込む（接続が閉じられた場合はNone）
+    '''
+    line = await reader.readline()
+    if not line:
+        return None
+
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError('不正なリクエスト行です')
+    method, target, _ = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError('リクエストが大きすぎます')
+    body = await reader.readexactly(length) if length > 0 else b''
+
+    return method.upper(), target, headers, body
+
+
+def _write_response(writer, status, response, keep_alive):
+    '''
+    JSON形式の応答を書き込む
+    '''
+    body = json.dumps(response, ensure_ascii=False).encode('utf8')
+    header = ('HTTP/1.1 ' + str(status) + ' ' + HTTP_STATUS.get(status, '') + '\r\n'
+              + 'Content-Type: application/json; charset=utf-8\r\n'
+              + 'Content-Length: ' + str(len(body)) + '\r\n'
+              + 'Connection: ' + ('keep-alive' if keep_alive else 'close') + '\r\n'
+              + '\r\n')
+    writer.write(header.encode('latin-1') + body)
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】予測サーバ Util関数  ★★★★★★
+# ------------------------------------------------------------
@@ -0,0 +1,256 @@
+# ------------------------------------------------------------
+# 処理名  ： 【共通】決定木 Util関数
+# 作成日  ： 2026.10.18
+# 処理概要： LightGBMのfoldモデルの木を1つのモデルに結合し、
+#            1回の予測でfoldアンサンブルの平均を算出する
+#            - 葉の値を 1/fold数 にして全foldの木を並べるため、
+#              予測値（木の葉の値の合計）が foldごとの予測値の平均になる
+#            - fold数分の Booster.predict の呼出（1回ごとの前処理）をなくし、
+#              少ない行数の予測（予測サーバ）を速くする
+#            - 出力変換のない目的関数（IDENTITY_OBJECTIVES）のみ結合できる
+# ------------------------------------------------------------
+# ライブラリのインポート
+import os
+import re
+import time
+
+import numpy as np
+
+from util import conv_util
+from util import model_util
+
+# アルゴリズム（最初に使う時点で読み込む）
+lgbm = conv_util.lazy_import('lightgbm')
+
+# 出力変換のない目的関数（予測値 = 葉の値の合計）
+IDENTITY_OBJECTIVES = ['regression', 'regression_l1', 'huber', 'fair',
+                       'quantile', 'mape']
+
+# 1度に予測する行数
+CHUNK_SIZE = 100000
+
+# 読込済みの結合モデル（モデルのディレクトリ → 結合モデル）
+g_merged_cache = {}
+
+
+# ------------------------------------------------------------
+# [決定木] 結合できるモデルの判定
+# ------------------------------------------------------------
+def get_objective(model):
+    '''
+    モデルの目的関数名（エイリアスはLightGBMが正規化した名前）
+
+    Parameters
+    ----------
+    model : Booster
+        学習済みモデル
+
+    Returns
+    ----------
+    objective : str
+        目的関数名（'regression' など）
+
+    '''
+    return model.dump_model(num_iteration=1).get(
+        'objective', 'regression').split(' ')[0]
+
+
+def is_mergeable(model):
+    '''
+    結合できるモデル（出力変換のない単一出力の目的関数、線形の葉なし）かを判定する
+
+    Parameters
+    ----------
+    model : Booster
+        学習済みモデル
+
+    Returns
+    ----------
+    mergeable : boolean
+        結合できる場合はTrue
+
+    '''
+    return get_objective(model) in IDENTITY_OBJECTIVES \
+        and model.params.get('num_class', 1) == 1 \
+        and not model.params.get('linear_tree', False)
+
+
+# ------------------------------------------------------------
+# [決定木] foldモデルの結合
+# ------------------------------------------------------------
+def merge_fold_models(models):
+    '''
+    foldモデルの木を1つのモデルに結合する
+    - 各foldの best_iteration までの木を、葉の値を 1/fold数 にして並べる
+    - 予測値は model_util.predict_folds（0以下の置換前）と一致する
+
+    Parameters
+    ----------
+    models : list
+        foldモデル（Booster）のリスト
+
+    Returns
+    ----------
+    merged : Booster
+        結合したモデル
+
+    Example
+    ----------
+    使用方法：
+    merged = tree_util.merge_fold_models(models)
+    preds = tree_util.predict_merged(merged, x_feature)
+
+    '''
+    for model in models:
+        if not is_mergeable(model):
+            raise ValueError('結合できない目的関数です : ' + get_objective(model))
+
+    header = None
+    footer = None
+    trees = []
+    for model in models:
+        text = model.model_to_string(num_iteration=model.best_iteration)
+        head, rest = text.split('\nTree=', 1)
+        body, tail = rest.split('\nend of trees', 1)
+        if header is None:
+            header, footer = head, tail
+        trees.extend(block.strip('\n') for block in
+                     re.split(r'\n(?=Tree=\d+\n)', 'Tree=' + body))
+
+    # 木の番号を振り直し、葉の値を 1/fold数 にする
+    scale = 1.0 / len(models)
+    blocks = []
+    for index, tree in enumerate(trees):
+        lines = tree.split('\n')
+        lines[0] = 'Tree=' + str(index)
+        for i, line in enumerate(lines):
+            if line.startswith('leaf_value='):
+                values = np.array(line[len('leaf_value='):].split(' '),
+                                  dtype=np.float64) * scale
+                lines[i] = 'leaf_value=' + ' '.join(repr(float(v)) for v in values)
+        blocks.append('\n'.join(lines))
+
+    # 木ごとのバイト数（tree_sizes）は木を並べ替えたため除く
+    header = '\n'.join(line for line in header.split('\n')
+                       if not line.startswith('tree_sizes='))
+
+    return lgbm.Booster(model_str=header + '\n' + '\n\n\n'.join(blocks)
+                        + '\n\n\nend of trees' + footer)
+
+
+# ------------------------------------------------------------
+# [決定木] 結合モデルによる予測
+# ------------------------------------------------------------
+def predict_merged(merged, x_feature, chunk_size=CHUNK_SIZE):
+    '''
+    結合モデルでfoldアンサンブルの平均を予測する
+    - 学習時と同様に0以下の予測値は0に置換する
+
+    Parameters
+    ----------
+    merged : Booster
+        結合したモデル（merge_fold_models の戻り値）
+    x_feature : ndarray
+        特徴量の配列（model_util.to_feature_array で変換したもの）
+    chunk_size : int
+        1度に予測する行数
+
+    Returns
+    ----------
+    preds : ndarray
+        予測値
+
+    '''
+    n = len(x_feature)
+    preds = np.zeros(n)
+
+    for begin in range(0, n, chunk_size):
+        end = min(begin + chunk_size, n)
+        preds[begin:end] = merged.predict(x_feature[begin:end])
+
+    # 日販0以下を0に置換する
+    return np.where(preds > 0, preds, 0)
+
+
+# ------------------------------------------------------------
+# [決定木] 結合モデルの読込
+# ------------------------------------------------------------
+def load_merged_model(logger, model_dir):
+    '''
+    foldモデルを読み込んで1つに結合する
+    - 結合したモデルはプロセス内でキャッシュし、2回目以降は再結合しない
+
+    Parameters
+    ----------
+    logger : logger object
+        ログ出力用のlogger
+    model_dir : str
+        foldモデルの格納先（600_model/<time>/）
+
+    Returns
+    ----------
+    merged : Booster
+        結合したモデル
+
+    Example
+    ----------
+    使用方法：
+    merged = tree_util.load_merged_model(g_logger, '../600_model/20201010120000/')
+
+    '''
+    key = os.path.abspath(model_dir)
+    if key in g_merged_cache:
+        return g_merged_cache[key]
+
+    try:
+        models = model_util.load_fold_models(logger, model_dir)
+
+        # 計測開始
+        start = time.time()
+
+        logger.info('--[tree_util：load_merged_model]--------------------')
+        logger.info('PATH  : ' + model_dir)
+
+        merged = merge_fold_models(models)
+
+    except Exception:
+        raise
+
+    else:
+        g_merged_cache[key] = merged
+
+        # ログ出力
+        logger.info('FOLD  : ' + str(len(models)))
+        logger.info('TREE  : ' + str(merged.num_trees()))
+        logger.info('TIME  : {:.2f}'.format(time.time() - start) + '[sec]')
+        logger.info('------------------------------------')
+        logger.info('')
+
+        return merged
+
+    finally:
+        pass
+
+
+# ------------------------------------------------------------
+# [決定木] キャッシュのクリア
+# ------------------------------------------------------------
+def clear_merged_cache():
+    '''
+    結合モデルのキャッシュをクリアする
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    ----------
+    None
+
+    '''
+    g_merged_cache.clear()
+
+
+# ------------------------------------------------------------
+# ★★★★★★  【共通】決定木 Util関数  ★★★★★★
+# ------------------------------------------------------------
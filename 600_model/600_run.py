@@ -10,7 +10,12 @@ import os
 import sys
 import traceback
 
+# 300_src のutilプログラムを参照する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '300_src'))
+
 from util import conv_util
+from util import pipeline_util
 
 # グローバル変数定義
 g_bt_ymd = ''
@@ -19,6 +24,46 @@ g_logger = None
 g_python_name = os.path.basename(__file__)
 g_list = [None] * conv_util.VAR_LIST_SIZE
 
+# パイプラインのステージ定義（600_model からの相対パス）
+# - inputs / outputs で依存関係と再実行の要否を判定する
+# - outputs が空のステージは常に実行する
+# - 特徴量の差分追記は manifest.json を更新するため、特徴量の入力に含める
+# - 特徴量の作成は差分更新の状態を毎回出力し、特徴量ストアは変更がある場合のみ
+#   出力するため、状態のファイルを出力とする
+STAGES = [
+    {
+        # 特徴量の作成
+        'name': 'make_features',
+        'script': '../300_src/320_make_features.py',
+        'inputs': ['../200_input/train.csv', '../200_input/test.csv'],
+        'outputs': ['../400_features/features_state.pkl'],
+    },
+    {
+        # 学習の実行（予測で使うモデルを latest_model.json に記録する）
+        'name': 'train_lightgbm',
+        'script': '../300_src/310_train_ligthbm.py',
+        'inputs': ['../400_features/features.feather',
+                   '../400_features/manifest.json'],
+        'outputs': ['../600_model/latest_model.json'],
+    },
+    {
+        # 予測の実行
+        'name': 'predict_lightgbm',
+        'script': '../300_src/510_predict_lightgbm_model.py',
+        'inputs': ['../400_features/features_forecast.feather',
+                   '../400_features/manifest.json',
+                   '../600_model/latest_model.json'],
+        'outputs': ['../500_output/predict.csv'],
+    },
+    {
+        # 階層予測の整合化
+        'name': 'reconcile_forecast',
+        'script': '../300_src/530_reconcile_forecast.py',
+        'inputs': ['../200_input/train.csv', '../500_output/predict.csv'],
+        'outputs': ['../500_output/reconcile.csv'],
+    },
+]
+
 
 # ------------------------------------------------------------
 # ★★★★★★  メイン処理部分  ★★★★★★
@@ -28,14 +73,13 @@ def main():
     # バッチ処理の記述
     try:
 
-        # 特徴量の作成
-        os.system('python ../●●.py')
-
-        # 特徴量の作成
-        os.system('python ../●●.py')
+        # ディレクトリのセット
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-        # 学習の実行
-        os.system('python ../510_predict_lightgbm_model.py')
+        # ステージのDAGを実行する（異常終了したステージで停止する）
+        pipeline_util.run_pipeline(g_logger, STAGES,
+                                   mode=g_par.PIPELINE_MODE,
+                                   max_workers=g_par.PIPELINE_N_JOBS)
 
     except Exception:
         # エラースタックを出力